@@ -0,0 +1,132 @@
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+from urllib.parse import urljoin, urlparse
+
+from bs4 import BeautifulSoup
+
+from extractor import etree, extract_html
+from spider import DEFAULT_EXTENSIONS
+
+# Micro-benchmark of the HTML extraction: the previous BeautifulSoup code (kept below as the baseline)
+# against the single-pass extractor, with lxml and with html.parser.
+# Runs over a directory of saved pages (--corpus), or over generated pages when none is given.
+# Reports the mean parse time per page and the peak memory traced by tracemalloc while parsing one page.
+
+# problem: Images or links might be stored in attributes other than <img src>
+# solution: Extract images from custom attributes like data-src, div style, CSS styles...
+def is_valid_image_url(url, image_formats):
+    return url and any(url.lower().endswith(ext) for ext in image_formats)
+
+def legacy_extract_image_urls(soup, base_url, image_formats):
+    image_urls = []
+    
+    def process_and_add(url):
+        full_url = urljoin(base_url, url)
+        if is_valid_image_url(full_url, image_formats):
+            image_urls.append(full_url)
+    
+    # Standard <img> tags
+    for img_tag in soup.find_all("img"):
+        process_and_add(img_tag.get("src"))
+    
+    # <source> in <picture> or <video>
+    for source in soup.find_all('source', srcset=True):
+        process_and_add(source['srcset'])
+    
+    # Meta og:image
+    for meta in soup.find_all('meta', property="og:image", content=True):
+        process_and_add(meta['content'])
+    
+    # Link icons
+    for link in soup.find_all('link', href=True):
+        process_and_add(link['href'])
+    
+    # Inline styles
+    for div in soup.find_all("div", style=True):
+        style = div.get("style")
+        if "background-image" in style:
+            url = style.split("url(")[1].split(")")[0].strip("'\"")
+            process_and_add(url)
+    
+    # Custom attributes
+    for tag in soup.find_all(attrs={"data-src": True}):
+        process_and_add(tag['data-src'])
+    
+    return image_urls
+
+def legacy_extract_html(html, url, image_formats):
+    soup = BeautifulSoup(html, "html.parser")
+    image_urls = legacy_extract_image_urls(soup, url, image_formats)
+    next_urls = []
+    for tag, attr in (("a", "href"), ("script", "src"), ("link", "href")):
+        for link_tag in soup.find_all(tag, **{attr: True}):
+            next_url = urljoin(url, link_tag[attr])
+            if urlparse(next_url).netloc == urlparse(url).netloc:
+                next_urls.append(next_url)
+    return image_urls, next_urls
+
+def generated_page(index, links=200, images=100):
+    parts = ["<html><head><style>.hero { background-image: url('/img/hero.png') }</style>",
+             '<meta property="og:image" content="/img/og.jpg"><link rel="icon" href="/favicon.png">',
+             '<script src="/static/app.js"></script></head><body>']
+    for i in range(links):
+        parts.append(f'<p>Paragraph {i} with <a href="/page/{index}/{i}.html">a link</a> and '
+                     f'<a href="https://external.example/{i}">another</a>.</p>')
+    for i in range(images):
+        parts.append(f'<div style="background-image: url(/img/bg{i}.jpg)"><img src="/img/{i}.jpg" '
+                     f'srcset="/img/{i}-1x.jpg 1x, /img/{i}-2x.jpg 2x" data-src="/img/lazy{i}.png"></div>')
+    parts.append("</body></html>")
+    return "".join(parts)
+
+def load_corpus(corpus, pages):
+    if corpus is None:
+        return [generated_page(i) for i in range(pages)]
+    documents = []
+    for path in sorted(glob.glob(os.path.join(corpus, "*.htm*"))):
+        with open(path, "rb") as file:
+            documents.append(file.read().decode("utf-8", errors="replace"))
+    return documents
+
+def measure(extract, documents, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for html in documents:
+            extract(html, "http://example.com/index.html", DEFAULT_EXTENSIONS)
+    per_page = (time.perf_counter() - start) / (repeats * len(documents))
+
+    peak = 0
+    for html in documents:
+        tracemalloc.start()
+        extract(html, "http://example.com/index.html", DEFAULT_EXTENSIONS)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return per_page, peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML link/image extraction.")
+    parser.add_argument("--corpus", help="Directory of saved .html pages (default: generated pages).")
+    parser.add_argument("--pages", type=int, default=20, help="Number of generated pages without --corpus (default: 20).")
+    parser.add_argument("--repeats", type=int, default=5, help="Passes over the corpus (default: 5).")
+    args = parser.parse_args()
+
+    documents = load_corpus(args.corpus, args.pages)
+    if not documents:
+        parser.error(f"no .html files in {args.corpus}")
+
+    extractors = [("beautifulsoup", legacy_extract_html),
+                  ("html.parser", lambda html, url, formats: extract_html(html, url, formats, use_lxml=False))]
+    if etree is not None:
+        extractors.append(("lxml", extract_html))
+
+    print(f"{len(documents)} pages, {sum(map(len, documents)) / len(documents) / 1024:.0f} KiB on average")
+    baseline = None
+    for name, extract in extractors:
+        per_page, peak = measure(extract, documents, args.repeats)
+        baseline = baseline or per_page
+        print(f"{name:14} {per_page * 1000:8.2f} ms/page  {peak / 1024:8.0f} KiB peak  {baseline / per_page:5.1f}x")
+
+if __name__ == "__main__":
+    main()
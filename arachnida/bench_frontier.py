@@ -0,0 +1,51 @@
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+from frontier import SpillingFrontier, VisitedUrls
+from spider import peak_rss_mib
+
+# Memory benchmark of the crawl bookkeeping: push N URLs through a visited set and a frontier the way crawl_site does
+# (mark visited, queue, later take it out again), with the plain dict + PriorityQueue the crawler used before and with
+# VisitedUrls + SpillingFrontier. Each variant runs in its own process so the peak RSS it reports is its own.
+
+def synthetic_urls(count):
+    for i in range(count):
+        yield f"https://www.example.com/catalog/section-{i % 997}/item-{i}.html?ref=listing&page={i % 50}"
+
+async def drain(frontier, count):
+    for _ in range(count):
+        await frontier.get()
+        frontier.task_done()
+
+def run(variant, count, memory_limit, results):
+    if variant == "dict + PriorityQueue":
+        visited, frontier = {}, asyncio.PriorityQueue()
+    else:
+        visited, frontier = VisitedUrls(), SpillingFrontier(memory_limit)
+
+    start = time.perf_counter()
+    for i, url in enumerate(synthetic_urls(count)):
+        if visited.get(url, 1 << 16) > i % 10:
+            visited[url] = i % 10
+            frontier.put_nowait((i % 10, url))
+    asyncio.run(drain(frontier, count))
+    results.put((variant, time.perf_counter() - start, peak_rss_mib()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark visited set and frontier memory for large crawls.")
+    parser.add_argument("--urls", type=int, default=1_000_000, help="Number of URLs (default: 1000000).")
+    parser.add_argument("--frontier-memory", type=int, default=100_000, help="URLs kept in memory before spilling (default: 100000).")
+    args = parser.parse_args()
+
+    results = multiprocessing.Queue()
+    for variant in ("dict + PriorityQueue", "VisitedUrls + SpillingFrontier"):
+        process = multiprocessing.Process(target=run, args=(variant, args.urls, args.frontier_memory, results))
+        process.start()
+        variant, elapsed, rss = results.get()
+        process.join()
+        print(f"{variant:32} {args.urls} URLs in {elapsed:6.2f}s, peak RSS {rss:6.0f} MiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import os
+import tempfile
+import time
+
+import exifread
+from metadata_cache import MetadataCache
+from metadata_reader import read_tags
+from sample_images import make_corpus
+from scorpion import iter_image_files, scan
+
+# Per-file latency of scorpion's metadata reading: exifread.process_file as scorpion called it before, against the
+# mmap header reader in full mode, with --fast and with --tags. Runs on a generated corpus of JPEG/PNG/GIF files with
+# a MakerNote, a thumbnail and `--payload` bytes of image data each, or on a directory of real images.
+# Then a recursive scan of a tree of `--tree` small files without the metadata cache, and twice with it (the second
+# time every file is unchanged).
+
+def legacy(path):
+    with open(path, "rb") as file:
+        return exifread.process_file(file)
+
+VARIANTS = {
+    "exifread.process_file": legacy,
+    "read_tags": read_tags,
+    "read_tags --fast": lambda path: read_tags(path, details=False),
+    "read_tags --tags Make,Model": lambda path: read_tags(path, {"Make", "Model"}, details=False),
+}
+
+def timed(read, paths, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for path in paths:
+            read(path)
+    return (time.perf_counter() - start) / (rounds * len(paths))
+
+def timed_scan(root, cache_path=None):
+    cache = MetadataCache(cache_path) if cache_path else None
+    start = time.perf_counter()
+    count = sum(1 for _ in scan(iter_image_files(root), 1, cache=cache))
+    if cache is not None:
+        cache.prune(root)
+        cache.close()
+    return count, time.perf_counter() - start
+
+def bench_rescan(directory, files):
+    root = os.path.join(directory, "tree")
+    for i in range(0, files, 1000):
+        make_corpus(os.path.join(root, f"dir{i // 1000}"), min(1000, files - i), payload=1024)
+    cache_path = os.path.join(directory, "index.sqlite")
+    for name, path in (("no cache", None), ("cache, first scan", cache_path), ("cache, unchanged", cache_path)):
+        count, elapsed = timed_scan(root, path)
+        print(f"{name:30} {count} files in {elapsed:6.2f}s  ({elapsed / count * 1e6:6.1f} us/file)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scorpion's metadata reading.")
+    parser.add_argument("--files", type=int, default=60, help="Number of generated files (default: 60).")
+    parser.add_argument("--payload", type=int, default=8 * 1024 * 1024, help="Bytes of image data per generated file (default: 8 MiB).")
+    parser.add_argument("--rounds", type=int, default=5, help="Passes over the corpus per variant (default: 5).")
+    parser.add_argument("--corpus", help="Directory of images to use instead of generated ones.")
+    parser.add_argument("--tree", type=int, default=20_000, help="Files in the re-scan benchmark tree (default: 20000, 0 to skip).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.corpus:
+            paths = [path for path, _ in iter_image_files(args.corpus)]
+        else:
+            paths = make_corpus(directory, args.files, args.payload)
+
+        baseline = None
+        for name, read in VARIANTS.items():
+            latency = timed(read, paths, args.rounds)
+            baseline = baseline or latency
+            print(f"{name:30} {latency * 1000:8.3f} ms/file  ({baseline / latency:5.1f}x)")
+        if args.tree:
+            bench_rescan(directory, args.tree)
+
+if __name__ == "__main__":
+    main()
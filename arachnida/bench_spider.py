@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+
+from crawl_state import CrawlState
+from sample_images import camera_tiff, png_bytes
+from scorpion import iter_image_files, scan
+from spider import DEFAULT_EXTENSIONS, MetadataSidecar, crawl_page, crawl_site, download_images, make_session
+
+# Benchmark of the serial crawler against the concurrent pipeline, crawl and image downloads included.
+# A local threaded HTTP server serves a synthetic site: page i links to the next `fanout` pages (wrapping around,
+# so the link graph has cycles) and references one PNG image of about `image_size` bytes, with an eXIf chunk naming
+# "Model <page>" and holding GPS tags on even pages. Pages are padded with paragraphs
+# (each linking back to the page) up to `page_size` bytes to make parsing cost realistic. Every response is delayed by
+# `latency` seconds to simulate a real network round-trip.
+# Every `json_every`-th page is a JSON document ({"links": [...], "image": ...}) and every `text_every`-th a plain text
+# page listing absolute URLs, so the other extractors get their share; every `slow_every`-th response takes
+# `slow_latency` seconds more, like the few slow pages a real site has.
+# --workers runs the concurrent crawl once per given number of parser processes, to see how parsing scales with cores.
+# --metadata compares a crawl followed by a scorpion scan of the output dir with a crawl writing the metadata sidecar.
+
+def synthetic_site_handler(pages, fanout, latency, image_size=1024, page_size=0, json_every=0, text_every=0,
+                           slow_every=0, slow_latency=0.5):
+    # page 0, the start page, is always HTML
+    def page_kind(page):
+        if json_every and page % json_every == json_every - 1:
+            return "json"
+        if text_every and page % text_every == text_every - 1:
+            return "txt"
+        return "html"
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        head_only = False
+
+        def do_HEAD(self):
+            self.head_only = True
+            try:
+                self.do_GET()
+            finally:
+                self.head_only = False
+
+        def do_GET(self):
+            number = self.path.strip("/").split("/")[-1].split(".")[0]
+            slow = slow_every and number.isdigit() and int(number) % slow_every == slow_every - 1
+            time.sleep(latency + (slow_latency if slow else 0))
+            if self.path.startswith("/img/"):
+                # every image has distinct content, so the image store keeps them all
+                page = self.path[5:].split(".")[0]
+                tiff = camera_tiff(model=f"Model {page}", gps=page.isdigit() and int(page) % 2 == 0,
+                                   maker_note_size=0, thumbnail_size=0)
+                self.send_body(png_bytes(tiff, payload=max(image_size - len(tiff) - 70, 0)), "image/png")
+                return
+            try:
+                page = int(self.path.strip("/").split(".")[0] or 0)
+            except ValueError:
+                self.send_error(404)
+                return
+            etag = f'"page-{page}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            targets = [(page + i) % pages for i in range(1, fanout + 1)]
+            kind = page_kind(page)
+            if kind == "json":
+                body = json.dumps({"page": page, "image": f"/img/{page}.png",
+                                   "links": [f"/{target}.{page_kind(target)}" for target in targets]}).encode()
+                self.send_body(body, "application/json", etag)
+                return
+            if kind == "txt":
+                base = f"http://{self.headers['Host']}"
+                lines = [f"{base}/img/{page}.png"] + [f"{base}/{target}.{page_kind(target)}" for target in targets]
+                self.send_body("\n".join(lines).encode(), "text/plain", etag)
+                return
+            links = "".join(f'<a href="/{target}.{page_kind(target)}">p</a>' for target in targets)
+            filler = f'<p>Lorem ipsum dolor sit amet, <a href="/{page}.html">consectetur</a> adipiscing elit.</p>'
+            body = f'<html><body><img src="/img/{page}.png">{links}{filler * (page_size // len(filler))}</body></html>'.encode()
+            self.send_body(body, "text/html", etag)
+
+        def send_body(self, body, content_type, etag=None):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            if etag:
+                self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if not self.head_only:
+                self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def start_server(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+# the benchmark runs the server in its own process, so serving pages doesn't compete with the crawler for the GIL
+def serve(handler_args, port_queue):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), synthetic_site_handler(*handler_args))
+    server.daemon_threads = True
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+def start_server_process(*handler_args):
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(handler_args, port_queue), daemon=True)
+    process.start()
+    return process, port_queue.get()
+
+def timed(fn):
+    start = time.perf_counter()
+    with redirect_stdout(StringIO()):
+        result = fn()
+    return result, time.perf_counter() - start
+
+def serial_run(start_url, max_depth, output_dir):
+    session = make_session(1)
+    image_urls = crawl_page(start_url, output_dir, DEFAULT_EXTENSIONS, set(), 0, max_depth, session)
+    download_images(set(image_urls), output_dir, session)
+    return image_urls
+
+def concurrent_run(start_url, max_depth, output_dir, args, workers):
+    state = CrawlState(output_dir)
+    try:
+        run = lambda: asyncio.run(crawl_site(
+            start_url, DEFAULT_EXTENSIONS, max_depth, args.concurrency, args.concurrency, output_dir=output_dir,
+            download_workers=args.download_workers, state=state, workers=workers))
+        image_urls, elapsed = timed(run)
+        # second run over the unchanged site: every page is a 304 and every image is already in the store
+        _, recrawl_elapsed = timed(run)
+    finally:
+        state.close()
+    return image_urls, elapsed, recrawl_elapsed
+
+def metadata_runs(start_url, max_depth, args):
+    crawl = lambda output_dir, sidecar=None: asyncio.run(crawl_site(
+        start_url, DEFAULT_EXTENSIONS, max_depth, args.concurrency, args.concurrency, output_dir=output_dir,
+        download_workers=args.download_workers, sidecar=sidecar))
+    def crawl_then_scan(output_dir):
+        image_urls = crawl(output_dir)
+        for _ in scan(iter_image_files(output_dir), args.download_workers, use_threads=True):
+            pass
+        return image_urls
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        image_urls, separate = timed(lambda: crawl_then_scan(output_dir))
+    with tempfile.TemporaryDirectory() as output_dir:
+        sidecar = MetadataSidecar(output_dir)
+        _, in_process = timed(lambda: crawl(output_dir, sidecar))
+        sidecar.close()
+    return image_urls, separate, in_process
+
+def report(name, image_urls, pages, elapsed, baseline):
+    print(f"{name:22} {len(set(image_urls))} images, {elapsed:6.2f}s, {pages / elapsed:7.1f} pages/sec, "
+          f"{baseline / elapsed:5.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the serial and concurrent spider against a local site.")
+    parser.add_argument("--pages", type=int, default=200, help="Number of pages in the synthetic site (default: 200).")
+    parser.add_argument("--fanout", type=int, default=3, help="Links per page (default: 3).")
+    parser.add_argument("--latency", type=float, default=0.02, help="Per-response delay in seconds (default: 0.02).")
+    parser.add_argument("--image-size", type=int, default=64 * 1024, help="Size of each image in bytes (default: 65536).")
+    parser.add_argument("--page-size", type=int, default=16 * 1024, help="Approximate size of each page in bytes (default: 16384).")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent fetchers for the async crawler (default: 16).")
+    parser.add_argument("--download-workers", type=int, default=8, help="Concurrent image downloaders (default: 8).")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0], help="Parser process counts to compare (default: 0).")
+    parser.add_argument("--metadata", action="store_true", help="Also compare crawl + scorpion with the in-process metadata sidecar.")
+    args = parser.parse_args()
+
+    server, port = start_server_process(args.pages, args.fanout, args.latency, args.image_size, args.page_size)
+    start_url = f"http://127.0.0.1:{port}/0.html"
+    max_depth = args.pages
+
+    try:
+        with tempfile.TemporaryDirectory() as serial_dir:
+            serial_images, serial_time = timed(lambda: serial_run(start_url, max_depth, serial_dir))
+        report("serial", serial_images, args.pages, serial_time, serial_time)
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as output_dir:
+                image_urls, elapsed, recrawl_elapsed = concurrent_run(start_url, max_depth, output_dir, args, workers)
+            report(f"concurrent, {workers} workers", image_urls, args.pages, elapsed, serial_time)
+            report(f"re-crawl, {workers} workers", image_urls, args.pages, recrawl_elapsed, serial_time)
+        if args.metadata:
+            image_urls, separate, in_process = metadata_runs(start_url, max_depth, args)
+            report("crawl, then scorpion", image_urls, args.pages, separate, serial_time)
+            report("crawl with sidecar", image_urls, args.pages, in_process, serial_time)
+    finally:
+        server.terminate()
+
+if __name__ == "__main__":
+    main()
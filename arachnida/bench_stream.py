@@ -0,0 +1,180 @@
+import argparse
+import json
+import multiprocessing
+import re
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from urllib.parse import urlparse
+
+from extractor import extract_html
+from spider import DEFAULT_EXTENSIONS, MAX_PAGE_SIZE, extract_links_from_json, fetch_page, make_session, same_host
+
+# Memory and bandwidth benchmark of the page fetch on large assets: the previous fetch (kept below as the baseline),
+# which reads every response whole through response.text, against the streamed and size-bounded one.
+# A local server (in its own process) serves a start page linking to one asset of each kind, all about `asset_size`
+# bytes: a script and a stylesheet (as <script src> and <link href>), a text file and a JSON document full of
+# image URLs, a longer HTML page, a video and an archive. Both fetches crawl the site one page at a time.
+# Reports the bytes the server sent, the peak memory traced by tracemalloc, the time and the image URLs found.
+
+def asset_bodies(host, asset_size):
+    def fill(line, kind):
+        count = asset_size // len(line.format(kind=kind, i=0)) + 1
+        return "".join(line.format(kind=kind, i=i) for i in range(count)).encode()
+    return {
+        "/app.js": (fill(f'var image{{i}} = "http://{host}/img/{{kind}}-{{i}}.png"; render(image{{i}});\n', "js"),
+                    "application/javascript"),
+        "/style.css": (fill('.icon-{i} {{ background: url("/img/{kind}-{i}.png") no-repeat }}\n', "css"), "text/css"),
+        "/data.txt": (fill(f"http://{host}/img/{{kind}}-{{i}}.png and http://{host}/index.html\n", "txt"),
+                      "text/plain"),
+        "/data.json": (b'{"items": [' + fill('{{"image": "/img/{kind}-{i}.png", "rank": {i}}}, ', "json")
+                       + b'{"image": "/img/json-last.png"}]}', "application/json"),
+        "/big.html": (b"<html><body>" + fill('<p><img src="/img/{kind}-{i}.png"> lorem ipsum</p>', "html")
+                      + b"</body></html>", "text/html"),
+        "/video.mp4": (bytes(asset_size), "video/mp4"),
+        "/archive.zip": (bytes(asset_size), "application/zip"),
+    }
+
+START_PAGE = (b'<html><head><script src="/app.js"></script><link rel="stylesheet" href="/style.css"></head><body>'
+              b'<a href="/data.txt">text</a> <a href="/data.json">json</a> <a href="/big.html">html</a> '
+              b'<a href="/video.mp4">video</a> <a href="/archive.zip">archive</a></body></html>')
+
+# bytes_sent is a shared counter (multiprocessing.Value) of the body bytes written to the sockets
+def large_asset_handler(asset_size, bytes_sent):
+    bodies = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def body(self):
+            if not bodies:
+                bodies.update(asset_bodies(self.headers["Host"], asset_size))
+            if self.path in ("/", "/index.html"):
+                return START_PAGE, "text/html"
+            if self.path.startswith("/img/"):
+                return b"\x89PNG\r\n\x1a\n", "image/png"
+            return bodies.get(self.path, (None, None))
+
+        def send_headers(self):
+            body, content_type = self.body()
+            if body is None:
+                self.send_error(404)
+                return None
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            return body
+
+        def do_HEAD(self):
+            self.send_headers()
+
+        def do_GET(self):
+            body = self.send_headers()
+            if body is None:
+                return
+            view = memoryview(body)
+            for start in range(0, len(body), 64 * 1024):
+                self.wfile.write(view[start:start + 64 * 1024])
+                with bytes_sent.get_lock():
+                    bytes_sent.value += len(view[start:start + 64 * 1024])
+
+        # the streamed fetch closes the connection as soon as it has read what it wants
+        def handle(self):
+            try:
+                super().handle()
+            except ConnectionError:
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def serve(asset_size, bytes_sent, port_queue):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), large_asset_handler(asset_size, bytes_sent))
+    server.daemon_threads = True
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+# the fetch before streaming, kept as the baseline: the whole response is read, decoded if it is text, then parsed
+def legacy_fetch_page(session, url, image_formats):
+    response = session.get(url, timeout=10)
+    response.raise_for_status()
+    content_type = response.headers.get("Content-Type", "")
+    text = response.text if content_type.startswith(("text/", "application/json")) else ""
+    netloc = urlparse(url).netloc
+    if "text/html" in content_type:
+        return extract_html(text, url, image_formats)
+    if "text/plain" in content_type:
+        found_links = re.findall(r'https?://[^\s"]+', text)
+        image_urls = re.findall(r'https?://[^\s"]+\.(?:jpg|jpeg|png|gif|bmp)', text)
+        return image_urls, [link for link in found_links if same_host(link, netloc)]
+    if "application/json" in content_type:
+        found_links = extract_links_from_json(json.loads(text), base_url=url)
+        return ([link for link in found_links if link.endswith(tuple(image_formats))],
+                [link for link in found_links if same_host(link, netloc)])
+    if content_type.startswith("image/"):
+        return [url], []
+    return [], []
+
+def streamed_fetch_page(session, url, image_formats, max_size):
+    page = fetch_page(session, url, 0, image_formats, max_size=max_size)
+    return (page.image_urls, page.next_urls) if page is not None else ([], [])
+
+# every page reachable from the start page, one at a time; returns (pages fetched, image URLs found)
+def crawl(fetch, start_url):
+    seen = {start_url}
+    queue = [start_url]
+    image_urls = set()
+    while queue:
+        found_images, next_urls = fetch(queue.pop())
+        image_urls.update(found_images)
+        for next_url in next_urls:
+            if next_url not in seen and "/img/" not in next_url:
+                seen.add(next_url)
+                queue.append(next_url)
+    return len(seen), image_urls
+
+def measure(fetch, start_url, bytes_sent):
+    bytes_sent.value = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    with redirect_stdout(StringIO()):
+        pages, image_urls = crawl(fetch, start_url)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # the server may still be writing into a socket the client closed
+    time.sleep(0.2)
+    return pages, len(image_urls), bytes_sent.value, peak, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the memory and bandwidth of the whole-response and streamed page fetches.")
+    parser.add_argument("--asset-size", type=int, default=16 * 1024 * 1024, help="Size of each large asset in bytes (default: 16777216).")
+    parser.add_argument("--max-page-size", type=int, default=MAX_PAGE_SIZE, help=f"max_size of the streamed fetch (default: {MAX_PAGE_SIZE}).")
+    args = parser.parse_args()
+
+    bytes_sent = multiprocessing.Value("q", 0)
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(args.asset_size, bytes_sent, port_queue), daemon=True)
+    server.start()
+    start_url = f"http://127.0.0.1:{port_queue.get()}/index.html"
+    session = make_session(1)
+    fetches = {
+        "whole response": lambda url: legacy_fetch_page(session, url, DEFAULT_EXTENSIONS),
+        "streamed": lambda url: streamed_fetch_page(session, url, DEFAULT_EXTENSIONS, args.max_page_size),
+    }
+    try:
+        for name, fetch in fetches.items():
+            pages, images, sent, peak, elapsed = measure(fetch, start_url, bytes_sent)
+            print(f"{name:15} {pages} pages, {images:7} image URLs, {sent / 2 ** 20:8.1f} MiB sent, "
+                  f"peak {peak / 2 ** 20:7.1f} MiB traced, {elapsed:6.2f}s")
+    finally:
+        session.close()
+        server.terminate()
+
+if __name__ == "__main__":
+    main()
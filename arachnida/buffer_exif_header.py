@@ -0,0 +1,48 @@
+import struct
+from exifread.core.exif_header import ExifHeader
+from exifread.core.find_exif import get_endian_str
+from exifread.tags.makernote.canon import CAMERA_INFO_TAG_NAME
+
+# file-like view over a buffer for ExifHeader: it seeks and reads a few bytes at a time, so nothing is copied in bulk
+class BufferReader:
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+
+    def seek(self, pos, whence=0):
+        self.pos = pos if whence == 0 else self.pos + pos if whence == 1 else len(self.view) + pos
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else self.pos + size
+        data = bytes(self.view[self.pos:end])
+        self.pos += len(data)
+        return data
+
+UNPACK_FORMATS = {(1, False): "B", (1, True): "b", (2, False): "H", (2, True): "h", (4, False): "I", (4, True): "i",
+                  (8, False): "Q", (8, True): "q"}
+BYTE_FIELD_TYPES = (1, 7)  # BYTE, UNDEFINED
+
+# ExifHeader reading straight from the buffer: exifread reads MakerNotes and thumbnails one byte per seek + read + unpack,
+# which takes longer than everything else in a file; here byte fields are sliced in one go and numbers unpacked in place
+class BufferExifHeader(ExifHeader):
+    def __init__(self, view, endian, offset, details):
+        super().__init__(BufferReader(view), endian, offset, 0, strict=False, detailed=details)
+        self.view = view
+        self.prefix = "<" if endian == "I" else ">"
+
+    def s2n(self, offset, length, signed=False):
+        pos = self.offset + offset
+        if pos < 0 or pos + length > len(self.view):
+            return 0
+        return struct.unpack_from(self.prefix + UNPACK_FORMATS[(length, signed)], self.view, pos)[0]
+
+    def _process_field(self, tag_name, count, field_type, type_length, offset):
+        if field_type not in BYTE_FIELD_TYPES or (count >= 1000 and tag_name not in ("MakerNote", CAMERA_INFO_TAG_NAME)):
+            return super()._process_field(tag_name, count, field_type, type_length, offset)
+        pos = self.offset + offset
+        values = list(self.view[pos:pos + count]) if 0 <= pos else []
+        return values + [0] * (count - len(values))
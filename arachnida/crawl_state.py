@@ -0,0 +1,93 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+
+STATE_FILENAME = ".spider_state.sqlite"
+
+# what the crawler keeps of a fetched page: the extracted URLs plus the validators needed to ask the server if it changed
+Page = namedtuple("Page", "image_urls next_urls etag last_modified content_type")
+
+# Persistent crawl state, kept in a SQLite file next to the downloaded images.
+# problem: every run starts from an empty visited set and refetches and re-parses every page
+# solution: remember ETag / Last-Modified / Content-Type and the extracted links and image URLs of each page,
+# so a re-crawl can send If-None-Match / If-Modified-Since and reuse the cached extraction on a 304 Not Modified.
+# problem: a crash in the middle of a long crawl loses all progress
+# solution: the frontier of the current run is saved as well (run table: url, depth, done). A page and the links it
+# queued are committed together, so after a crash the next run picks up the pages that were still pending.
+class CrawlState:
+    def __init__(self, state_dir):
+        os.makedirs(state_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(state_dir, STATE_FILENAME), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_type TEXT,
+            image_urls TEXT NOT NULL, next_urls TEXT NOT NULL)""")
+        self.db.execute("CREATE TABLE IF NOT EXISTS run (url TEXT PRIMARY KEY, depth INTEGER NOT NULL, done INTEGER NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.db.commit()
+
+    def get_page(self, url):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT image_urls, next_urls, etag, last_modified, content_type FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return Page(json.loads(row[0]), json.loads(row[1]), *row[2:])
+
+    def save_page(self, url, page):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                            (url, page.etag, page.last_modified, page.content_type,
+                             json.dumps(page.image_urls), json.dumps(page.next_urls)))
+
+    # returns (visited {url: depth}, pending (url, depth) pairs). A saved frontier is only resumed for the same start URL and
+    # depth limit; otherwise, or with resume=False, a new run starts from start_url.
+    def start(self, start_url, max_depth, resume=True):
+        run_key = json.dumps([start_url, max_depth])
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'run'").fetchone()
+            if resume and row is not None and row[0] == run_key:
+                visited = dict(self.db.execute("SELECT url, depth FROM run").fetchall())
+                pending = self.db.execute("SELECT url, depth FROM run WHERE done = 0 ORDER BY depth").fetchall()
+                if pending:
+                    return visited, pending
+            self.db.execute("DELETE FROM run")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('run', ?)", (run_key,))
+            self.db.execute("INSERT INTO run VALUES (?, 0, 0)", (start_url,))
+            self.db.commit()
+        return {start_url: 0}, [(start_url, 0)]
+
+    # image URLs of the pages already done in this run, to requeue the downloads a crash may have lost
+    def done_image_urls(self):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT pages.image_urls FROM run JOIN pages ON pages.url = run.url WHERE run.done = 1").fetchall()
+        for (image_urls,) in rows:
+            yield from json.loads(image_urls)
+
+    # also used when a queued or done URL is found again at a smaller depth, which makes it pending again
+    def enqueue(self, url, depth):
+        with self.lock:
+            self.db.execute("INSERT INTO run VALUES (?, ?, 0) ON CONFLICT (url) DO UPDATE SET depth = excluded.depth, done = 0",
+                            (url, depth))
+
+    # marks url as done and commits it together with its saved page and the links it queued,
+    # unless it was queued again at a smaller depth in the meantime
+    def done(self, url, depth):
+        with self.lock:
+            self.db.execute("UPDATE run SET done = 1 WHERE url = ? AND depth = ?", (url, depth))
+            self.db.commit()
+
+    def finish(self):
+        with self.lock:
+            self.db.execute("DELETE FROM run")
+            self.db.execute("DELETE FROM meta WHERE key = 'run'")
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,181 @@
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Single-pass extraction of links and image candidates from an HTML page.
+# problem: the BeautifulSoup version built a full tree and walked it with find_all about nine times per page,
+# then parsed the page URL again for every link it compared
+# solution: stream the page once through an event parser (lxml's target parser when it is installed, html.parser otherwise)
+# and collect everything from the start tag callbacks:
+#   links:  <a href>, <script src>, <link href>
+#   images: <img src/srcset>, <source src/srcset> (every srcset candidate), <meta property="og:image">, <link href>,
+#           data-src on any tag, every url(...) in style attributes and <style> blocks
+# The extension check is one precompiled regex per set of image formats, and relative links skip the host comparison.
+
+CSS_URL_REGEX = re.compile(r"""url\(\s*['"]?([^'")]+?)['"]?\s*\)""")
+ABSOLUTE_URL_REGEX = re.compile(r"^(?:[a-zA-Z][a-zA-Z0-9+.-]*:|//)")
+# a CSS url(...) reference (group 1) or an absolute http(s) URL (group 2) anywhere in text, JavaScript or CSS
+TEXT_URL_REGEX = re.compile(r"""url\(\s*['"]?([^'")]+?)['"]?\s*\)|(https?://[^\s"'<>()\\]+)""")
+# longest URL kept across a chunk boundary, longer ones are cut
+MAX_URL_LENGTH = 2048
+
+@lru_cache(maxsize=None)
+def image_url_regex(image_formats):
+    extensions = "|".join(re.escape(ext.lstrip(".")) for ext in sorted(image_formats))
+    return re.compile(rf"\.(?:{extensions})$", re.IGNORECASE)
+
+def srcset_urls(srcset):
+    for candidate in srcset.split(","):
+        parts = candidate.split()
+        if parts:
+            yield parts[0]
+
+class PageLinks:
+    def __init__(self, base_url, image_formats):
+        self.base_url = base_url
+        parsed = urlparse(base_url)
+        self.netloc = parsed.netloc
+        self.origin = f"{parsed.scheme}://{parsed.netloc}"
+        self.is_image = image_url_regex(frozenset(image_formats)).search
+        self.image_urls = {}
+        self.next_urls = {}
+        self.in_style = False
+
+    # urljoin dominates the extraction time; root-relative paths without dot segments only need the origin prepended
+    def join(self, url):
+        if url[:1] == "/" and url[:2] != "//" and "/." not in url:
+            return self.origin + url
+        return urljoin(self.base_url, url)
+
+    def add_image(self, url):
+        if url:
+            full_url = self.join(url.strip())
+            if self.is_image(full_url):
+                self.image_urls[full_url] = None
+
+    def add_link(self, url):
+        if url:
+            url = url.strip()
+            full_url = self.join(url)
+            if not ABSOLUTE_URL_REGEX.match(url) or urlparse(full_url).netloc == self.netloc:
+                self.next_urls[full_url] = None
+
+    def add_css(self, css):
+        for url in CSS_URL_REGEX.findall(css):
+            self.add_image(url)
+
+    def start(self, tag, attrs):
+        get = attrs.get
+        if "style" in attrs:
+            self.add_css(attrs["style"] or "")
+        if "data-src" in attrs:
+            self.add_image(get("data-src"))
+
+        if tag == "a":
+            self.add_link(get("href"))
+        elif tag == "img" or tag == "source":
+            self.add_image(get("src"))
+            if get("srcset"):
+                for url in srcset_urls(attrs["srcset"]):
+                    self.add_image(url)
+        elif tag == "link":
+            self.add_link(get("href"))
+            self.add_image(get("href"))
+        elif tag == "script":
+            self.add_link(get("src"))
+        elif tag == "meta":
+            if get("property") == "og:image":
+                self.add_image(get("content"))
+        elif tag == "style":
+            self.in_style = True
+
+    def end(self, tag):
+        if tag == "style":
+            self.in_style = False
+
+    def data(self, text):
+        if self.in_style:
+            self.add_css(text)
+
+    def close(self):
+        return list(self.image_urls), list(self.next_urls)
+
+class StdlibLinkParser(HTMLParser):
+    def __init__(self, links):
+        super().__init__(convert_charrefs=True)
+        self.links = links
+
+    def handle_starttag(self, tag, attrs):
+        self.links.start(tag, dict(attrs))
+
+    def handle_endtag(self, tag):
+        self.links.end(tag)
+
+    def handle_data(self, data):
+        self.links.data(data)
+
+# Incremental URL scan of text, JavaScript and CSS bodies, which have no markup to parse.
+# problem: scanning the whole decoded text with a regex means holding the whole body in memory, however large it is
+# solution: feed the decoded chunks as they arrive and keep only the URL references found plus a short tail: a match
+# touching the end of the buffer may go on in the next chunk, so the text after the last complete match (at most
+# MAX_URL_LENGTH characters) is scanned again with the next chunk. The references are resolved against the page by
+# extract_refs, so the scan itself doesn't need the page URL or the image formats.
+class UrlScanner:
+    def __init__(self):
+        # (is a CSS url() reference, url) -> None, without duplicates and in document order
+        self.refs = {}
+        self.tail = ""
+
+    def feed(self, text):
+        self.scan(self.tail + text, final=False)
+
+    # returns the [(is_css, url)] references found; when the text was cut (complete=False), a match running to its
+    # end is left out
+    def close(self, complete=True):
+        self.scan(self.tail, final=complete)
+        self.tail = ""
+        return list(self.refs)
+
+    def scan(self, buffer, final):
+        end = 0
+        for match in TEXT_URL_REGEX.finditer(buffer):
+            if match.end() == len(buffer) and not final:
+                break
+            css, url = match.groups()
+            self.refs[(True, css) if css is not None else (False, url)] = None
+            end = match.end()
+        self.tail = buffer[max(end, len(buffer) - MAX_URL_LENGTH):]
+
+def scan_text(text):
+    scanner = UrlScanner()
+    scanner.feed(text)
+    return scanner.close()
+
+# url() references are images (like in <style>), absolute URLs are images or links depending on their extension;
+# returns (image_urls, next_urls) like extract_html
+def extract_refs(refs, base_url, image_formats):
+    links = PageLinks(base_url, image_formats)
+    for is_css, url in refs:
+        if is_css or links.is_image(url):
+            links.add_image(url)
+        else:
+            links.add_link(url)
+    return links.close()
+
+# returns (image_urls, next_urls), each without duplicates and in document order
+def extract_html(html, base_url, image_formats, use_lxml=True):
+    links = PageLinks(base_url, image_formats)
+    if use_lxml and etree is not None and html.strip():
+        parser = etree.HTMLParser(target=links)
+        parser.feed(html)
+        return parser.close()
+    parser = StdlibLinkParser(links)
+    parser.feed(html)
+    parser.close()
+    return links.close()
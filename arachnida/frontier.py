@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import tempfile
+from array import array
+from collections import deque
+from urllib.parse import urlsplit, urlunsplit
+
+# Bounded-memory crawl bookkeeping for very large sites.
+# problem: the visited set holds every full URL string (~100+ bytes each with the set overhead) and the frontier queue
+# holds every pending URL in memory, so a million-URL crawl runs out of memory
+# solution: canonicalize URLs so trivial variants count once, keep only a 64-bit fingerprint (and the depth) per visited
+# URL in flat arrays, and let the frontier spill to temp files once it holds more than a fixed number of URLs.
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# lowercase scheme and host, no default port, no fragment, "/" for an empty path, no tabs or newlines
+def canonicalize_url(url):
+    url = url.replace("\t", "").replace("\r", "").replace("\n", "")
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and DEFAULT_PORTS.get(scheme) == port:
+        netloc = netloc.rsplit(":", 1)[0]
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+# 0 marks an empty slot in the table, so no URL fingerprints to it
+def fingerprint(url):
+    return int.from_bytes(hashlib.blake2b(url.encode(), digest_size=8).digest(), "little") or 1
+
+# Map of URL -> depth holding only 64-bit fingerprints: an open-addressing hash table (linear probing) over an
+# array('Q') of fingerprints and an array('H') of depths, about 15-25 bytes per URL. Two URLs colliding on 64 bits
+# would make the second one look visited, which is negligible even at billions of URLs.
+class VisitedUrls:
+    def __init__(self, capacity=1024):
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        self.keys = array("Q", bytes(8 * capacity))
+        self.depths = array("H", bytes(2 * capacity))
+        self.mask = capacity - 1
+        self.count = 0
+
+    def slot(self, key):
+        keys = self.keys
+        index = key & self.mask
+        while keys[index] != key and keys[index] != 0:
+            index = (index + 1) & self.mask
+        return index
+
+    def get(self, url, default=None):
+        index = self.slot(fingerprint(url))
+        return self.depths[index] if self.keys[index] else default
+
+    def __contains__(self, url):
+        return self.keys[self.slot(fingerprint(url))] != 0
+
+    def __setitem__(self, url, depth):
+        self.insert(fingerprint(url), min(depth, 0xFFFF))
+
+    def add(self, url):
+        self[url] = 0
+
+    def insert(self, key, depth):
+        index = self.slot(key)
+        if self.keys[index] == 0:
+            self.keys[index] = key
+            self.count += 1
+        self.depths[index] = depth
+        if self.count * 10 > len(self.keys) * 7:
+            self.grow()
+
+    def grow(self):
+        keys, depths = self.keys, self.depths
+        self.allocate(len(keys) * 2)
+        for key, depth in zip(keys, depths):
+            if key:
+                self.insert(key, depth)
+
+    def __len__(self):
+        return self.count
+
+# Pending URLs by depth: up to memory_limit of them in deques, the rest appended to one temp file per depth and read
+# back in batches once the in-memory entries of that depth run out. The smallest depth is always served first.
+class SpillQueue:
+    def __init__(self, memory_limit, spill_dir=None):
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir
+        self.levels = {}
+        self.spills = {}
+        self.in_memory = 0
+        self.length = 0
+
+    def push(self, item):
+        depth, url = item
+        if self.in_memory < self.memory_limit:
+            self.levels.setdefault(depth, deque()).append(url)
+            self.in_memory += 1
+        else:
+            if depth not in self.spills:
+                self.spills[depth] = SpillFile(self.spill_dir)
+            self.spills[depth].append(url)
+        self.length += 1
+
+    def pop(self):
+        depth = min(depth for depth in (*self.levels, *self.spills)
+                    if self.levels.get(depth) or (depth in self.spills and self.spills[depth].count))
+        level = self.levels.setdefault(depth, deque())
+        if not level:
+            level.extend(self.spills[depth].read(max(self.memory_limit - self.in_memory, 1)))
+            self.in_memory += len(level)
+        url = level.popleft()
+        if not level:
+            del self.levels[depth]
+        self.in_memory -= 1
+        self.length -= 1
+        return depth, url
+
+    def close(self):
+        for spill in self.spills.values():
+            spill.close()
+        self.spills.clear()
+
+    def __len__(self):
+        return self.length
+
+class SpillFile:
+    def __init__(self, spill_dir):
+        self.file = tempfile.TemporaryFile("w+b", dir=spill_dir)
+        self.read_pos = 0
+        self.count = 0
+
+    def append(self, url):
+        self.file.seek(0, 2)
+        self.file.write(url.encode() + b"\n")
+        self.count += 1
+
+    def read(self, limit):
+        self.file.seek(self.read_pos)
+        urls = [self.file.readline()[:-1].decode() for _ in range(min(limit, self.count))]
+        self.read_pos = self.file.tell()
+        self.count -= len(urls)
+        return urls
+
+    def close(self):
+        self.file.close()
+
+# asyncio queue of (depth, url) on top of SpillQueue, through the same _init/_put/_get hooks PriorityQueue overrides
+class SpillingFrontier(asyncio.Queue):
+    def __init__(self, memory_limit=100_000, spill_dir=None):
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir
+        super().__init__()
+
+    def _init(self, maxsize):
+        self._queue = SpillQueue(self.memory_limit, self.spill_dir)
+
+    def _put(self, item):
+        self._queue.push(item)
+
+    def _get(self):
+        return self._queue.pop()
+
+    def close(self):
+        self._queue.close()
@@ -0,0 +1,194 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from functools import partial
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+import requests
+
+ROBOTS_TTL = 3600
+BACKOFF_STATUSES = {429, 503}
+MAX_BACKOFF = 60
+CONGESTION_MARGIN = 0.05
+MIN_TIMEOUT = 3
+TIMEOUT_FACTOR = 10
+
+# Per-host politeness and throughput control for the concurrent crawler.
+# problem: nothing keeps spider from hammering a host: robots.txt is ignored, there is no rate limit, every host gets the
+# same fixed number of requests in flight, and a 429 or 503 just loses the page, so big crawls get throttled or banned
+# solution: every request goes through the HostState of its host:
+#   - robots.txt is fetched once per host and kept for ROBOTS_TTL seconds; disallowed URLs are skipped, and its
+#     Crawl-delay / Request-rate (or --rate) drive a token bucket
+#   - the number of requests in flight is tuned with AIMD: it starts at per_host (the fixed cap it replaces), is halved
+#     when the latency doubles or on a 429/503, and grows back by 1/limit per response while the latency stays near
+#     the best one seen
+#   - a 429/503 pauses the host for its Retry-After, or for an exponential backoff
+#   - the read timeout follows the host's latency instead of a fixed 10s
+# Responses are observed through a requests response hook on the session, so the fetch code stays the same.
+
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    # takes a token, going into debt if there is none, and returns how long to wait before using it
+    def reserve(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return max(-self.tokens / self.rate, 0)
+
+# seconds to wait from a Retry-After header (delay in seconds or HTTP date), None without one
+def retry_after(response):
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+# observe() runs in the fetcher threads, everything else in the event loop
+class HostState:
+    def __init__(self, max_concurrency, timeout, rate=None):
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.ready = asyncio.Condition()
+        self.lock = threading.Lock()
+        self.bucket = TokenBucket(rate) if rate else None
+        self.robots = None
+        self.robots_expires = 0.0
+        self.robots_task = None
+        self.latency = None
+        self.best_latency = None
+        self.decreased_at = 0.0
+        self.resume_at = 0.0
+        self.backoff = 0.0
+        self.max_timeout = timeout
+        self.timeout = timeout
+
+    def observe(self, status, latency, delay=None):
+        now = time.monotonic()
+        with self.lock:
+            if status in BACKOFF_STATUSES:
+                self.backoff = min(max(self.backoff * 2, 1.0), MAX_BACKOFF)
+                self.resume_at = max(self.resume_at, now + (self.backoff if delay is None else delay))
+                self.decrease(now)
+                return
+            self.backoff = 0.0
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            self.best_latency = latency if self.best_latency is None else min(self.best_latency, latency)
+            if self.latency > 2 * self.best_latency and self.latency - self.best_latency > CONGESTION_MARGIN:
+                self.decrease(now)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.timeout = min(self.max_timeout, max(MIN_TIMEOUT, TIMEOUT_FACTOR * self.latency))
+
+    # at most once per round trip, so one burst of slow responses doesn't collapse the limit to 1
+    def decrease(self, now):
+        if now - self.decreased_at > (self.latency or 0):
+            self.limit = max(1.0, self.limit / 2)
+            self.decreased_at = now
+
+class HostScheduler:
+    def __init__(self, session, executor, per_host=8, timeout=10, rate=None, robots=True, robots_ttl=ROBOTS_TTL):
+        self.session = session
+        self.executor = executor
+        self.per_host = per_host
+        self.timeout = timeout
+        self.rate = rate
+        self.use_robots = robots
+        self.robots_ttl = robots_ttl
+        self.user_agent = session.headers.get("User-Agent", "*")
+        self.hosts = {}
+        session.hooks["response"].append(self.observe_response)
+
+    def host(self, url):
+        netloc = urlsplit(url).netloc
+        host = self.hosts.get(netloc)
+        if host is None:
+            host = self.hosts[netloc] = HostState(self.per_host, self.timeout, self.rate)
+        return host
+
+    def observe_response(self, response, *args, **kwargs):
+        host = self.hosts.get(urlsplit(response.url).netloc)
+        if host is not None:
+            host.observe(response.status_code, response.elapsed.total_seconds(), retry_after(response))
+        return response
+
+    # like RobotFileParser.read: 401/403 disallow everything, any other error allows everything
+    def fetch_robots(self, robots_url):
+        parser = RobotFileParser(robots_url)
+        try:
+            response = self.session.get(robots_url, timeout=self.timeout)
+        except requests.RequestException:
+            parser.allow_all = True
+            return parser
+        if response.status_code in (401, 403):
+            parser.disallow_all = True
+        elif response.status_code >= 400:
+            parser.allow_all = True
+        else:
+            parser.parse(response.text.splitlines())
+        return parser
+
+    async def allowed(self, url):
+        if not self.use_robots:
+            return True
+        host = self.host(url)
+        if host.robots is None or host.robots_expires < time.monotonic():
+            # the first request to a host fetches robots.txt, the ones arriving meanwhile wait for the same fetch
+            if host.robots_task is None:
+                parts = urlsplit(url)
+                fetch = partial(self.fetch_robots, f"{parts.scheme}://{parts.netloc}/robots.txt")
+                host.robots_task = asyncio.ensure_future(asyncio.get_running_loop().run_in_executor(self.executor, fetch))
+            task = host.robots_task
+            robots = await task
+            if host.robots_task is task:
+                host.robots_task = None
+                host.robots = robots
+                host.robots_expires = time.monotonic() + self.robots_ttl
+                self.apply_crawl_delay(host, robots)
+        return host.robots.can_fetch(self.user_agent, url)
+
+    def apply_crawl_delay(self, host, robots):
+        rates = [self.rate] if self.rate else []
+        delay = robots.crawl_delay(self.user_agent)
+        if delay:
+            rates.append(1 / float(delay))
+        request_rate = robots.request_rate(self.user_agent)
+        if request_rate and request_rate.seconds:
+            rates.append(request_rate.requests / request_rate.seconds)
+        rate = min(rates) if rates else None
+        if rate != (host.bucket.rate if host.bucket else None):
+            host.bucket = TokenBucket(rate) if rate else None
+
+    # holds one of the host's request slots, once its backoff is over and the token bucket allows;
+    # yields the read timeout to use for the request
+    @asynccontextmanager
+    async def slot(self, url):
+        host = self.host(url)
+        async with host.ready:
+            await host.ready.wait_for(lambda: host.in_flight < int(host.limit))
+            host.in_flight += 1
+        try:
+            while (pause := host.resume_at - time.monotonic()) > 0:
+                await asyncio.sleep(pause)
+            if host.bucket is not None:
+                await asyncio.sleep(host.bucket.reserve())
+            yield host.timeout
+        finally:
+            async with host.ready:
+                host.in_flight -= 1
+                host.ready.notify_all()
@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import threading
+
+INDEX_FILENAME = ".spider_index.sqlite"
+
+# Content-addressed index of the images saved in an output dir.
+# problem: deduplicating by os.path.basename(url) throws away different images sharing a name like image.jpg,
+# and still downloads the same bytes again when a CDN serves them under another URL
+# solution: index every download by the SHA-256 of its content in a SQLite file inside the output dir:
+#   urls:  url  -> digest    (checked before any network request, so a repeat crawl never refetches a known URL)
+#   files: name -> digest    (every file name in the output dir, the first one holds the bytes)
+# A new URL whose content is already stored gets its name as a hardlink (or symlink) to the existing file instead of a copy.
+# The downloaders run in threads, so every access goes through one lock.
+class ImageStore:
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(output_dir, INDEX_FILENAME), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, digest TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, digest TEXT NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_digest ON files (digest)")
+        self.db.commit()
+
+    def has_url(self, url):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM urls WHERE url = ?", (url,)).fetchone() is not None
+
+    def stored_name(self, digest):
+        row = self.db.execute("SELECT name FROM files WHERE digest = ? LIMIT 1", (digest,)).fetchone()
+        return row[0] if row else None
+
+    # basename of the URL, unless it is already taken by different content (or by a file the index doesn't know about),
+    # then the basename suffixed with the digest, which a third URL with the same name and content finds already stored
+    def pick_name(self, url, digest):
+        name = os.path.basename(url)
+        stem, ext = os.path.splitext(name)
+        for name in (name, f"{stem}.{digest[:12]}{ext}"):
+            row = self.db.execute("SELECT digest FROM files WHERE name = ?", (name,)).fetchone()
+            if row is None and not os.path.lexists(os.path.join(self.output_dir, name)):
+                return name, False
+            if row is not None and row[0] == digest:
+                return name, True
+        return name, False
+
+    # moves a finished temp file into the store; returns (file name, whether the content was new)
+    def add(self, url, temp_path, digest):
+        with self.lock:
+            stored = self.stored_name(digest)
+            name, exists = self.pick_name(url, digest)
+            if stored is None:
+                os.replace(temp_path, os.path.join(self.output_dir, name))
+            else:
+                os.unlink(temp_path)
+                if not exists:
+                    self.link(stored, name)
+            self.db.execute("INSERT OR IGNORE INTO files (name, digest) VALUES (?, ?)", (name, digest))
+            self.db.execute("INSERT OR REPLACE INTO urls (url, digest) VALUES (?, ?)", (url, digest))
+            self.db.commit()
+            return name, stored is None
+
+    def link(self, stored, name):
+        target = os.path.join(self.output_dir, name)
+        try:
+            os.link(os.path.join(self.output_dir, stored), target)
+        except OSError:
+            os.symlink(stored, target)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,94 @@
+import json
+import os
+import sqlite3
+import time
+from metadata_reader import has_gps
+
+BATCH_SIZE = 10_000
+
+# Persistent metadata index for scorpion, in one SQLite file.
+# problem: every run over the same archive opens and parses every file again, although almost none of them changed
+# solution: keep each file's record keyed by (path, size, mtime_ns). The stat result comes for free from the os.scandir
+# walk, so an unchanged file is answered from the index without being opened; a changed size or mtime means the entry is
+# stale and the file is read again. Files that disappeared are dropped after a recursive scan of their directory.
+# Make, model and "has GPS" are kept in indexed columns as well, so those queries run on the index alone.
+# A record read with --fast (details=0) only answers --fast scans; a full record answers both.
+# Only scorpion's main thread uses it (pool workers return their records to it), so there is no lock.
+class MetadataCache:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, details INTEGER NOT NULL,
+            seen INTEGER NOT NULL, has_gps INTEGER NOT NULL, make TEXT COLLATE NOCASE, model TEXT COLLATE NOCASE,
+            record TEXT NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_make ON files (make)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_model ON files (model)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_gps ON files (has_gps) WHERE has_gps")
+        self.db.commit()
+        # marks the entries seen by this run, the others under a rescanned directory are deleted by prune
+        self.run = time.time_ns()
+        self.seen = []
+        self.pending = []
+
+    # the stored record if the file is unchanged since it was read with at least this level of detail, else None
+    def get(self, path, st, details=True):
+        row = self.db.execute("SELECT size, mtime_ns, details, record FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns or row[2] < details:
+            return None
+        self.seen.append((self.run, path))
+        if len(self.seen) >= BATCH_SIZE:
+            self.flush()
+        return json.loads(row[3])
+
+    # records with an error are not stored, so the file is tried again next time
+    def put(self, path, st, record, details=True):
+        if "error" in record:
+            return
+        tags = record["tags"]
+        self.pending.append((path, st.st_size, st.st_mtime_ns, int(details), self.run, has_gps(tags),
+                             tags.get("Image Make"), tags.get("Image Model"), json.dumps(record)))
+        if len(self.pending) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.pending and not self.seen:
+            return
+        self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", self.pending)
+        self.db.executemany("UPDATE files SET seen = ? WHERE path = ?", self.seen)
+        self.db.commit()
+        self.pending.clear()
+        self.seen.clear()
+
+    # drops the entries under root that this run did not see: files deleted since, or no longer supported
+    def prune(self, root):
+        self.flush()
+        prefix = os.path.join(root, "")
+        self.db.execute("DELETE FROM files WHERE seen != ? AND substr(path, 1, ?) = ?", (self.run, len(prefix), prefix))
+        self.db.commit()
+
+    # records straight from the index; roots limits them to those files or directories, the other filters are ANDed
+    def query(self, roots=(), has_gps=False, make=None, model=None):
+        self.flush()
+        where, params = [], []
+        if roots:
+            where.append("(" + " OR ".join("path = ? OR substr(path, 1, ?) = ?" for _ in roots) + ")")
+            for root in roots:
+                prefix = os.path.join(root, "")
+                params += [root, len(prefix), prefix]
+        if has_gps:
+            where.append("has_gps")
+        if make is not None:
+            where.append("make = ?")
+            params.append(make)
+        if model is not None:
+            where.append("model = ?")
+            params.append(model)
+        sql = "SELECT record FROM files" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY path"
+        for (record,) in self.db.execute(sql, params):
+            yield json.loads(record)
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -0,0 +1,176 @@
+import mmap
+import os
+import zlib
+
+# Header-only metadata reader used by scorpion.
+# problem: exifread.process_file parses every tag of a file, MakerNote and thumbnails included, even when only a
+# couple of tags are wanted, and returns nothing for PNG text chunks or GIF comments
+# solution: memory-map the file and walk only its container headers: JPEG segments up to the start of scan, PNG chunk
+# headers (IDAT payloads are skipped by their length), GIF blocks. The TIFF block found there (APP1 Exif, eXIf, or the
+# whole file for TIFF-based RAW) is handed to exifread's ExifHeader directly, one IFD at a time:
+# IFD0 (with GPS), then the EXIF IFD, then, in detailed mode only, the thumbnail IFDs, MakerNote and thumbnail.
+# Reading stops as soon as every wanted tag has been found.
+# exifread itself is only imported by the first file with EXIF data (buffer_exif_header.py), so scorpion starts
+# without it and answers from its index without ever loading it.
+# Tag names are exifread's ("Image Make", "EXIF DateTimeOriginal", "GPS GPSLatitude", ...), plus
+# "JPEG Comment", "PNG <keyword>" for tEXt/zTXt/iTXt chunks and "GIF Comment".
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# wanted holds full tag names ("Image Make") or names without the IFD prefix ("Make")
+def is_wanted(name, wanted):
+    return wanted is None or name in wanted or name.split(" ", 1)[-1] in wanted
+
+def has_all(tags, wanted):
+    return wanted is not None and all(any(is_wanted(name, {tag}) for name in tags) for tag in wanted)
+
+def has_gps(tags):
+    return any(name.startswith("GPS ") for name in tags)
+
+def jpeg_headers(view, tags):
+    tiff_offset = None
+    pos = 2
+    while pos + 4 <= len(view) and view[pos] == 0xFF:
+        marker = view[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            pos += 2
+            continue
+        if marker in (0xDA, 0xD9):
+            break
+        length = int.from_bytes(view[pos + 2:pos + 4], "big")
+        if marker == 0xE1 and tiff_offset is None and view[pos + 4:pos + 10] == b"Exif\0\0":
+            tiff_offset = pos + 10
+        elif marker == 0xFE:
+            tags["JPEG Comment"] = bytes(view[pos + 4:pos + 2 + length]).decode("utf-8", "replace")
+        pos += 2 + length
+    return tiff_offset
+
+def png_text(kind, data):
+    keyword, _, rest = data.partition(b"\0")
+    if kind == b"tEXt":
+        text = rest.decode("latin-1")
+    elif kind == b"zTXt":
+        text = zlib.decompress(rest[1:]).decode("latin-1")
+    else:
+        compressed, rest = rest[0], rest[2:]
+        _, _, rest = rest.partition(b"\0")
+        _, _, text = rest.partition(b"\0")
+        text = (zlib.decompress(text) if compressed else text).decode("utf-8", "replace")
+    return "PNG " + keyword.decode("latin-1"), text
+
+def png_headers(view, tags, wanted):
+    tiff_offset = None
+    pos = 8
+    while pos + 8 <= len(view):
+        length = int.from_bytes(view[pos:pos + 4], "big")
+        kind = bytes(view[pos + 4:pos + 8])
+        if kind == b"IEND":
+            break
+        if kind == b"eXIf" and tiff_offset is None:
+            tiff_offset = pos + 8
+        elif kind in (b"tEXt", b"zTXt", b"iTXt"):
+            name, text = png_text(kind, bytes(view[pos + 8:pos + 8 + length]))
+            if is_wanted(name, wanted):
+                tags[name] = text
+        pos += 12 + length
+    return tiff_offset
+
+def skip_sub_blocks(view, pos, collect=None):
+    end = len(view)
+    while pos < end:
+        size = view[pos]
+        if not size:
+            break
+        if collect is not None:
+            collect.append(bytes(view[pos + 1:pos + 1 + size]))
+        pos += 1 + size
+    return pos + 1
+
+# comments normally come before the image data; only the detailed mode walks the image data looking for later ones
+def gif_headers(view, tags, details):
+    flags = view[10]
+    pos = 13 + (3 * (2 << (flags & 7)) if flags & 0x80 else 0)
+    comments = []
+    while pos < len(view):
+        block = view[pos]
+        if block == 0x21:
+            collect = comments if view[pos + 1] == 0xFE else None
+            pos = skip_sub_blocks(view, pos + 2, collect)
+        elif block == 0x2C and details:
+            flags = view[pos + 9]
+            pos += 10 + (3 * (2 << (flags & 7)) if flags & 0x80 else 0)
+            pos = skip_sub_blocks(view, pos + 1)
+        else:
+            break
+    if comments:
+        tags["GIF Comment"] = b"".join(comments).decode("utf-8", "replace")
+
+# same IFD order and names as exifread.process_file, minus everything after the EXIF IFD when details is off
+def dump_tiff(header, wanted, details):
+    ifds = header.list_ifd()
+    if ifds:
+        header.dump_ifd(ifds[0], "Image")
+    if has_all(header.tags, wanted):
+        return
+    exif_offset = header.tags.get("Image ExifOffset")
+    if exif_offset:
+        header.dump_ifd(exif_offset.values[0], "EXIF")
+    if not details or has_all(header.tags, wanted):
+        return
+
+    for i, ifd in enumerate(ifds[1:], 1):
+        header.dump_ifd(ifd, "Thumbnail" if i == 1 else f"IFD {i}")
+    sub_ifds = header.tags.get("Image SubIFDs")
+    if sub_ifds:
+        for i, ifd in enumerate(sub_ifds.values):
+            header.dump_ifd(ifd, f"EXIF SubIFD{i}")
+    if "EXIF MakerNote" in header.tags and "Image Make" in header.tags:
+        header.decode_maker_note()
+    if len(ifds) > 1:
+        header.extract_tiff_thumbnail(ifds[1])
+        header.extract_jpeg_thumbnail()
+
+def read_exif(view, offset, tags, wanted, details):
+    from buffer_exif_header import BufferExifHeader, get_endian_str
+    endian = get_endian_str(bytes(view[offset:offset + 1]))[0]
+    header = BufferExifHeader(view, endian, offset, details)
+    try:
+        dump_tiff(header, wanted, details)
+    except Exception:
+        # corrupt or truncated EXIF: keep the tags read before the error, like exifread does when not strict
+        pass
+    for name, value in header.tags.items():
+        if is_wanted(name, wanted):
+            tags[name] = value
+
+# reads the metadata of an image held in any buffer (bytes, mmap, memoryview); returns {tag name: value}
+def read_buffer(buffer, wanted=None, details=True):
+    tags = {}
+    with memoryview(buffer) as view:
+        signature = bytes(view[:8])
+        if signature[:2] == b"\xff\xd8":
+            tiff_offset = jpeg_headers(view, tags)
+        elif signature == PNG_SIGNATURE:
+            tiff_offset = png_headers(view, tags, wanted)
+        elif signature[:4] == b"GIF8" and len(view) >= 13:
+            tiff_offset = None
+            if is_wanted("GIF Comment", wanted):
+                gif_headers(view, tags, details)
+        elif signature[:4] in (b"II*\0", b"MM\0*"):
+            tiff_offset = 0
+        else:
+            tiff_offset = None
+        tags = {name: value for name, value in tags.items() if is_wanted(name, wanted)}
+        if tiff_offset is not None and not has_all(tags, wanted):
+            read_exif(view, tiff_offset, tags, wanted, details)
+    return tags
+
+def read_tags(file_path, wanted=None, details=True):
+    with open(file_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return {}
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return read_buffer(mapped, wanted, details)
@@ -0,0 +1,226 @@
+import bisect
+import io
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds in seconds, as Prometheus histogram buckets
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+DEFAULT_INTERVAL = 10
+PROFILE_TOP = 25
+
+# Metrics shared by spider and scorpion.
+# problem: the only visibility into a run is its print lines, so nobody can tell where the time goes, size a crawl
+# or notice a regression
+# solution: one process-wide registry (`stats`) of counters, latency histograms and gauges, updated from any thread.
+# A reporter thread writes it every few seconds as a JSON line on stderr (--stats) and/or as a Prometheus text file
+# (--prometheus), and --profile runs the whole tool under cProfile and tracemalloc.
+# cProfile, pstats, tracemalloc and tempfile are imported by the options that use them, not by every run.
+# Worker processes have their own registry: what they record is lost, so pool work is timed by the parent instead.
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # upper bound of the bucket holding the q-quantile
+    def quantile(self, q):
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return BUCKETS[-1]
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.gauges = {}
+            self.started = time.time()
+
+    # labels is a tuple of (name, value) pairs, e.g. (("status", "200"),)
+    def count(self, name, amount=1, labels=()):
+        with self.lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    # fn is called whenever the metrics are exported, from the reporter thread
+    def gauge(self, name, fn):
+        with self.lock:
+            self.gauges[name] = fn
+
+    def remove_gauges(self, *names):
+        with self.lock:
+            for name in names:
+                self.gauges.pop(name, None)
+
+    def read_gauges(self):
+        values = {}
+        for name, fn in list(self.gauges.items()):
+            try:
+                values[name] = fn()
+            except Exception:
+                pass
+        return values
+
+    def snapshot(self):
+        gauges = self.read_gauges()
+        with self.lock:
+            counters = {format_name(name, labels): value for (name, labels), value in sorted(self.counters.items())}
+            histograms = {name: {"count": h.count, "sum": round(h.sum, 6), "p50": h.quantile(0.5),
+                                 "p90": h.quantile(0.9), "p99": h.quantile(0.99)}
+                          for name, h in sorted(self.histograms.items())}
+        return {"time": round(time.time(), 3), "uptime": round(time.time() - self.started, 3),
+                "counters": counters, "histograms": histograms, "gauges": gauges}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), default=str)
+
+    # Prometheus text exposition format: counters get a _total suffix, histograms cumulative _bucket lines
+    def to_prometheus(self, prefix):
+        gauges = self.read_gauges()
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{prefix}_{name}_total"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{format_name(metric, labels)} {value}")
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f"{prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+                lines.append(f"{metric}_sum {histogram.sum}")
+                lines.append(f"{metric}_count {histogram.count}")
+        for name, value in sorted(gauges.items()):
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+def format_name(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+stats = Metrics()
+
+# writes the metrics every `interval` seconds and once more when stopped
+class Reporter:
+    def __init__(self, metrics, prefix, interval=DEFAULT_INTERVAL, json_out=None, prometheus_path=None):
+        self.metrics = metrics
+        self.prefix = prefix
+        self.interval = interval
+        self.json_out = json_out
+        self.prometheus_path = prometheus_path
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def report(self):
+        if self.json_out is not None:
+            self.json_out.write(self.metrics.to_json() + "\n")
+            self.json_out.flush()
+        if self.prometheus_path is not None:
+            # node_exporter's textfile collector may read at any time, so the file is replaced, never rewritten in place
+            import tempfile
+            directory = os.path.dirname(os.path.abspath(self.prometheus_path))
+            with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as file:
+                file.write(self.metrics.to_prometheus(self.prefix))
+            os.replace(file.name, self.prometheus_path)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.report()
+
+# cProfile only sees the thread it was enabled in: for spider that is the event loop, not the fetcher threads
+@contextmanager
+def profiled(path, out=sys.stderr):
+    import cProfile
+    import pstats
+    import tracemalloc
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        profiler.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        out.write(report.getvalue())
+        out.write(f"Peak traced memory: {peak / 2 ** 20:.1f} MiB, top allocations:\n")
+        for stat in snapshot.statistics("lineno")[:10]:
+            out.write(f"  {stat}\n")
+        out.write(f"Profile written to {path} (python -m pstats {path})\n")
+
+def add_arguments(parser):
+    parser.add_argument("--stats", type=float, metavar="SECONDS", help="Print a JSON line of metrics to stderr every SECONDS and at the end.")
+    parser.add_argument("--prometheus", metavar="FILE", help=f"Write metrics to FILE in Prometheus text format, every --stats seconds (default: {DEFAULT_INTERVAL}) and at the end.")
+    parser.add_argument("--profile", metavar="FILE", help="Run under cProfile and tracemalloc, print the hot paths and top allocations and save the profile to FILE.")
+
+# wraps a tool's run according to the add_arguments options
+@contextmanager
+def instrumented(args, prefix):
+    stats.reset()
+    reporter = None
+    if args.stats or args.prometheus:
+        reporter = Reporter(stats, prefix, args.stats or DEFAULT_INTERVAL,
+                            sys.stderr if args.stats else None, args.prometheus)
+        reporter.start()
+    try:
+        if args.profile:
+            with profiled(args.profile):
+                yield
+        else:
+            yield
+    finally:
+        if reporter is not None:
+            reporter.stop()
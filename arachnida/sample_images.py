@@ -0,0 +1,171 @@
+import argparse
+import os
+import struct
+import zlib
+
+# Generator of sample images with realistic metadata, for the scorpion tests and benchmarks (no imaging library needed).
+# The pixel data is filler: metadata readers only care about the container structure around it.
+#   jpeg: APP1 Exif segment (IFD0, EXIF IFD with a MakerNote, GPS IFD, IFD1 with a JPEG thumbnail), COM segment,
+#         then a scan of `payload` bytes
+#   png:  tEXt chunks, an eXIf chunk with the same TIFF block, then an IDAT chunk of `payload` bytes
+#   gif:  a comment extension, then one image whose data sub-blocks hold `payload` bytes
+
+ASCII, SHORT, LONG, RATIONAL, UNDEFINED = 2, 3, 4, 5, 7
+TYPE_SIZES = {ASCII: 1, SHORT: 2, LONG: 4, RATIONAL: 8, UNDEFINED: 1}
+
+MAKE, MODEL, ORIENTATION, DATETIME = 0x010F, 0x0110, 0x0112, 0x0132
+EXIF_IFD, GPS_IFD = 0x8769, 0x8825
+THUMBNAIL_OFFSET, THUMBNAIL_LENGTH = 0x0201, 0x0202
+EXPOSURE_TIME, DATETIME_ORIGINAL, MAKER_NOTE = 0x829A, 0x9003, 0x927C
+GPS_LATITUDE_REF, GPS_LATITUDE, GPS_LONGITUDE_REF, GPS_LONGITUDE = 1, 2, 3, 4
+
+def encode_value(kind, value):
+    if kind == ASCII:
+        data = value.encode() + b"\0"
+    elif kind == SHORT:
+        data = struct.pack(f"<{len(value)}H", *value)
+    elif kind == LONG:
+        data = struct.pack(f"<{len(value)}I", *value)
+    elif kind == RATIONAL:
+        data = b"".join(struct.pack("<II", *pair) for pair in value)
+    else:
+        data = value
+    return data, len(data) // TYPE_SIZES[kind]
+
+def ifd_size(entries):
+    size = 2 + 12 * len(entries) + 4
+    for _, kind, value in entries:
+        encoded, _ = encode_value(kind, value)
+        if len(encoded) > 4:
+            size += len(encoded)
+    return size
+
+# entries are (tag, type, value) with value a str (ASCII), a list of ints (SHORT, LONG),
+# a list of (numerator, denominator) pairs (RATIONAL) or bytes (UNDEFINED); base is the IFD offset in the TIFF block
+def encode_ifd(entries, base, next_ifd=0):
+    entries = sorted(entries)
+    data_offset = base + 2 + 12 * len(entries) + 4
+    table = struct.pack("<H", len(entries))
+    data = b""
+    for tag, kind, value in entries:
+        encoded, count = encode_value(kind, value)
+        if len(encoded) <= 4:
+            table += struct.pack("<HHI", tag, kind, count) + encoded.ljust(4, b"\0")
+        else:
+            table += struct.pack("<HHII", tag, kind, count, data_offset + len(data))
+            data += encoded
+    return table + struct.pack("<I", next_ifd) + data
+
+def tiff_block(ifd0, exif=(), gps=(), thumbnail=b""):
+    ifd0, exif, gps = list(ifd0), list(exif), list(gps)
+    if exif:
+        ifd0.append((EXIF_IFD, LONG, [0]))
+    if gps:
+        ifd0.append((GPS_IFD, LONG, [0]))
+    ifd1 = [(THUMBNAIL_OFFSET, LONG, [0]), (THUMBNAIL_LENGTH, LONG, [len(thumbnail)])] if thumbnail else []
+
+    offsets = [8]
+    for entries in (ifd0, exif, gps, ifd1):
+        offsets.append(offsets[-1] + (ifd_size(entries) if entries else 0))
+    exif_offset, gps_offset, ifd1_offset, thumbnail_offset = offsets[1:]
+
+    ifd0 = [(tag, kind, [exif_offset] if tag == EXIF_IFD else [gps_offset] if tag == GPS_IFD else value)
+            for tag, kind, value in ifd0]
+    ifd1 = [(tag, kind, [thumbnail_offset] if tag == THUMBNAIL_OFFSET else value) for tag, kind, value in ifd1]
+
+    block = b"II*\0" + struct.pack("<I", 8) + encode_ifd(ifd0, 8, ifd1_offset if ifd1 else 0)
+    if exif:
+        block += encode_ifd(exif, exif_offset)
+    if gps:
+        block += encode_ifd(gps, gps_offset)
+    if ifd1:
+        block += encode_ifd(ifd1, ifd1_offset) + thumbnail
+    return block
+
+def camera_tiff(make="Canon", model="EOS 5D", gps=True, maker_note_size=16 * 1024, thumbnail_size=16 * 1024):
+    ifd0 = [(MAKE, ASCII, make), (MODEL, ASCII, model), (ORIENTATION, SHORT, [1]),
+            (DATETIME, ASCII, "2024:05:01 12:00:00")]
+    exif = [(EXPOSURE_TIME, RATIONAL, [(1, 250)]), (DATETIME_ORIGINAL, ASCII, "2024:05:01 12:00:00")]
+    if maker_note_size:
+        exif.append((MAKER_NOTE, UNDEFINED, bytes(maker_note_size)))
+    gps_entries = [(GPS_LATITUDE_REF, ASCII, "N"), (GPS_LATITUDE, RATIONAL, [(52, 1), (31, 1), (0, 1)]),
+                   (GPS_LONGITUDE_REF, ASCII, "E"), (GPS_LONGITUDE, RATIONAL, [(13, 1), (24, 1), (0, 1)])] if gps else []
+    thumbnail = b"\xff\xd8" + bytes(thumbnail_size) + b"\xff\xd9" if thumbnail_size else b""
+    return tiff_block(ifd0, exif, gps_entries, thumbnail)
+
+def segment(marker, data):
+    return b"\xff" + bytes([marker]) + struct.pack(">H", len(data) + 2) + data
+
+def jpeg_bytes(tiff=None, payload=0, comment=None):
+    parts = [b"\xff\xd8"]
+    if tiff is not None:
+        parts.append(segment(0xE1, b"Exif\0\0" + tiff))
+    if comment is not None:
+        parts.append(segment(0xFE, comment.encode()))
+    parts.append(segment(0xDA, b"\x01\x01\x00\x00\x3f\x00") + bytes(payload) + b"\xff\xd9")
+    return b"".join(parts)
+
+def make_jpeg(path, tiff=None, payload=0, comment=None):
+    with open(path, "wb") as file:
+        file.write(jpeg_bytes(tiff, payload, comment))
+
+def chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+def png_bytes(tiff=None, payload=0, texts=()):
+    parts = [b"\x89PNG\r\n\x1a\n", chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0))]
+    for keyword, text in texts:
+        parts.append(chunk(b"tEXt", keyword.encode("latin-1") + b"\0" + text.encode("latin-1")))
+    if tiff is not None:
+        parts.append(chunk(b"eXIf", tiff))
+    parts.append(chunk(b"IDAT", bytes(payload)))
+    parts.append(chunk(b"IEND", b""))
+    return b"".join(parts)
+
+def make_png(path, tiff=None, payload=0, texts=()):
+    with open(path, "wb") as file:
+        file.write(png_bytes(tiff, payload, texts))
+
+def sub_blocks(data):
+    return b"".join(bytes([len(data[i:i + 255])]) + data[i:i + 255] for i in range(0, len(data), 255)) + b"\0"
+
+def gif_bytes(payload=0, comment=None):
+    parts = [b"GIF89a", struct.pack("<HHBBB", 1, 1, 0, 0, 0)]
+    if comment is not None:
+        parts.append(b"\x21\xfe" + sub_blocks(comment.encode()))
+    parts.append(b"\x2c" + struct.pack("<HHHHB", 0, 0, 1, 1, 0) + b"\x02" + sub_blocks(bytes(payload)))
+    parts.append(b"\x3b")
+    return b"".join(parts)
+
+def make_gif(path, payload=0, comment=None):
+    with open(path, "wb") as file:
+        file.write(gif_bytes(payload, comment))
+
+# a directory of `count` files cycling through the formats above, with and without GPS and comments
+def make_corpus(directory, count, payload=256 * 1024):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        tiff = camera_tiff(make=("Canon", "Nikon", "Sony")[i % 3], model=f"Model {i % 5}", gps=i % 2 == 0)
+        path = os.path.join(directory, f"sample{i}.{('jpg', 'png', 'gif')[i % 3]}")
+        if i % 3 == 0:
+            make_jpeg(path, tiff, payload, comment=f"sample {i}")
+        elif i % 3 == 1:
+            make_png(path, tiff, payload, texts=[("Comment", f"sample {i}"), ("Software", "sample_images")])
+        else:
+            make_gif(path, payload, comment=f"sample {i}")
+        paths.append(path)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate sample images with metadata for scorpion.")
+    parser.add_argument("directory", help="Directory to write the samples to.")
+    parser.add_argument("-n", type=int, default=30, help="Number of files (default: 30).")
+    parser.add_argument("--payload", type=int, default=256 * 1024, help="Bytes of filler image data per file (default: 262144).")
+    args = parser.parse_args()
+
+    paths = make_corpus(args.directory, args.n, args.payload)
+    print(f"Wrote {len(paths)} sample images to {args.directory}")
+
+if __name__ == "__main__":
+    main()
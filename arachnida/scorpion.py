@@ -1,46 +1,258 @@
 import argparse
+import csv
+import json
 import os
-import exifread
+import stat
+import sys
+import time
 from datetime import datetime
+from functools import partial
+from metadata_reader import has_gps, is_wanted, read_buffer, read_tags
+from metrics import add_arguments as add_metrics_arguments, instrumented, stats
 
-SUPPORTED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp"}
+# TIFF and the TIFF-based camera RAW formats (DNG, Nikon NEF, Canon CR2, Sony ARW) are read from their IFDs directly
+SUPPORTED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tif", ".tiff", ".dng", ".nef", ".cr2", ".arw"}
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+CSV_FIELDS = ["path", "size", "created", "modified", "tag", "value", "error"]
 
-def process_file(file_path):
+def is_supported(file_path):
+    return os.path.splitext(file_path)[1].lower() in SUPPORTED_EXTENSIONS
+
+# embedded thumbnails come back as raw bytes: report their size rather than tens of kilobytes of bytes repr
+def describe(value):
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    return str(value)
+
+# reads everything scorpion reports about one file into a dict; st is the stat result the caller already has
+# (from os.scandir or os.stat), so no more separate getsize/getctime/getmtime calls per file.
+# wanted limits the tags to those names (reading stops once they are all found); details=False skips the MakerNote,
+# thumbnail IFDs and thumbnail
+def read_metadata(file_path, st, wanted=None, details=True):
+    record = {
+        "path": file_path,
+        "size": st.st_size,
+        "created": datetime.fromtimestamp(st.st_ctime).strftime(TIME_FORMAT),
+        "modified": datetime.fromtimestamp(st.st_mtime).strftime(TIME_FORMAT),
+        "tags": {},
+    }
+    try:
+        tags = read_tags(file_path, wanted, details)
+        record["tags"] = {tag: describe(value) for tag, value in tags.items()}
+    except Exception as e:
+        record["error"] = str(e)
+    return record
+
+# a pool worker's own metrics are lost with it, so it returns how long the read took for scan to record
+def timed_read_metadata(file_path, st, wanted=None, details=True):
+    start = time.perf_counter()
+    record = read_metadata(file_path, st, wanted, details)
+    return record, time.perf_counter() - start
+
+# the same record for an image that is only in memory, e.g. a response body spider just downloaded
+def read_buffer_metadata(name, buffer, wanted=None, details=True):
+    record = {"path": name, "size": len(buffer), "tags": {}}
     try:
-        file_ext = os.path.splitext(file_path)[1].lower()
+        record["tags"] = {tag: describe(value) for tag, value in read_buffer(buffer, wanted, details).items()}
+    except Exception as e:
+        record["error"] = str(e)
+    return record
 
-        if file_ext in SUPPORTED_EXTENSIONS:
-            print(f"\nProcessing file: {file_path}")
-            print(f"File size: {os.path.getsize(file_path)} bytes")
-            print(f"Created on: {datetime.fromtimestamp(os.path.getctime(file_path)).strftime('%Y-%m-%d %H:%M:%S')}")
-            print(f"Last modified: {datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')}")
+# the filters of the index queries (--has-gps, --make, --model), on a record
+def matches(record, gps=False, make=None, model=None):
+    tags = record["tags"]
+    if gps and not has_gps(tags):
+        return False
+    if make is not None and tags.get("Image Make", "").lower() != make.lower():
+        return False
+    return model is None or tags.get("Image Model", "").lower() == model.lower()
 
-            with open(file_path, 'rb') as file:
-                tags = exifread.process_file(file)
-                print(f"EXIF data:" if tags else "EXIF data can't be retrieved!")
-                for tag, value in tags.items():
-                    print(f"{tag}: {value}")
+def select_tags(record, wanted):
+    if wanted is None:
+        return record
+    return {**record, "tags": {tag: value for tag, value in record["tags"].items() if is_wanted(tag, wanted)}}
 
+def print_metadata(record):
+    if "error" in record:
+        print(f"Error processing {record['path']}: {record['error']}")
+        return
+    print(f"\nProcessing file: {record['path']}")
+    print(f"File size: {record['size']} bytes")
+    print(f"Created on: {record['created']}")
+    print(f"Last modified: {record['modified']}")
+    tags = record["tags"]
+    print(f"EXIF data:" if tags else "EXIF data can't be retrieved!")
+    for tag, value in tags.items():
+        print(f"{tag}: {value}")
+
+def process_file(file_path):
+    try:
+        if is_supported(file_path):
+            print_metadata(read_metadata(file_path, os.stat(file_path)))
     except Exception as e:
         print(f"Error processing {file_path}: {e}")
 
+# problem: walking huge image dumps with os.walk + os.path.* costs several stat calls per file
+# solution: iterative os.scandir walk; DirEntry caches the stat result, which is passed on to read_metadata
+def iter_image_files(root):
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif is_supported(entry.name):
+                        try:
+                            st = entry.stat()
+                        except OSError as e:
+                            print(f"Error: {entry.path}: {e}", file=sys.stderr)
+                            continue
+                        if stat.S_ISREG(st.st_mode):
+                            yield entry.path, st
+        except OSError as e:
+            print(f"Error: {directory}: {e}", file=sys.stderr)
+
+def iter_targets(paths, recursive):
+    for file_path in paths:
+        abs_path = os.path.abspath(file_path)
+
+        try:
+            st = os.stat(abs_path)
+        except OSError:
+            print(f"Error: File not found - {file_path}", file=sys.stderr)
+            continue
+
+        if stat.S_ISDIR(st.st_mode):
+            if recursive:
+                yield from iter_image_files(abs_path)
+            else:
+                print(f"Error: {file_path} is a directory (use -R to scan it)", file=sys.stderr)
+        elif is_supported(abs_path):
+            yield abs_path, st
+
+# problem: one file at a time can't keep a disk array or all the cores busy
+# solution: spread the files over a pool and yield the records in completion order. Only a few files per worker are
+# in flight at any time, so hundreds of thousands of paths never pile up as pending futures.
+# With a cache, unchanged files are answered from it before reaching the pool, and the others are read with every tag,
+# so their stored record can serve any later --tags selection.
+def scan(targets, jobs, use_threads=False, wanted=None, details=True, cache=None):
+    read = partial(timed_read_metadata, wanted=None if cache else wanted, details=details)
+
+    def finish(file_path, st, result):
+        record, seconds = result
+        stats.observe("read_seconds", seconds)
+        stats.count("files_read")
+        stats.count("file_bytes", st.st_size)
+        if "error" in record:
+            stats.count("read_errors")
+        if cache is None:
+            return record
+        cache.put(file_path, st, record, details)
+        return select_tags(record, wanted)
+
+    pool = None
+    if jobs > 1:
+        # imported here: the process pool machinery alone costs more startup time than a one-file run
+        from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+        pool = ThreadPoolExecutor(jobs) if use_threads else ProcessPoolExecutor(jobs)
+    in_flight = {}
+    stats.gauge("files_in_flight", in_flight.__len__)
+    try:
+        for file_path, st in targets:
+            if cache is not None:
+                record = cache.get(file_path, st, details)
+                if record is not None:
+                    stats.count("cache_hits")
+                    yield select_tags(record, wanted)
+                    continue
+                stats.count("cache_misses")
+            if pool is None:
+                yield finish(file_path, st, read(file_path, st))
+                continue
+            if len(in_flight) >= jobs * 4:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield finish(*in_flight.pop(future), future.result())
+            in_flight[pool.submit(read, file_path, st)] = (file_path, st)
+        if pool is not None:
+            for future in as_completed(list(in_flight)):
+                yield finish(*in_flight.pop(future), future.result())
+    finally:
+        stats.remove_gauges("files_in_flight")
+        if pool is not None:
+            pool.shutdown()
+
+class CsvWriter:
+    def __init__(self, out):
+        self.writer = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+        self.writer.writeheader()
+
+    # long format, one row per tag, so rows can be written before knowing every tag name in the dataset
+    def write(self, record):
+        row = {field: record.get(field, "") for field in ("path", "size", "created", "modified", "error")}
+        if not record["tags"]:
+            self.writer.writerow(row)
+        for tag, value in record["tags"].items():
+            self.writer.writerow({**row, "tag": tag, "value": value})
+
+def write_ndjson(record):
+    sys.stdout.write(json.dumps(record) + "\n")
+
 def main():
     parser = argparse.ArgumentParser(
         description="Program to extract image metadata.",
-        usage="scorpion.py [-h] file1 [file2...]"
+        usage="scorpion.py [-h] [-R] [-j JOBS] [--threads] [--format {text,ndjson,csv}] [--tags TAGS] [--fast] [--cache FILE [--has-gps] [--make MAKE] [--model MODEL]] file1 [file2...]"
     )
     parser.add_argument("files", nargs='+', help="The name of the file(s) to extract from.")
+    parser.add_argument("-R", action="store_true", help="Recursively scan directories given as arguments.")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of files processed in parallel (default: number of CPUs with -R, 1 otherwise).")
+    parser.add_argument("--threads", action="store_true", help="Use a thread pool instead of processes (for I/O-bound storage).")
+    parser.add_argument("--format", choices=["text", "ndjson", "csv"], default="text", help="Output format (default: text).")
+    parser.add_argument("--tags", help="Comma-separated tags to report, e.g. 'Make,Model,GPS GPSLatitude' (default: all).")
+    parser.add_argument("--fast", action="store_true", help="Skip MakerNote and thumbnail data.")
+    parser.add_argument("--cache", help="Metadata index file: unchanged files are answered from it instead of being read again.")
+    parser.add_argument("--has-gps", action="store_true", help="Query the index (--cache) for files with GPS tags under the given paths.")
+    parser.add_argument("--make", help="Query the index (--cache) for files from this camera make.")
+    parser.add_argument("--model", help="Query the index (--cache) for files from this camera model.")
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
-    
-    for file_path in args.files:
-        abs_path = os.path.abspath(file_path)
-        
-        if not os.path.exists(abs_path):
-            print(f"Error: File not found - {file_path}")
-            continue
-        
-        process_file(abs_path)
+    querying = args.has_gps or args.make is not None or args.model is not None
+    if querying and not args.cache:
+        parser.error("--has-gps, --make and --model query the index and need --cache")
+
+    if args.format == "ndjson":
+        write = write_ndjson
+    elif args.format == "csv":
+        write = CsvWriter(sys.stdout).write
+    else:
+        write = print_metadata
+
+    wanted = {tag.strip() for tag in args.tags.split(",") if tag.strip()} if args.tags else None
+    jobs = args.jobs or ((os.cpu_count() or 1) if args.R else 1)
+    cache = None
+    if args.cache:
+        from metadata_cache import MetadataCache
+        cache = MetadataCache(args.cache)
+    try:
+        with instrumented(args, "scorpion"):
+            if querying:
+                roots = [os.path.abspath(file_path) for file_path in args.files]
+                records = (select_tags(record, wanted) for record in cache.query(roots, args.has_gps, args.make, args.model))
+            else:
+                records = scan(iter_targets(args.files, args.R), jobs, args.threads, wanted, not args.fast, cache)
+            for record in records:
+                with stats.time("write_seconds"):
+                    write(record)
+            if cache is not None and args.R and not querying:
+                for file_path in args.files:
+                    if os.path.isdir(file_path):
+                        cache.prune(os.path.abspath(file_path))
+    finally:
+        if cache is not None:
+            cache.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
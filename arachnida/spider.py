@@ -1,11 +1,50 @@
 import os
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from crawl_state import CrawlState, Page
+from extractor import UrlScanner, extract_html, extract_refs, scan_text
+from frontier import SpillingFrontier, VisitedUrls, canonicalize_url
+from host_scheduler import HostScheduler, retry_after
+from image_store import ImageStore
+from metrics import add_arguments as add_metrics_arguments, instrumented, stats
+from scorpion import matches, read_buffer_metadata
 from urllib.parse import urljoin, urlparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 import argparse
+import asyncio
+import codecs
+import hashlib
+import itertools
+import json
+import mmap
+import multiprocessing
 import re
+import resource
+import tempfile
+import threading
+import time
 
 DEFAULT_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp"}
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+FETCH_RETRIES = 3
+# documents parsed whole (up to max_size), bodies scanned for URLs as they stream in, and every other type is skipped
+DOCUMENT_CONTENT_TYPES = ("text/html", "application/json")
+SCANNED_CONTENT_TYPES = ("text/plain", "text/css", "text/javascript", "application/javascript",
+                         "application/x-javascript", "application/ecmascript")
+MAX_PAGE_SIZE = 10 * 1024 * 1024
+# links with these extensions (or none) are fetched right away, any other is probed with a HEAD request first
+PAGE_EXTENSIONS = {"", ".html", ".htm", ".xhtml", ".php", ".asp", ".aspx", ".jsp", ".cgi", ".json", ".txt",
+                   ".js", ".mjs", ".css"}
+METADATA_FILENAME = "metadata.ndjson"
+MAX_BUFFERED_IMAGE = 16 * 1024 * 1024
+JSON_STRING_REGEX = re.compile(r'"(?:[^"\\]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*"')
+
+# a fetched response reduced to what extraction needs, small enough to send to a parser process;
+# a scanned body has no text, only the URL references found in it (extractor.UrlScanner)
+Body = namedtuple("Body", "content_type text etag last_modified refs", defaults=(None,))
 
 # This script ONLY processes the STATIC HTML content received from the server!
 # for modern websites that use JavaScript to load images or links dynamically after the initial HTML is rendered
@@ -30,129 +69,180 @@ def extract_links_from_json(data, base_url=None):
 # problem: some URLs might not be images
 # solution: check the content type of the response before downloading the image
 # problem: The script might download the same image multiple times if it appears on multiple pages
-# solution: check if file(name) already exists to avoid duplicates
-def download_images(image_urls, output_dir):
-    os.makedirs(output_dir, exist_ok=True)
+# solution: look the URL up in the content-addressed image store (image_store.py) before requesting it
+# problem: a dropped connection or a 5xx loses the image, and an interrupted write leaves a truncated file behind
+# solution: retry after the server's Retry-After or an exponential backoff, stream into a temp file in the output dir
+# and let the store move it into place
+def is_retryable(error):
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)):
+        return True
+    return isinstance(error, requests.HTTPError) and error.response is not None \
+        and error.response.status_code in RETRY_STATUSES
+
+# returns (temp file path, SHA-256 hex digest of the content)
+def save_chunks(chunks, output_dir):
+    digest = hashlib.sha256()
+    file = tempfile.NamedTemporaryFile("wb", dir=output_dir, suffix=".part", delete=False)
+    size = 0
+    try:
+        with file:
+            for chunk in chunks:
+                file.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.unlink(file.name)
+        raise
+    stats.count("image_bytes", size)
+    return file.name, digest.hexdigest()
+
+def save_response(response, output_dir):
+    return save_chunks(response.iter_content(DOWNLOAD_CHUNK_SIZE), output_dir)
+
+# problem: getting the metadata of the downloaded images takes a separate scorpion run that opens and reads every file again
+# solution: with a sidecar, the response body is kept in memory and scorpion's reader runs on it (through a memoryview,
+# nothing is copied) before it is written. The records go to metadata.ndjson in the output dir, one line per image,
+# and images that don't match the filter (--has-gps, --make, --model) are not saved at all.
+# An image over max_buffer bytes is saved as usual and read back from the temp file (mmapped), so memory stays
+# bounded whatever the image sizes and however many downloaders there are.
+class MetadataSidecar:
+    def __init__(self, output_dir, gps=False, make=None, model=None, max_buffer=MAX_BUFFERED_IMAGE):
+        self.filters = (gps, make, model)
+        self.max_buffer = max_buffer
+        self.lock = threading.Lock()
+        self.file = open(os.path.join(output_dir, METADATA_FILENAME), "a")
+
+    # the scorpion record of the image, or None if it doesn't match the filter
+    def inspect(self, url, body):
+        record = read_buffer_metadata(url, body)
+        return record if matches(record, *self.filters) else None
+
+    def inspect_file(self, url, path):
+        with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return self.inspect(url, mapped)
+
+    def write(self, url, path, record):
+        line = json.dumps({**record, "url": url, "path": path}) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
 
-    for url in image_urls:
+def download_image(session, url, store, retries=3, backoff=0.5, timeout=10, sidecar=None):
+    if store.has_url(url):
+        print(f"Already downloaded, skipping: {url}")
+        stats.count("images_known")
+        return False
+
+    for attempt in range(retries + 1):
         try:
-            response = requests.get(url, stream=True, timeout=10)
-            response.raise_for_status()
-            if response.headers["Content-Type"].startswith("image"):
-                filename = os.path.join(output_dir, os.path.basename(url))
-                if os.path.exists(filename):
-                    print(f"File already exists, skipping: {filename}")
-                    continue
-                with open(filename, "wb") as file:
-                    for chunk in response.iter_content(1024):
-                        file.write(chunk)
-                print(f"Downloaded: {filename}")
-            else:
-                print(f"Skipping: {url} (Not an image)")
+            start = time.perf_counter()
+            with session.get(url, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                if not response.headers.get("Content-Type", "").startswith("image"):
+                    print(f"Skipping: {url} (Not an image)")
+                    stats.count("images_not_image")
+                    return False
+                if sidecar is None:
+                    temp_path, digest = save_response(response, store.output_dir)
+                else:
+                    chunks = response.iter_content(DOWNLOAD_CHUNK_SIZE)
+                    body = bytearray()
+                    temp_path = None
+                    for chunk in chunks:
+                        body += chunk
+                        if len(body) > sidecar.max_buffer:
+                            temp_path, digest = save_chunks(itertools.chain([body], chunks), store.output_dir)
+                            body = None
+                            break
+                    with stats.time("metadata_seconds"):
+                        record = sidecar.inspect(url, body) if temp_path is None else sidecar.inspect_file(url, temp_path)
+                    if record is None:
+                        if temp_path is not None:
+                            os.unlink(temp_path)
+                        print(f"Skipping: {url} (Metadata doesn't match the filter)")
+                        stats.count("images_filtered")
+                        return False
+                    if temp_path is None:
+                        temp_path, digest = save_chunks([body], store.output_dir)
+            stats.observe("image_download_seconds", time.perf_counter() - start)
+            with stats.time("store_seconds"):
+                name, is_new = store.add(url, temp_path, digest)
+                filename = os.path.join(store.output_dir, name)
+                if sidecar is not None:
+                    sidecar.write(url, filename, record)
+            print(f"Downloaded: {filename}" if is_new else f"Duplicate content, linked: {filename}")
+            stats.count("images_downloaded" if is_new else "images_duplicate")
+            return is_new
         except requests.RequestException as e:
-            print(f"Failed to download {url}: {e}")
+            if attempt == retries or not is_retryable(e):
+                print(f"Failed to download {url}: {e}")
+                stats.count("image_errors")
+                return False
+            stats.count("retries")
+            delay = retry_after(e.response) if e.response is not None else None
+        time.sleep(backoff * 2 ** attempt if delay is None else delay)
 
-# problem: Images or links might be stored in attributes other than <img src>
-# solution: Extract images from custom attributes like data-src, div style, CSS styles...
-def is_valid_image_url(url, image_formats):
-    return url and any(url.lower().endswith(ext) for ext in image_formats)
+def download_images(image_urls, output_dir, session=requests, sidecar=None):
+    os.makedirs(output_dir, exist_ok=True)
+    store = ImageStore(output_dir)
+    try:
+        for url in image_urls:
+            download_image(session, url, store, sidecar=sidecar)
+    finally:
+        store.close()
 
-def extract_image_urls(soup, base_url, image_formats):
-    image_urls = []
-    
-    def process_and_add(url):
-        full_url = urljoin(base_url, url)
-        if is_valid_image_url(full_url, image_formats):
-            image_urls.append(full_url)
-    
-    # Standard <img> tags
-    for img_tag in soup.find_all("img"):
-        process_and_add(img_tag.get("src"))
-    
-    # <source> in <picture> or <video>
-    for source in soup.find_all('source', srcset=True):
-        process_and_add(source['srcset'])
-    
-    # Meta og:image
-    for meta in soup.find_all('meta', property="og:image", content=True):
-        process_and_add(meta['content'])
-    
-    # Link icons
-    for link in soup.find_all('link', href=True):
-        process_and_add(link['href'])
-    
-    # Inline styles
-    for div in soup.find_all("div", style=True):
-        style = div.get("style")
-        if "background-image" in style:
-            url = style.split("url(")[1].split(")")[0].strip("'\"")
-            process_and_add(url)
-    
-    # Custom attributes
-    for tag in soup.find_all(attrs={"data-src": True}):
-        process_and_add(tag['data-src'])
-    
-    return image_urls
+# ru_maxrss is in KiB on Linux
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# requests only exposes the time until the response headers arrived (DNS, connect and time to first byte together)
+def record_response(response, *args, **kwargs):
+    stats.count("http_responses", labels=(("status", str(response.status_code)),))
+    stats.observe("http_response_seconds", response.elapsed.total_seconds())
+    return response
+
+# one pooled keep-alive session per crawl instead of a fresh TCP/TLS handshake for every requests.get()
+def make_session(pool_size=10):
+    session = requests.Session()
+    session.hooks["response"].append(record_response)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def same_host(url, netloc):
+    return urlparse(url).netloc == netloc
 
-# subject specifies: URLs must start with http:// or https://. else requests.get() will raise an exception otherwise
-# problem: The script might get stuck in an infinite loop if the website has circular links
-# solution: Keep track of visited URLs and avoid revisiting them
 # problem: some links might not be in the link tag <a href> but in JavaScript code or CSS or the page might not be HTML
-# solution: use bautifulsoup(for html; including alternative link tags) AND regex to find all URLs in the response text and crawl them
+# solution: single-pass HTML extractor (extractor.py; including alternative link tags) AND regex to find all URLs in the response text and crawl them
 # problem: some links might lead to external domains -> crawling unintended websites, wasting resources, or violating website terms of use
 # solution: use netloc to compare the domain of the next URL with the base URL
-def crawl_page(url, output_dir, image_formats, visited, depth, max_depth):
-    if depth > max_depth or url in visited:
-        return []
-
-    visited.add(url)
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        content_type = response.headers.get("Content-Type", "")
-    except requests.RequestException as e:
-        print(f"Failed to fetch {url}: {e}")
-        return []
-
-    print(f"Crawling: {url} (Depth {depth})")
+# works on the decoded body rather than the response, so it can run in a worker process;
+# returns (image_urls, next_urls), shared by the serial and the concurrent crawler
+def extract_from_body(url, content_type, text, image_formats):
+    netloc = urlparse(url).netloc
     image_urls = []
+    next_urls = []
 
     if "text/html" in content_type:
-        soup = BeautifulSoup(response.text, "html.parser")
-        image_urls.extend(extract_image_urls(soup, url, image_formats))
-        for link_tag in soup.find_all("a", href=True):
-            next_url = urljoin(url, link_tag["href"])
-            if urlparse(next_url).netloc == urlparse(url).netloc:
-                image_urls.extend(crawl_page(next_url, output_dir, image_formats, visited, depth + 1, max_depth))
-        for script_tag in soup.find_all("script", src=True):
-            next_url = urljoin(url, script_tag["src"])
-            if urlparse(next_url).netloc == urlparse(url).netloc:
-                image_urls.extend(crawl_page(next_url, output_dir, image_formats, visited, depth + 1, max_depth))
-        for link_tag in soup.find_all("link", href=True):
-            next_url = urljoin(url, link_tag["href"])
-            if urlparse(next_url).netloc == urlparse(url).netloc:
-                image_urls.extend(crawl_page(next_url, output_dir, image_formats, visited, depth + 1, max_depth))
-
-    elif "text/plain" in content_type:
-        text_content = response.text
-        url_regex = r'https?://[^\s"]+'
-        found_links = re.findall(url_regex, text_content)
-        image_regex = r'https?://[^\s"]+\.(jpg|jpeg|png|gif|bmp)'
-        image_urls.extend(re.findall(image_regex, text_content))
-        for next_url in found_links:
-            if urlparse(next_url).netloc == urlparse(url).netloc:
-                image_urls.extend(crawl_page(next_url, output_dir, image_formats, visited, depth + 1, max_depth))
+        image_urls, next_urls = extract_html(text, url, image_formats)
+
+    elif content_type.startswith(SCANNED_CONTENT_TYPES):
+        image_urls, next_urls = extract_refs(scan_text(text), url, image_formats)
 
     elif "application/json" in content_type:
         try:
-            data = response.json()
-            found_links = extract_links_from_json(data, base_url=url)
-            image_urls.extend([link for link in found_links if link.endswith(tuple(image_formats))])
-            for next_url in found_links:
-                if urlparse(next_url).netloc == urlparse(url).netloc:
-                    image_urls.extend(crawl_page(next_url, output_dir, image_formats, visited, depth + 1, max_depth))
-        except Exception as e:
+            data = json.loads(text)
+        except (ValueError, RecursionError) as e:
+            # a document cut at the size limit doesn't parse: its complete strings are still checked for links
             print(f"Error processing JSON at {url}: {e}")
+            data = [json.loads(string, strict=False) for string in JSON_STRING_REGEX.findall(text)]
+        found_links = extract_links_from_json(data, base_url=url)
+        image_urls.extend([link for link in found_links if link.endswith(tuple(image_formats))])
+        next_urls.extend(link for link in found_links if same_host(link, netloc))
 
     elif content_type.startswith("image/"):
         print(f"Direct image found: {url}")
@@ -161,6 +251,372 @@ def crawl_page(url, output_dir, image_formats, visited, depth, max_depth):
     else:
         print(f"Unhandled Content-Type: {content_type}")
 
+    return image_urls, next_urls
+
+# the chunks of a response body, up to max_size bytes; truncated tells whether the body went on past them
+class BoundedBody:
+    def __init__(self, response, url, max_size):
+        self.response = response
+        self.url = url
+        self.max_size = max_size
+        self.truncated = False
+
+    def __iter__(self):
+        size = 0
+        for chunk in self.response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            if size + len(chunk) > self.max_size:
+                print(f"Truncated: {self.url} (over {self.max_size} bytes)")
+                stats.count("pages_truncated")
+                self.truncated = True
+                yield chunk[:self.max_size - size]
+                size = self.max_size
+                break
+            size += len(chunk)
+            yield chunk
+        stats.count("page_bytes", size)
+
+def decode_chunks(chunks, encoding):
+    try:
+        decoder = codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+# problem: response.text holds the whole body twice (bytes and str) whatever its size, and a linked video, archive
+# or script is downloaded in full only to find nothing to parse in it
+# solution: stream the body. Its Content-Type is known from the headers, before any of it is read:
+#   HTML and JSON documents are decoded chunk by chunk and kept up to max_size bytes (a longer one is cut there)
+#   text, JavaScript and CSS go through the incremental URL scan (extractor.UrlScanner) and are never kept whole
+#   images and every other type are not read, unless their body is shorter than a chunk
+# A body cut at max_size ends with a partial URL or tag, which is dropped: the text scan leaves out a match running
+# to the cut and an HTML document is parsed up to its last complete tag (JSON: see extract_from_body).
+def read_body(response, url, max_size):
+    content_type = response.headers.get("Content-Type", "")
+    validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    chunks = BoundedBody(response, url, max_size)
+    if content_type.startswith(SCANNED_CONTENT_TYPES):
+        scanner = UrlScanner()
+        for text in decode_chunks(chunks, response.encoding):
+            scanner.feed(text)
+        return Body(content_type, "", *validators, scanner.close(complete=not chunks.truncated))
+    if not content_type.startswith(DOCUMENT_CONTENT_TYPES):
+        stats.count("pages_not_read")
+        # closing a response before its end drops the keep-alive connection: a short body is cheaper to read
+        length = response.headers.get("Content-Length", "")
+        if length.isdigit() and int(length) <= DOWNLOAD_CHUNK_SIZE:
+            for _ in chunks:
+                pass
+        return Body(content_type, "", *validators)
+    text = "".join(decode_chunks(chunks, response.encoding))
+    if chunks.truncated and "text/html" in content_type:
+        text = text[:text.rfind("<")]
+    return Body(content_type, text, *validators)
+
+def needs_probe(url):
+    return os.path.splitext(urlparse(url).path)[1].lower() not in PAGE_EXTENSIONS
+
+# links with an extension that isn't a page's (PAGE_EXTENSIONS) are probed with a HEAD request first, so an image or
+# an unwanted type costs no GET at all. Returns the Content-Type announced by the HEAD request, or None when the server
+# doesn't answer HEAD requests properly
+def probe_content_type(session, url, timeout):
+    stats.count("pages_probed")
+    try:
+        response = session.head(url, timeout=timeout, allow_redirects=True)
+        response.raise_for_status()
+    except requests.RequestException:
+        return None
+    return response.headers.get("Content-Type")
+
+# problem: re-crawling a mostly unchanged site downloads and parses every page again
+# solution: with a cached Page, ask the server with If-None-Match / If-Modified-Since and reuse the cached page on a 304
+# returns the cached Page on a 304, a Body to extract otherwise, None if the fetch failed.
+# With raise_retryable, a 429/5xx or connection error is raised instead, for the caller to retry later.
+def fetch_body(session, url, depth, timeout=10, cached=None, raise_retryable=False, max_size=MAX_PAGE_SIZE,
+               probe=True):
+    # a cached page of a type that isn't read has no validators to send: it is reused as is, without any request
+    if cached is not None and not (cached.content_type or "").startswith(DOCUMENT_CONTENT_TYPES + SCANNED_CONTENT_TYPES):
+        print(f"Not modified: {url} (Depth {depth}, {cached.content_type or 'no content type'} not read)")
+        return cached
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+    try:
+        start = time.perf_counter()
+        if probe and cached is None and needs_probe(url):
+            content_type = probe_content_type(session, url, timeout)
+            if content_type is not None and not content_type.startswith(DOCUMENT_CONTENT_TYPES + SCANNED_CONTENT_TYPES):
+                print(f"Probed: {url} ({content_type})")
+                stats.count("pages_not_read")
+                return Body(content_type, "", None, None)
+        with session.get(url, timeout=timeout, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            if response.status_code == 304 and cached is not None:
+                print(f"Not modified: {url} (Depth {depth})")
+                body = cached
+            else:
+                print(f"Crawling: {url} (Depth {depth})")
+                body = read_body(response, url, max_size)
+        stats.observe("page_fetch_seconds", time.perf_counter() - start)
+    except requests.RequestException as e:
+        if raise_retryable and is_retryable(e):
+            stats.count("retries")
+            raise
+        print(f"Failed to fetch {url}: {e}")
+        stats.count("page_errors")
+        return None
+    return body
+
+# in a parser process the timing is lost with the process' own registry; crawl_site times the round trip instead
+def page_from_body(url, body, image_formats):
+    with stats.time("extract_seconds"):
+        if body.refs is not None:
+            image_urls, next_urls = extract_refs(body.refs, url, image_formats)
+        else:
+            image_urls, next_urls = extract_from_body(url, body.content_type, body.text, image_formats)
+    return Page(image_urls, next_urls, body.etag, body.last_modified, body.content_type)
+
+def fetch_page(session, url, depth, image_formats, timeout=10, cached=None, raise_retryable=False,
+               max_size=MAX_PAGE_SIZE, probe=True):
+    body = fetch_body(session, url, depth, timeout, cached, raise_retryable, max_size, probe)
+    if body is None or body is cached:
+        return body
+    return page_from_body(url, body, image_formats)
+
+# subject specifies: URLs must start with http:// or https://. else requests.get() will raise an exception otherwise
+# problem: The script might get stuck in an infinite loop if the website has circular links
+# solution: Keep track of visited URLs and avoid revisiting them
+# serial depth-first crawler, kept as the reference implementation (--serial) and benchmark baseline
+# problem: recursing once per link level hits Python's recursion limit on deep sites, and the image lists were
+# copied up the whole call stack
+# solution: walk the same depth-first order with an explicit stack and yield image URLs as they are found
+def iter_crawl(url, image_formats, visited, depth, max_depth, session=requests, max_size=MAX_PAGE_SIZE, probe=True):
+    stack = [(canonicalize_url(url), depth)]
+    while stack:
+        url, depth = stack.pop()
+        if depth > max_depth or url in visited:
+            continue
+
+        visited.add(url)
+        page = fetch_page(session, url, depth, image_formats, max_size=max_size, probe=probe)
+        if page is None:
+            continue
+
+        yield from page.image_urls
+        stack.extend((canonicalize_url(next_url), depth + 1) for next_url in reversed(page.next_urls))
+
+def crawl_page(url, output_dir, image_formats, visited, depth, max_depth, session=requests, max_size=MAX_PAGE_SIZE,
+               probe=True):
+    return list(iter_crawl(url, image_formats, visited, depth, max_depth, session, max_size, probe))
+
+# problem: crawl_page waits on the network for every single page, one after the other
+# solution: breadth-first frontier queue drained by a pool of concurrent fetchers sharing one keep-alive session.
+# With a CrawlState (crawl_state.py) pages are fetched conditionally and the frontier is saved, so a crashed run resumes.
+# Page bodies are streamed and read up to max_size bytes (fetch_body); probe=False skips the HEAD requests.
+async def crawl_site(start_url, image_formats, max_depth, concurrency=16, per_host=8, timeout=10,
+                     output_dir=None, download_workers=8, queue_size=1000, state=None, resume=True, workers=0,
+                     frontier_memory=100_000, collect=True, sidecar=None, rate=None, robots=True,
+                     max_size=MAX_PAGE_SIZE, probe=True):
+    start_url = canonicalize_url(start_url)
+    # memory stays bounded on huge sites (frontier.py): URLs are canonicalized, visited pages and seen images are kept
+    # as 64-bit fingerprints and the frontier spills to disk past frontier_memory URLs
+    visited = VisitedUrls()
+    frontier = SpillingFrontier(frontier_memory, spill_dir=output_dir)
+    if state is not None:
+        run, pending = state.start(start_url, max_depth, resume)
+        for url, depth in run.items():
+            visited[url] = depth
+        if len(run) > len(pending):
+            print(f"Resuming crawl: {len(run) - len(pending)} pages done, {len(pending)} left in the frontier")
+        del run
+    else:
+        visited[start_url] = 0
+        pending = [(start_url, 0)]
+    for url, depth in pending:
+        frontier.put_nowait((depth, url))
+    del pending
+    image_urls = [] if collect else None
+    seen_images = VisitedUrls()
+    images_found = 0
+    downloads = asyncio.Queue(maxsize=queue_size)
+    pages = 0
+    not_modified = 0
+    downloaded = 0
+
+    loop = asyncio.get_running_loop()
+    session = make_session(concurrency + download_workers)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    download_executor = ThreadPoolExecutor(max_workers=download_workers)
+    # problem: once fetching is concurrent, parsing in the fetcher threads keeps a single core busy (GIL) and caps
+    # throughput
+    # solution: with workers > 0 the threads only fetch, and extraction runs in a pool of worker processes that get the
+    # decoded Body and return the Page; the frontier, the visited set and all I/O stay in this process.
+    # Forked while the fetcher, robots and --stats threads run, a worker could inherit a held lock (stats.lock) and
+    # hang on its first page: the workers are started from a clean forkserver process instead
+    parse_pool = None
+    if workers > 0:
+        parse_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"))
+    scheduler = HostScheduler(session, executor, per_host, timeout, rate, robots)
+    store = None
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        store = ImageStore(output_dir)
+    fetch_image = partial(download_image, session, store=store, sidecar=sidecar)
+
+    # with collect=False the image URLs are only streamed to the downloaders instead of being accumulated and returned
+    async def add_image(image_url):
+        nonlocal images_found
+        if image_url not in seen_images:
+            seen_images.add(image_url)
+            images_found += 1
+            if collect:
+                image_urls.append(image_url)
+            if output_dir is not None:
+                await downloads.put(image_url)
+
+    # requests is blocking, so each fetch (and its parsing) runs in a thread pool sized to the number of fetchers, and
+    # every request to a host, downloads included, goes through its HostState (host_scheduler.py): robots.txt, a rate
+    # limit, an in-flight limit adapted to the host's latency (at most per_host) and backoff on 429/503.
+    # A 429/503 or a dropped connection is retried once the host's backoff is over
+    async def fetch(url, depth, cached):
+        for attempt in range(FETCH_RETRIES + 1):
+            last = attempt == FETCH_RETRIES
+            try:
+                async with scheduler.slot(url) as host_timeout:
+                    if parse_pool is None:
+                        fetch_fn = partial(fetch_page, session, url, depth, image_formats)
+                    else:
+                        fetch_fn = partial(fetch_body, session, url, depth)
+                    return await loop.run_in_executor(executor, partial(fetch_fn, host_timeout, cached, not last,
+                                                                        max_size=max_size, probe=probe))
+            except requests.RequestException:
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    # URLs are marked visited (with their depth) when they are queued. Fetchers finish out of order, so a page can first
+    # be found through a longer path: the frontier is a priority queue by depth, and a URL found again at a smaller
+    # depth is queued again, so every page is crawled at the smallest depth it is reachable from and max_depth cuts the
+    # same pages.
+    # A page failing for any other reason than the network (a malformed link, a parser error) is logged and skipped,
+    # so the fetcher goes on with the frontier instead of dying and leaving frontier.join() waiting forever
+    async def process(url, depth):
+        nonlocal pages, not_modified
+        try:
+            cached = state.get_page(url) if state is not None else None
+            if await scheduler.allowed(url):
+                page = await fetch(url, depth, cached)
+            else:
+                print(f"Disallowed by robots.txt: {url}")
+                stats.count("robots_disallowed")
+                page = None
+            if parse_pool is not None and page is not None and page is not cached:
+                start = time.perf_counter()
+                page = await loop.run_in_executor(parse_pool, page_from_body, url, page, image_formats)
+                stats.observe("extract_seconds", time.perf_counter() - start)
+            if page is not None:
+                pages += 1
+                stats.count("pages")
+                if page is cached:
+                    not_modified += 1
+                    stats.count("pages_not_modified")
+                elif state is not None:
+                    state.save_page(url, page)
+                for image_url in page.image_urls:
+                    await add_image(image_url)
+                if depth < max_depth:
+                    for next_url in page.next_urls:
+                        next_url = canonicalize_url(next_url)
+                        if visited.get(next_url, max_depth + 1) > depth + 1:
+                            visited[next_url] = depth + 1
+                            frontier.put_nowait((depth + 1, next_url))
+                            if state is not None:
+                                state.enqueue(next_url, depth + 1)
+        except Exception as e:
+            print(f"Failed to process {url}: {e}")
+            stats.count("page_errors")
+        if state is not None:
+            state.done(url, depth)
+
+    async def fetcher():
+        while True:
+            depth, url = await frontier.get()
+            try:
+                # skip entries superseded by the same URL queued again at a smaller depth
+                if visited.get(url) == depth:
+                    await process(url, depth)
+            finally:
+                frontier.task_done()
+
+    async def download(image_url):
+        # a known URL is skipped by download_image without any request, so it needs no slot
+        if store.has_url(image_url):
+            return await loop.run_in_executor(download_executor, fetch_image, image_url)
+        if not await scheduler.allowed(image_url):
+            print(f"Disallowed by robots.txt: {image_url}")
+            stats.count("robots_disallowed")
+            return False
+        async with scheduler.slot(image_url) as host_timeout:
+            return await loop.run_in_executor(download_executor, partial(fetch_image, image_url, timeout=host_timeout))
+
+    # problem: downloading only after the whole crawl finishes makes the total time crawl + download
+    # solution: when output_dir is given, new image URLs go straight into a bounded queue drained by a pool of
+    # downloaders while the crawl goes on. A full queue makes the fetchers wait, so memory stays bounded however many
+    # images a site has.
+    # A full disk or a store error fails the image, not the downloader: with every downloader gone, the bounded queue
+    # would fill up and block the fetchers for good
+    async def downloader():
+        nonlocal downloaded
+        while True:
+            image_url = await downloads.get()
+            try:
+                if await download(image_url):
+                    downloaded += 1
+            except Exception as e:
+                print(f"Failed to download {image_url}: {e}")
+                stats.count("image_errors")
+            finally:
+                downloads.task_done()
+
+    gauges = {"frontier_urls": frontier.qsize, "download_queue": downloads.qsize, "visited_urls": visited.__len__,
+              "pages_in_flight": lambda: sum(host.in_flight for host in list(scheduler.hosts.values()))}
+    for name, fn in gauges.items():
+        stats.gauge(name, fn)
+
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(fetcher()) for _ in range(concurrency)]
+    if output_dir is not None:
+        tasks += [asyncio.create_task(downloader()) for _ in range(download_workers)]
+    try:
+        if state is not None and output_dir is not None:
+            for image_url in state.done_image_urls():
+                await add_image(image_url)
+        await frontier.join()
+        crawl_elapsed = time.perf_counter() - start
+        await downloads.join()
+        if state is not None:
+            state.finish()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        stats.remove_gauges(*gauges)
+        executor.shutdown(wait=False)
+        frontier.close()
+        if parse_pool is not None:
+            parse_pool.shutdown(cancel_futures=True)
+        download_executor.shutdown(wait=True)
+        session.close()
+        if store is not None:
+            store.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Crawled {pages} pages ({not_modified} not modified) in {crawl_elapsed:.2f}s "
+          f"({pages / crawl_elapsed if crawl_elapsed else 0:.1f} pages/sec), peak RSS {peak_rss_mib():.0f} MiB")
+    if output_dir is not None:
+        print(f"Downloaded {downloaded} of {images_found} images, done after {elapsed:.2f}s")
     return image_urls
 
 
@@ -170,6 +626,24 @@ def main():
     parser.add_argument("-r", action="store_true", help="Enable recursive crawling.")
     parser.add_argument("-l", type=int, default=5, help="Maximum depth level for recursive crawling (default: 5).")
     parser.add_argument("-p", type=str, default="./data", help="Path to save downloaded images (default: ./data).")
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of concurrent page fetchers (default: 16).")
+    parser.add_argument("--per-host", type=int, default=8, help="Maximum concurrent requests to the same host; the actual number adapts to its latency (default: 8).")
+    parser.add_argument("--rate", type=float, default=0, help="Maximum requests per second to the same host (default: 0, only limited by robots.txt Crawl-delay).")
+    parser.add_argument("--ignore-robots", action="store_true", help="Do not fetch or honour robots.txt.")
+    parser.add_argument("--download-workers", type=int, default=8, help="Number of concurrent image downloaders (default: 8).")
+    parser.add_argument("--queue-size", type=int, default=1000, help="Maximum image URLs waiting for a downloader (default: 1000).")
+    parser.add_argument("--workers", type=int, default=0, help="Number of processes parsing pages (default: 0, parse in the fetcher threads).")
+    parser.add_argument("--max-page-size", type=int, default=MAX_PAGE_SIZE, help=f"Bytes read at most from a page; HTML and JSON are cut there, text, scripts and stylesheets are scanned up to there (default: {MAX_PAGE_SIZE}).")
+    parser.add_argument("--no-probe", action="store_true", help="Do not send a HEAD request before fetching links that don't look like pages.")
+    parser.add_argument("--frontier-memory", type=int, default=100_000, help="Pending URLs kept in memory before the frontier spills to disk (default: 100000).")
+    parser.add_argument("--fresh", action="store_true", help="Start a new crawl instead of resuming an interrupted one.")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use or update the crawl state saved in the output directory.")
+    parser.add_argument("--serial", action="store_true", help="Crawl depth-first, then download serially, instead of the concurrent pipeline.")
+    parser.add_argument("--metadata", action="store_true", help=f"Read each image's metadata as it is downloaded and write it to {METADATA_FILENAME} in the output directory.")
+    parser.add_argument("--has-gps", action="store_true", help="Only save images with GPS tags (implies --metadata).")
+    parser.add_argument("--make", help="Only save images from this camera make (implies --metadata).")
+    parser.add_argument("--model", help="Only save images from this camera model (implies --metadata).")
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
 
@@ -178,11 +652,37 @@ def main():
     max_depth = args.l
     output_dir = args.p
 
-    visited = set()
-    image_urls = crawl_page(url, output_dir, DEFAULT_EXTENSIONS, visited, 0, max_depth if recursive else 0)
+    if not recursive:
+        max_depth = 0
+
+    sidecar = None
+    if args.metadata or args.has_gps or args.make is not None or args.model is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        sidecar = MetadataSidecar(output_dir, args.has_gps, args.make, args.model)
 
-    print(f"Found {len(image_urls)} potential image urls. Downloading...")
-    download_images(set(image_urls), output_dir)
+    try:
+        with instrumented(args, "spider"):
+            if args.serial:
+                visited = set()
+                image_urls = set(iter_crawl(url, DEFAULT_EXTENSIONS, visited, 0, max_depth,
+                                            max_size=args.max_page_size, probe=not args.no_probe))
+                print(f"Found {len(image_urls)} potential image urls. Downloading...")
+                download_images(image_urls, output_dir, sidecar=sidecar)
+            else:
+                state = None if args.no_cache else CrawlState(output_dir)
+                try:
+                    asyncio.run(crawl_site(url, DEFAULT_EXTENSIONS, max_depth, args.concurrency, args.per_host,
+                                           output_dir=output_dir, download_workers=args.download_workers,
+                                           queue_size=args.queue_size, state=state, resume=not args.fresh,
+                                           workers=args.workers, frontier_memory=args.frontier_memory, collect=False,
+                                           sidecar=sidecar, rate=args.rate or None, robots=not args.ignore_robots,
+                                           max_size=args.max_page_size, probe=not args.no_probe))
+                finally:
+                    if state is not None:
+                        state.close()
+    finally:
+        if sidecar is not None:
+            sidecar.close()
 
 if __name__ == "__main__":
     main()
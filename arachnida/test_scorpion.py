@@ -0,0 +1,202 @@
+import csv
+import io
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest.mock import patch
+
+import scorpion
+from metadata_reader import read_buffer, read_tags
+from sample_images import camera_tiff, make_corpus
+
+# minimal JPEG: SOI, an APP1 Exif segment holding a little-endian TIFF IFD0 with ASCII tags, EOI
+def make_jpeg(path, tags):
+    entries = sorted(tags.items())
+    data_offset = 8 + 2 + 12 * len(entries) + 4
+    ifd = struct.pack("<H", len(entries))
+    data = b""
+    for tag, text in entries:
+        value = text.encode() + b"\0"
+        if len(value) <= 4:
+            ifd += struct.pack("<HHI", tag, 2, len(value)) + value.ljust(4, b"\0")
+        else:
+            ifd += struct.pack("<HHII", tag, 2, len(value), data_offset + len(data))
+            data += value
+    tiff = b"II*\0" + struct.pack("<I", 8) + ifd + struct.pack("<I", 0) + data
+    app1 = b"Exif\0\0" + tiff
+    with open(path, "wb") as file:
+        file.write(b"\xff\xd8\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 + b"\xff\xd9")
+
+MAKE, MODEL = 0x010F, 0x0110
+
+class TestScorpion(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        os.makedirs(os.path.join(self.root, "a", "b"))
+        make_jpeg(os.path.join(self.root, "top.jpg"), {MAKE: "Canon", MODEL: "EOS 5D"})
+        make_jpeg(os.path.join(self.root, "a", "b", "deep.JPG"), {MAKE: "Nikon"})
+        with open(os.path.join(self.root, "a", "notes.txt"), "w") as file:
+            file.write("not an image")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_main(self, *args):
+        output = StringIO()
+        with patch.object(sys, "argv", ["scorpion.py", *args]), redirect_stdout(output):
+            scorpion.main()
+        return output.getvalue()
+
+    def test_walk_finds_supported_files_only(self):
+        paths = sorted(os.path.relpath(path, self.root) for path, _ in scorpion.iter_image_files(self.root))
+        self.assertEqual(paths, [os.path.join("a", "b", "deep.JPG"), "top.jpg"])
+
+    def test_tiff_based_raw_files(self):
+        path = os.path.join(self.root, "a", "raw.NEF")
+        with open(path, "wb") as file:
+            file.write(camera_tiff(make="Nikon", model="D850"))
+        self.assertIn(path, [found for found, _ in scorpion.iter_image_files(self.root)])
+        record = json.loads(self.run_main("--format", "ndjson", path))
+        self.assertEqual(record["tags"]["Image Make"], "Nikon")
+        self.assertEqual(record["tags"]["Image Model"], "D850")
+        self.assertIn("GPS GPSLatitude", record["tags"])
+
+    def test_read_metadata(self):
+        path = os.path.join(self.root, "top.jpg")
+        record = scorpion.read_metadata(path, os.stat(path))
+        self.assertEqual(record["size"], os.path.getsize(path))
+        self.assertEqual(record["tags"]["Image Make"], "Canon")
+        self.assertEqual(record["tags"]["Image Model"], "EOS 5D")
+
+    def test_recursive_ndjson_with_pool(self):
+        for pool in ([], ["--threads"]):
+            records = [json.loads(line) for line in self.run_main("-R", "-j", "2", *pool, "--format", "ndjson", self.root).splitlines()]
+            makes = sorted(record["tags"]["Image Make"] for record in records)
+            self.assertEqual(makes, ["Canon", "Nikon"])
+
+    def test_pool_yields_records_in_completion_order(self):
+        read_metadata = scorpion.read_metadata
+        def slow_top(file_path, *args):
+            if file_path.endswith("top.jpg"):
+                time.sleep(0.5)
+            return read_metadata(file_path, *args)
+        targets = [(path, os.stat(path)) for path in (os.path.join(self.root, "top.jpg"), os.path.join(self.root, "a", "b", "deep.JPG"))]
+        with patch.object(scorpion, "read_metadata", slow_top):
+            records = list(scorpion.scan(targets, 2, use_threads=True))
+        self.assertEqual([os.path.basename(record["path"]) for record in records], ["deep.JPG", "top.jpg"])
+
+    def test_csv_has_one_row_per_tag(self):
+        rows = list(csv.DictReader(io.StringIO(self.run_main("-R", "-j", "1", "--format", "csv", self.root))))
+        top = [row for row in rows if row["path"].endswith("top.jpg")]
+        self.assertEqual(sorted(row["tag"] for row in top), ["Image Make", "Image Model"])
+
+    def test_text_output_for_single_file(self):
+        output = self.run_main(os.path.join(self.root, "top.jpg"))
+        self.assertIn("Image Make: Canon", output)
+        self.assertIn("EXIF data:", output)
+
+class TestMetadataReader(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.jpeg, self.png, self.gif = make_corpus(self.tmp.name, 3, payload=4096)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_matches_exifread(self):
+        import exifread
+        for path in (self.jpeg, self.png):
+            with open(path, "rb") as file:
+                expected = {tag: str(value) for tag, value in exifread.process_file(file).items()}
+            tags = {tag: str(value) for tag, value in read_tags(path).items()}
+            self.assertEqual({tag: tags[tag] for tag in expected}, expected)
+
+    def test_comments_and_text_chunks(self):
+        self.assertEqual(read_tags(self.jpeg)["JPEG Comment"], "sample 0")
+        self.assertEqual(read_tags(self.png)["PNG Software"], "sample_images")
+        self.assertEqual(read_tags(self.gif), {"GIF Comment": "sample 2"})
+
+    def test_fast_skips_maker_note_and_thumbnail(self):
+        tags = read_tags(self.jpeg, details=False)
+        self.assertIn("GPS GPSLatitude", tags)
+        self.assertNotIn("EXIF MakerNote", tags)
+        self.assertNotIn("JPEGThumbnail", tags)
+
+    def test_wanted_tags_only(self):
+        tags = read_tags(self.jpeg, {"Make", "GPS GPSLatitude"})
+        self.assertEqual(sorted(tags), ["GPS GPSLatitude", "Image Make"])
+
+    def test_truncated_or_unknown_buffers(self):
+        self.assertEqual(read_buffer(b""), {})
+        self.assertEqual(read_buffer(b"BM not an image"), {})
+        self.assertEqual(str(read_buffer(b"\xff\xd8\xff\xe1\x00\x10Exif\0\0" + camera_tiff()[:200])["Image Make"]), "Canon")
+
+    def test_tags_and_fast_options(self):
+        output = StringIO()
+        with patch.object(sys, "argv", ["scorpion.py", "--format", "ndjson", "--fast", "--tags", "Model, PNG Comment", self.png]), \
+                redirect_stdout(output):
+            scorpion.main()
+        self.assertEqual(json.loads(output.getvalue())["tags"], {"Image Model": "Model 1", "PNG Comment": "sample 1"})
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, "images")
+        self.paths = make_corpus(self.root, 6, payload=1024)
+        self.cache = os.path.join(self.tmp.name, "index.sqlite")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_main(self, *args):
+        output = StringIO()
+        with patch.object(sys, "argv", ["scorpion.py", "--cache", self.cache, "--format", "ndjson", *args]), \
+                redirect_stdout(output):
+            scorpion.main()
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_unchanged_files_are_not_read_again(self):
+        first = self.run_main("-R", "-j", "1", self.root)
+        with patch.object(scorpion, "read_tags", side_effect=AssertionError("file was read")):
+            second = self.run_main("-R", "-j", "1", self.root)
+        self.assertEqual(sorted(first, key=lambda record: record["path"]), sorted(second, key=lambda record: record["path"]))
+
+    def test_changed_file_is_read_again(self):
+        self.run_main("-R", "-j", "1", self.root)
+        make_jpeg(self.paths[0], {MAKE: "Leica"})
+        records = self.run_main("-j", "1", self.paths[0])
+        self.assertEqual(records[0]["tags"]["Image Make"], "Leica")
+
+    def test_fast_records_do_not_answer_full_scans(self):
+        self.run_main("-R", "-j", "1", "--fast", self.root)
+        records = self.run_main("-j", "1", self.paths[0])
+        self.assertIn("EXIF MakerNote", records[0]["tags"])
+
+    def test_stats_line_counts_cache_hits(self):
+        self.run_main("-R", "-j", "1", self.root)
+        with patch.object(sys, "stderr", StringIO()) as stderr:
+            self.run_main("-R", "-j", "1", "--stats", "60", self.root)
+        counters = json.loads(stderr.getvalue())["counters"]
+        self.assertEqual(counters["cache_hits"], 6)
+        self.assertNotIn("files_read", counters)
+
+    def test_queries_and_prune(self):
+        self.run_main("-R", "-j", "2", "--threads", "--tags", "Make", self.root)
+        gps = {record["path"] for record in self.run_main("--has-gps", self.root)}
+        self.assertEqual(gps, {self.paths[0], self.paths[4]})
+        nikon = self.run_main("--make", "nikon", "--tags", "Model", self.root)
+        self.assertEqual([record["tags"] for record in nikon], [{"Image Model": "Model 1"}, {"Image Model": "Model 4"}])
+
+        os.remove(self.paths[4])
+        self.run_main("-R", "-j", "1", self.root)
+        self.assertEqual([record["path"] for record in self.run_main("--has-gps", self.root)], [self.paths[0]])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,419 @@
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+import unittest.mock
+from contextlib import redirect_stdout
+from io import StringIO
+
+from bench_spider import start_server, synthetic_site_handler
+from bench_stream import crawl, large_asset_handler, streamed_fetch_page
+from crawl_state import CrawlState, Page
+from extractor import UrlScanner, etree, extract_html, scan_text
+from frontier import SpillingFrontier, VisitedUrls, canonicalize_url
+from host_scheduler import HostState, TokenBucket
+from image_store import ImageStore
+from metrics import Metrics, stats
+from spider import DEFAULT_EXTENSIONS, METADATA_FILENAME, MetadataSidecar, crawl_page, crawl_site, fetch_page, make_session
+
+class LocalSiteTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_server(synthetic_site_handler(pages=20, fanout=2, latency=0))
+        cls.start_url = f"http://127.0.0.1:{cls.server.server_port}/0.html"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+class TestCrawlSite(LocalSiteTestCase):
+    def crawl(self, max_depth):
+        with redirect_stdout(StringIO()):
+            return asyncio.run(crawl_site(self.start_url, DEFAULT_EXTENSIONS, max_depth, concurrency=4, per_host=2))
+
+    def test_depth_zero_only_fetches_start_page(self):
+        self.assertEqual(self.crawl(0), [self.start_url.replace("0.html", "img/0.png")])
+
+    def test_respects_max_depth(self):
+        # each page links to the next two, so depth 2 reaches pages 0..4
+        self.assertEqual(len(self.crawl(2)), 5)
+
+    def test_matches_serial_crawler(self):
+        with redirect_stdout(StringIO()):
+            serial = crawl_page(self.start_url, None, DEFAULT_EXTENSIONS, set(), 0, 20)
+        self.assertEqual(set(self.crawl(20)), set(serial))
+
+    def test_parser_processes_match_threads(self):
+        with redirect_stdout(StringIO()):
+            in_processes = asyncio.run(crawl_site(self.start_url, DEFAULT_EXTENSIONS, 20, concurrency=4, per_host=2,
+                                                  workers=2))
+        self.assertEqual(set(in_processes), set(self.crawl(20)))
+
+    def test_spilled_frontier_reaches_every_page(self):
+        with redirect_stdout(StringIO()):
+            image_urls = asyncio.run(crawl_site(self.start_url, DEFAULT_EXTENSIONS, 20, concurrency=4, per_host=2,
+                                                frontier_memory=2, collect=True))
+        self.assertEqual(len(image_urls), 20)
+
+    def test_downloads_while_crawling(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            with redirect_stdout(StringIO()):
+                asyncio.run(crawl_site(self.start_url, DEFAULT_EXTENSIONS, 20, concurrency=4, per_host=4,
+                                       output_dir=output_dir, download_workers=2, queue_size=2))
+            images = [name for name in os.listdir(output_dir) if name.endswith(".png")]
+            self.assertEqual(sorted(images), sorted(f"{page}.png" for page in range(20)))
+
+    def test_metadata_sidecar_filters_downloads(self):
+        self.check_sidecar_filters_downloads()
+
+    # images over the buffer limit are read back from the temp file instead of memory
+    def test_metadata_sidecar_reads_large_images_from_file(self):
+        self.check_sidecar_filters_downloads(max_buffer=256)
+
+    def check_sidecar_filters_downloads(self, **options):
+        with tempfile.TemporaryDirectory() as output_dir:
+            sidecar = MetadataSidecar(output_dir, gps=True, **options)
+            with redirect_stdout(StringIO()):
+                asyncio.run(crawl_site(self.start_url, DEFAULT_EXTENSIONS, 20, concurrency=4, per_host=4,
+                                       output_dir=output_dir, download_workers=2, sidecar=sidecar))
+            sidecar.close()
+            images = [name for name in os.listdir(output_dir) if name.endswith(".png")]
+            self.assertEqual(sorted(images), sorted(f"{page}.png" for page in range(0, 20, 2)))
+            with open(os.path.join(output_dir, METADATA_FILENAME)) as file:
+                records = [json.loads(line) for line in file]
+            self.assertEqual(sorted(record["tags"]["Image Model"] for record in records),
+                             sorted(f"Model {page}" for page in range(0, 20, 2)))
+            self.assertTrue(all(record["path"] == os.path.join(output_dir, os.path.basename(record["url"])) for record in records))
+
+# every page but the start page carries a link urljoin can't parse
+class BadLinkSite(synthetic_site_handler(pages=5, fanout=1, latency=0)):
+    def send_body(self, body, content_type, etag=None):
+        if content_type == "text/html" and self.path != "/0.html":
+            body = body.replace(b"<body>", b'<body><a href="http://[::1">bad</a>')
+        super().send_body(body, content_type, etag)
+
+class TestBadPages(unittest.TestCase):
+    def test_bad_link_fails_the_page_not_the_crawl(self):
+        stats.reset()
+        server = start_server(BadLinkSite)
+        start_url = f"http://127.0.0.1:{server.server_port}/0.html"
+        try:
+            with redirect_stdout(StringIO()) as output:
+                image_urls = asyncio.run(asyncio.wait_for(
+                    crawl_site(start_url, DEFAULT_EXTENSIONS, 5, concurrency=2, per_host=2), timeout=10))
+        finally:
+            server.shutdown()
+        self.assertEqual(image_urls, [start_url.replace("0.html", "img/0.png")])
+        self.assertIn("Failed to process", output.getvalue())
+        self.assertEqual(stats.snapshot()["counters"]["page_errors"], 1)
+
+    def test_failing_downloads_dont_stop_the_crawl(self):
+        stats.reset()
+        server = start_server(synthetic_site_handler(pages=10, fanout=1, latency=0))
+        sidecar = unittest.mock.Mock()
+        sidecar.inspect.side_effect = OSError(28, "No space left on device")
+        try:
+            with tempfile.TemporaryDirectory() as output_dir, redirect_stdout(StringIO()):
+                asyncio.run(asyncio.wait_for(
+                    crawl_site(f"http://127.0.0.1:{server.server_port}/0.html", DEFAULT_EXTENSIONS, 10,
+                               concurrency=2, output_dir=output_dir, download_workers=1, queue_size=1,
+                               sidecar=sidecar), timeout=10))
+        finally:
+            server.shutdown()
+        self.assertEqual(stats.snapshot()["counters"]["image_errors"], 10)
+
+class TestCrawlState(LocalSiteTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.state = CrawlState(self.tmp.name)
+
+    def tearDown(self):
+        self.state.close()
+        self.tmp.cleanup()
+
+    def crawl_with_state(self, max_depth):
+        output = StringIO()
+        with redirect_stdout(output):
+            image_urls = asyncio.run(crawl_site(self.start_url, DEFAULT_EXTENSIONS, max_depth,
+                                                concurrency=4, per_host=2, state=self.state))
+        return image_urls, output.getvalue()
+
+    def test_recrawl_uses_conditional_requests(self):
+        first, _ = self.crawl_with_state(3)
+        second, output = self.crawl_with_state(3)
+        self.assertEqual(set(first), set(second))
+        self.assertIn("Not modified:", output)
+        self.assertNotIn("Crawling:", output)
+
+    def test_resumes_saved_frontier(self):
+        base = self.start_url.rsplit("/", 1)[0]
+        # state left behind by a run that crashed right after the start page
+        self.state.start(self.start_url, 1)
+        self.state.save_page(self.start_url, Page([f"{base}/img/0.png"], [f"{base}/1.html"], None, None, "text/html"))
+        self.state.enqueue(f"{base}/1.html", 1)
+        self.state.done(self.start_url, 0)
+
+        image_urls, output = self.crawl_with_state(1)
+        self.assertIn("Resuming crawl", output)
+        self.assertEqual(image_urls, [f"{base}/img/1.png"])
+
+class PickySite(synthetic_site_handler(pages=20, fanout=2, latency=0)):
+    rate_limited = set()
+
+    def do_GET(self):
+        if self.path == "/robots.txt":
+            self.send_body(b"User-agent: *\nDisallow: /1.html\nCrawl-delay: 0.001\n", "text/plain")
+        elif self.path.startswith("/img/") and self.path not in self.rate_limited:
+            # every image is refused once
+            self.rate_limited.add(self.path)
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            super().do_GET()
+
+class TestHostScheduler(unittest.TestCase):
+    def test_robots_and_rate_limited_downloads(self):
+        server = start_server(PickySite)
+        try:
+            start_url = f"http://127.0.0.1:{server.server_port}/0.html"
+            with tempfile.TemporaryDirectory() as output_dir, redirect_stdout(StringIO()) as output:
+                asyncio.run(crawl_site(start_url, DEFAULT_EXTENSIONS, 20, concurrency=4, per_host=4,
+                                       output_dir=output_dir, download_workers=2))
+                images = [name for name in os.listdir(output_dir) if name.endswith(".png")]
+        finally:
+            server.shutdown()
+        self.assertIn("Disallowed by robots.txt: " + start_url.replace("0.html", "1.html"), output.getvalue())
+        self.assertEqual(sorted(images), sorted(f"{page}.png" for page in range(20) if page != 1))
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10)
+        delays = [bucket.reserve() for _ in range(3)]
+        self.assertEqual(delays[0], 0)
+        self.assertAlmostEqual(delays[1], 0.1, delta=0.01)
+        self.assertAlmostEqual(delays[2], 0.2, delta=0.01)
+
+    def test_aimd_limit(self):
+        host = HostState(max_concurrency=8, timeout=10)
+        host.observe(429, 0.01, delay=5)
+        self.assertEqual(host.limit, 4)
+        self.assertGreater(host.resume_at, time.monotonic() + 4)
+        for _ in range(50):
+            host.observe(200, 0.01)
+        self.assertEqual(host.limit, 8)
+        self.assertEqual(host.timeout, 3)
+        for _ in range(20):
+            host.observe(200, 0.5)
+        self.assertEqual(host.limit, 8)
+        host.decreased_at -= 1
+        host.observe(200, 0.5)
+        self.assertEqual(host.limit, 4)
+
+class TestMetrics(unittest.TestCase):
+    def test_prometheus_and_json_export(self):
+        metrics = Metrics()
+        metrics.count("http_responses", labels=(("status", "200"),))
+        metrics.count("http_responses", 2, labels=(("status", "200"),))
+        for seconds in (0.002, 0.003, 0.2):
+            metrics.observe("fetch_seconds", seconds)
+        metrics.gauge("queue", lambda: 7)
+
+        text = metrics.to_prometheus("spider")
+        self.assertIn('spider_http_responses_total{status="200"} 3', text)
+        self.assertIn('spider_fetch_seconds_bucket{le="0.005"} 2', text)
+        self.assertIn('spider_fetch_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn("spider_queue 7", text)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["histograms"]["fetch_seconds"]["p50"], 0.005)
+        self.assertEqual(snapshot["gauges"], {"queue": 7})
+
+    def test_crawl_records_stages(self):
+        stats.reset()
+        server = start_server(synthetic_site_handler(pages=5, fanout=1, latency=0))
+        try:
+            with tempfile.TemporaryDirectory() as output_dir, redirect_stdout(StringIO()):
+                asyncio.run(crawl_site(f"http://127.0.0.1:{server.server_port}/0.html", DEFAULT_EXTENSIONS, 5,
+                                       concurrency=2, output_dir=output_dir, download_workers=1))
+        finally:
+            server.shutdown()
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot["counters"]["pages"], 5)
+        self.assertEqual(snapshot["counters"]["images_downloaded"], 5)
+        self.assertEqual(snapshot["histograms"]["extract_seconds"]["count"], 5)
+        self.assertEqual(snapshot["gauges"], {})
+
+class TestFrontier(unittest.TestCase):
+    def test_canonicalize_url(self):
+        self.assertEqual(canonicalize_url("HTTP://Example.COM:80#top"), "http://example.com/")
+        self.assertEqual(canonicalize_url("https://example.com:8443/a?b=1#c"), "https://example.com:8443/a?b=1")
+
+    def test_visited_urls_keeps_depths_across_growth(self):
+        visited = VisitedUrls(capacity=4)
+        for i in range(1000):
+            visited[f"http://example.com/{i}"] = i % 7
+        self.assertEqual(len(visited), 1000)
+        self.assertEqual(visited.get("http://example.com/999"), 999 % 7)
+        self.assertIn("http://example.com/0", visited)
+        self.assertIsNone(visited.get("http://example.com/1000"))
+
+    def test_spilling_frontier_serves_smallest_depth_first(self):
+        async def drain():
+            frontier = SpillingFrontier(memory_limit=3)
+            for i in range(10):
+                frontier.put_nowait((i % 3, f"url{i}"))
+            items = []
+            while not frontier.empty():
+                items.append(await frontier.get())
+            frontier.close()
+            return items
+
+        items = asyncio.run(drain())
+        self.assertEqual(sorted(items), sorted((i % 3, f"url{i}") for i in range(10)))
+        self.assertEqual([depth for depth, _ in items], sorted(depth for depth, _ in items))
+
+class TestImageStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ImageStore(self.tmp.name)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def add(self, url, content):
+        temp_path = os.path.join(self.tmp.name, "download.part")
+        with open(temp_path, "wb") as file:
+            file.write(content)
+        return self.store.add(url, temp_path, hashlib.sha256(content).hexdigest())
+
+    def test_same_name_different_content_keeps_both(self):
+        first, _ = self.add("http://a.example/image.jpg", b"first")
+        second, is_new = self.add("http://b.example/image.jpg", b"second")
+        self.assertTrue(is_new)
+        self.assertNotEqual(first, second)
+        with open(os.path.join(self.tmp.name, second), "rb") as file:
+            self.assertEqual(file.read(), b"second")
+
+    def test_same_content_different_url_is_linked(self):
+        self.add("http://cdn1.example/a.jpg", b"same")
+        name, is_new = self.add("http://cdn2.example/b.jpg", b"same")
+        self.assertFalse(is_new)
+        self.assertTrue(os.path.samefile(os.path.join(self.tmp.name, "a.jpg"), os.path.join(self.tmp.name, name)))
+        self.assertTrue(self.store.has_url("http://cdn2.example/b.jpg"))
+
+    def test_same_name_as_a_suffixed_file_is_not_linked_again(self):
+        self.add("http://a.example/x.jpg", b"one")
+        second, _ = self.add("http://b.example/x.jpg", b"two")
+        third, is_new = self.add("http://c.example/x.jpg", b"two")
+        self.assertEqual(third, second)
+        self.assertFalse(is_new)
+        self.assertTrue(self.store.has_url("http://c.example/x.jpg"))
+        self.assertEqual(sorted(name for name in os.listdir(self.tmp.name) if name.endswith(".jpg")), sorted(["x.jpg", second]))
+
+    def test_index_survives_reopen(self):
+        self.add("http://a.example/image.jpg", b"content")
+        self.store.close()
+        self.store = ImageStore(self.tmp.name)
+        self.assertTrue(self.store.has_url("http://a.example/image.jpg"))
+        self.assertFalse(self.store.has_url("http://a.example/other.jpg"))
+
+class TestExtractHtml(unittest.TestCase):
+    PAGE = """<html><head>
+        <style>.hero { background: url("/img/hero.png") no-repeat }</style>
+        <meta property="og:image" content="https://example.com/og.jpg">
+        <link rel="icon" href="/favicon.png"><script src="/app.js"></script>
+        </head><body>
+        <a href="about.html">about</a> <a href="https://other.example/x.html">external</a>
+        <a href="//example.com/proto.html">protocol relative</a> <a href="mailto:me@example.com">mail</a>
+        <img src="/a.jpg" srcset="/a-1x.jpg 1x, /a-2x.jpg 2x"> <img src="/a.jpg">
+        <div style="background-image: url('/bg.gif')" data-src="/lazy.bmp"></div>
+        <img src="/not-an-image.svg">
+        </body></html>"""
+
+    IMAGES = ["http://example.com/img/hero.png", "https://example.com/og.jpg", "http://example.com/favicon.png",
+              "http://example.com/a.jpg", "http://example.com/a-1x.jpg", "http://example.com/a-2x.jpg",
+              "http://example.com/bg.gif", "http://example.com/lazy.bmp"]
+    LINKS = ["http://example.com/favicon.png", "http://example.com/app.js", "http://example.com/dir/about.html",
+             "http://example.com/proto.html"]
+
+    def extract(self, use_lxml):
+        return extract_html(self.PAGE, "http://example.com/dir/index.html", DEFAULT_EXTENSIONS, use_lxml)
+
+    def test_html_parser(self):
+        image_urls, next_urls = self.extract(use_lxml=False)
+        self.assertEqual(sorted(image_urls), sorted(self.IMAGES))
+        self.assertEqual(sorted(next_urls), sorted(self.LINKS))
+
+    @unittest.skipIf(etree is None, "lxml is not installed")
+    def test_lxml_matches_html_parser(self):
+        self.assertEqual(self.extract(use_lxml=True), self.extract(use_lxml=False))
+
+class TestStreamedBodies(unittest.TestCase):
+    ASSET_SIZE = 300_000
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bytes_sent = multiprocessing.Value("q", 0)
+        cls.server = start_server(large_asset_handler(cls.ASSET_SIZE, cls.bytes_sent))
+        cls.base = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        self.session = make_session(1)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_scan_across_chunk_boundaries(self):
+        text = 'a { background: url("/img/a.png") } see http://example.com/b.html then url(c.gif)\n' * 3
+        expected = scan_text(text)
+        self.assertEqual(expected, [(True, "/img/a.png"), (False, "http://example.com/b.html"), (True, "c.gif")])
+        for cut in range(1, len(text)):
+            scanner = UrlScanner()
+            scanner.feed(text[:cut])
+            scanner.feed(text[cut:])
+            self.assertEqual(scanner.close(), expected)
+
+    def test_scripts_and_stylesheets_are_scanned_and_binaries_skipped(self):
+        self.bytes_sent.value = 0
+        with redirect_stdout(StringIO()):
+            pages, image_urls = crawl(lambda url: streamed_fetch_page(self.session, url, DEFAULT_EXTENSIONS, 10 ** 9),
+                                      f"{self.base}/index.html")
+        self.assertEqual(pages, 8)
+        for name in ("js-0", "css-0", "txt-0", "json-last", "html-0"):
+            self.assertIn(f"{self.base}/img/{name}.png", image_urls)
+        # the video and the archive are only probed with a HEAD request
+        self.assertLess(self.bytes_sent.value, 5.5 * self.ASSET_SIZE)
+
+    def test_recrawl_doesnt_fetch_probed_binaries_again(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            state = CrawlState(output_dir)
+            try:
+                for _ in range(2):
+                    with redirect_stdout(StringIO()) as output:
+                        asyncio.run(crawl_site(f"{self.base}/index.html", DEFAULT_EXTENSIONS, 1, concurrency=2,
+                                               state=state, max_size=10_000))
+            finally:
+                state.close()
+        self.assertIn(f"Not modified: {self.base}/video.mp4", output.getvalue())
+        self.assertNotIn(f"Crawling: {self.base}/video.mp4", output.getvalue())
+
+    def test_bodies_are_cut_at_max_size(self):
+        for path in ("/data.txt", "/app.js", "/data.json", "/big.html"):
+            with redirect_stdout(StringIO()) as output:
+                page = fetch_page(self.session, self.base + path, 0, DEFAULT_EXTENSIONS, max_size=10_000)
+            self.assertIn("Truncated:", output.getvalue())
+            self.assertTrue(0 < len(page.image_urls) < 300)
+            # no partial URL from the cut
+            self.assertTrue(all(url.endswith(".png") for url in page.image_urls))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FT_OTP = os.path.join(ROOT, "ft_otp", "ft_otp.py")
+SCORPION = os.path.join(ROOT, "arachnida", "scorpion.py")
+DEFAULT_BUDGET = 30
+
+sys.path.insert(0, os.path.join(ROOT, "arachnida"))
+from sample_images import camera_tiff, make_jpeg
+
+# Startup cost of the short-lived CLIs (ft_otp, scorpion), as scripts calling them thousands of times a day pay it.
+# Every command runs `--runs` times in a scratch directory holding a seed, an encrypted key, a sample image and a
+# scorpion index; its overhead is the fastest wall time minus the one of `python -c pass`, the interpreter's own
+# startup (the minimum, as anything slower is noise from the rest of the machine). One more run under
+# `python -X importtime` names the imports costing the most.
+# Bytecode caching is forced on (PYTHONDONTWRITEBYTECODE is dropped) and every command is run once before being
+# timed, so modules are loaded from their .pyc like in an installed tool, not compiled on every run.
+# Exits with status 1 when a command's overhead is over the budget (--budget milliseconds).
+
+COMMANDS = [
+    ("ft_otp -h", [FT_OTP, "-h"]),
+    ("ft_otp -m", [FT_OTP, "-m"]),
+    ("ft_otp -k ft_otp.key", [FT_OTP, "-k", "ft_otp.key"]),
+    ("scorpion -h", [SCORPION, "-h"]),
+    ("scorpion photo.jpg", [SCORPION, "photo.jpg"]),
+    ("scorpion --cache --has-gps", [SCORPION, "--cache", "index.db", "--has-gps", "."]),
+]
+
+ENV = {name: value for name, value in os.environ.items() if name != "PYTHONDONTWRITEBYTECODE"}
+
+def prepare(directory):
+    run = lambda *args: subprocess.run([sys.executable, *args], cwd=directory, env=ENV, check=True,
+                                       stdout=subprocess.DEVNULL)
+    run(FT_OTP, "-s")
+    with open(os.path.join(directory, "key.hex"), "w") as file:
+        file.write(os.urandom(64).hex())
+    run(FT_OTP, "-g", "key.hex")
+    make_jpeg(os.path.join(directory, "photo.jpg"), camera_tiff(gps=True))
+    run(SCORPION, "--cache", "index.db", "photo.jpg")
+
+def wall_times(argv, directory, runs):
+    times = []
+    for _ in range(runs + 1):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *argv], cwd=directory, env=ENV, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times[1:]
+
+# {module: cumulative microseconds} for the modules imported at top level (not by another module)
+def top_level_imports(argv, directory):
+    result = subprocess.run([sys.executable, "-X", "importtime", *argv], cwd=directory, env=ENV,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name[1:].startswith(" "):
+            imports[name.strip()] = int(cumulative)
+    return imports
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup overhead of ft_otp and scorpion commands.")
+    parser.add_argument("--runs", type=int, default=20, help="Runs per command (default: 20).")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET, help=f"Allowed overhead over `python -c pass` in milliseconds (default: {DEFAULT_BUDGET}).")
+    parser.add_argument("--top", type=int, default=3, help="Slowest imports shown per command (default: 3).")
+    args = parser.parse_args()
+
+    over = []
+    with tempfile.TemporaryDirectory() as directory:
+        prepare(directory)
+        baseline = min(wall_times(["-c", "pass"], directory, args.runs))
+        interpreter_imports = top_level_imports(["-c", "pass"], directory)
+        print(f"{'python -c pass':28} {baseline * 1000:7.1f} ms")
+        for name, argv in COMMANDS:
+            overhead = (min(wall_times(argv, directory, args.runs)) - baseline) * 1000
+            imports = {module: micros for module, micros in top_level_imports(argv, directory).items()
+                       if module not in interpreter_imports}
+            slowest = sorted(imports.items(), key=lambda item: -item[1])[:args.top]
+            verdict = "ok" if overhead <= args.budget else "OVER BUDGET"
+            print(f"{name:28} {overhead:+7.1f} ms  {verdict:11}  "
+                  + ", ".join(f"{module} {micros / 1000:.1f} ms" for module, micros in slowest))
+            if overhead > args.budget:
+                over.append(name)
+    if over:
+        print(f"Over the {args.budget:g} ms budget: {', '.join(over)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
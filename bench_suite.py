@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import sys
+import tempfile
+import time
+import traceback
+from contextlib import redirect_stdout
+from io import StringIO
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(ROOT, "arachnida"), os.path.join(ROOT, "ft_otp")]
+
+from bench_spider import start_server_process
+from metrics import stats
+from sample_images import make_corpus
+from scorpion import iter_image_files, scan, timed_read_metadata
+from spider import DEFAULT_EXTENSIONS, crawl_site
+from totp import TotpEngine
+
+DEFAULT_TOLERANCE = 0.15
+
+# Throughput and regression benchmark of the whole repository.
+# Each workload runs in a forked process, so its peak RSS is its own (on top of the imports it shares with the suite).
+# Forked, not spawned: a spawned child would make scorpion's process pool spawn its workers too, which is not what
+# scorpion does when run on its own.
+#   spider:   concurrent crawl of a local synthetic site (bench_spider's fixture server, in a third process) with HTML,
+#             JSON and text pages, link cycles, images and a few slow responses: pages/sec, MB/s
+#   scorpion: a generated corpus of JPEG/PNG/GIF files with EXIF, read one by one (per-file latency) and through a
+#             process pool (files/sec, MB/s)
+#   totp:     code generation and verification for many accounts with TotpEngine, with a window of one time step on
+#             each side: codes/sec, verifications/sec
+# The results are written as JSON (--output). Given a --baseline from an earlier run, every metric that got worse by
+# more than --tolerance is flagged and the exit status is 1. --repeat runs every workload several times and keeps the
+# best value of each metric, which filters out most of the noise from the rest of the machine. --quick shrinks every
+# workload for a smoke run.
+# Numbers only compare across runs of the same machine: keep one baseline per machine and don't commit it.
+
+# metric name -> "higher" or "lower" is better
+DIRECTIONS = {"per_sec": "higher", "mb_per_sec": "higher", "ms": "lower", "mib": "lower"}
+
+def direction(metric):
+    for suffix, better in DIRECTIONS.items():
+        if metric.endswith(suffix):
+            return better
+    return "higher"
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def spider_workload(options):
+    server, port = start_server_process(options["pages"], 3, options["latency"], options["image_size"],
+                                        options["page_size"], 5, 7, 25, 0.1)
+    try:
+        with tempfile.TemporaryDirectory() as output_dir, redirect_stdout(StringIO()):
+            start = time.perf_counter()
+            asyncio.run(crawl_site(f"http://127.0.0.1:{port}/0.html", DEFAULT_EXTENSIONS, options["pages"], 16, 16,
+                                   output_dir=output_dir, download_workers=8))
+            elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+    snapshot = stats.snapshot()
+    counters, fetches = snapshot["counters"], snapshot["histograms"]["page_fetch_seconds"]
+    return {
+        "pages_per_sec": counters["pages"] / elapsed,
+        "mb_per_sec": (counters.get("page_bytes", 0) + counters.get("image_bytes", 0)) / elapsed / 2 ** 20,
+        "page_fetch_p99_ms": fetches["p99"] * 1000,
+        "peak_rss_mib": peak_rss_mib(),
+    }
+
+def scorpion_workload(options):
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_corpus(directory, options["files"], options["payload"])
+        total_bytes = sum(os.path.getsize(path) for path in paths)
+        # the first read imports exifread: that is startup time (bench_startup.py), not per-file latency
+        timed_read_metadata(paths[0], os.stat(paths[0]))
+        latencies = []
+        start = time.perf_counter()
+        for path in paths:
+            latencies.append(timed_read_metadata(path, os.stat(path))[1])
+        serial = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in scan(iter_image_files(directory), options["jobs"]):
+            pass
+        parallel = time.perf_counter() - start
+    return {
+        "read_p50_ms": percentile(latencies, 0.5) * 1000,
+        "read_p99_ms": percentile(latencies, 0.99) * 1000,
+        "serial_files_per_sec": len(paths) / serial,
+        "parallel_files_per_sec": len(paths) / parallel,
+        "parallel_mb_per_sec": total_bytes / parallel / 2 ** 20,
+        "peak_rss_mib": peak_rss_mib(),
+    }
+
+def totp_workload(options):
+    engine = TotpEngine({f"account{i}": os.urandom(20) for i in range(options["accounts"])})
+    at = time.time()
+    start = time.perf_counter()
+    codes = engine.codes(at=at, window=1)
+    generate = time.perf_counter() - start
+    attempts = [(name, engine.format(row[1])) for name, row in codes.items()]
+    start = time.perf_counter()
+    engine.verify_many(attempts, at, window=1)
+    verify = time.perf_counter() - start
+    return {
+        "generate_codes_per_sec": 3 * len(engine) / generate,
+        "verifications_per_sec": len(attempts) / verify,
+        "peak_rss_mib": peak_rss_mib(),
+    }
+
+WORKLOADS = {
+    "spider": (spider_workload, {"pages": 300, "latency": 0.005, "image_size": 32 * 1024, "page_size": 8 * 1024},
+               {"pages": 30}),
+    "scorpion": (scorpion_workload, {"files": 300, "payload": 256 * 1024, "jobs": 4}, {"files": 30}),
+    "totp": (totp_workload, {"accounts": 50_000}, {"accounts": 2_000}),
+}
+
+class WorkloadFailed(Exception):
+    pass
+
+# the child reports its traceback instead of a result, so a failing workload fails the suite instead of hanging it
+def run_in_process(fn, options, results):
+    try:
+        results.put((True, fn(options)))
+    except BaseException:
+        results.put((False, traceback.format_exc()))
+
+def run_workload(name, quick):
+    fn, options, quick_options = WORKLOADS[name]
+    options = {**options, **(quick_options if quick else {})}
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    process = context.Process(target=run_in_process, args=(fn, options, results))
+    process.start()
+    # a child killed (by a signal, the OOM killer) before it could report is noticed on its exit code
+    while True:
+        try:
+            ok, result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if process.exitcode is not None:
+                try:
+                    ok, result = results.get_nowait()
+                    break
+                except queue.Empty:
+                    raise WorkloadFailed(f"{name} workload exited with code {process.exitcode}") from None
+    process.join()
+    if not ok:
+        raise WorkloadFailed(f"{name} workload failed:\n{result}")
+    return result
+
+# [(workload, metric, value, baseline value, relative change)] for the metrics worse than the tolerance
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, metrics in results["workloads"].items():
+        for metric, value in metrics.items():
+            previous = baseline.get("workloads", {}).get(name, {}).get(metric)
+            if not previous:
+                continue
+            change = (value - previous) / previous
+            if (change < -tolerance) if direction(metric) == "higher" else (change > tolerance):
+                found.append((name, metric, value, previous, change))
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the spider, scorpion and TOTP workloads and compare them with a baseline.")
+    parser.add_argument("workloads", nargs="*", help=f"Workloads to run, among {', '.join(WORKLOADS)} (default: all).")
+    parser.add_argument("--output", metavar="FILE", help="Write the results as JSON to FILE.")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare with the results in FILE and flag regressions.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help=f"Relative change counted as a regression (default: {DEFAULT_TOLERANCE}).")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs of each workload, the best value of each metric is kept (default: 1).")
+    parser.add_argument("--quick", action="store_true", help="Small workloads, to check the suite runs.")
+    args = parser.parse_args()
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workload(s): {', '.join(sorted(unknown))}")
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    results = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+               "machine": platform.machine(), "cpus": os.cpu_count(), "quick": args.quick, "repeat": args.repeat,
+               "workloads": {}}
+    for name in args.workloads or WORKLOADS:
+        try:
+            runs = [run_workload(name, args.quick) for _ in range(args.repeat)]
+        except WorkloadFailed as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        results["workloads"][name] = metrics = {
+            metric: (max if direction(metric) == "higher" else min)(run[metric] for run in runs) for metric in runs[0]}
+        for metric, value in metrics.items():
+            previous = baseline.get("workloads", {}).get(name, {}).get(metric)
+            change = f"{(value - previous) / previous:+7.1%}" if previous else ""
+            print(f"{name:9} {metric:24} {value:12.2f} {change}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if baseline and baseline.get("quick", False) != args.quick:
+        print("Warning: the baseline and this run don't use the same workload sizes (--quick).")
+    found = regressions(results, baseline, args.tolerance)
+    for name, metric, value, previous, change in found:
+        print(f"REGRESSION {name} {metric}: {previous:.2f} -> {value:.2f} ({change:+.1%})")
+    if found:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,8 @@ pip install beautifulsoup4
 pip install cryptography
 pip install Fernet
 pip install colorama
+# optional: faster HTML parsing in spider
+pip install lxml
 
 # Exit virtual environment
 deactivate
\ No newline at end of file
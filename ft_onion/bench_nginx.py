@@ -0,0 +1,125 @@
+import argparse
+import http.client
+import multiprocessing
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Load test of the hidden service's web server over plain HTTP, against the container's local port instead of Tor.
+# Every target (name=URL, or just URL) is loaded in turn by --connections keep-alive clients, spread over --processes
+# processes so the client isn't the bottleneck, each requesting the --path list in a loop for --duration seconds.
+# Requests ask for gzip like a browser does. Reports requests/sec, the latency percentiles, the body bytes received
+# per request (smaller with compression) and the connections opened per request: over Tor a new connection costs
+# extra round trips, so keep-alive matters more than it does here.
+# One response of each path is shown with its Content-Encoding and Cache-Control, to check the profile is live.
+# make loadtest runs it against the baseline and the tuned container.
+
+HEADERS = {"Accept-Encoding": "gzip", "User-Agent": "bench_nginx"}
+
+class CountingConnection(http.client.HTTPConnection):
+    connects = 0
+
+    def connect(self):
+        super().connect()
+        self.connects += 1
+
+# one client: (latencies, body bytes, connections opened, errors)
+def client(host, port, paths, deadline, results):
+    connection = CountingConnection(host, port, timeout=10)
+    latencies = []
+    received = 0
+    errors = 0
+    while time.perf_counter() < deadline:
+        for path in paths:
+            start = time.perf_counter()
+            try:
+                connection.request("GET", path, headers=HEADERS)
+                response = connection.getresponse()
+                received += len(response.read())
+                if response.status >= 400:
+                    errors += 1
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                connection.close()
+                continue
+            latencies.append(time.perf_counter() - start)
+    connection.close()
+    results.append((latencies, received, connection.connects, errors))
+
+def load(host, port, paths, connections, duration, queue):
+    results = []
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=client, args=(host, port, paths, deadline, results)) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.put(results)
+
+def run(url, paths, connections, processes, duration):
+    parts = urlsplit(url)
+    per_process = [connections // processes + (i < connections % processes) for i in range(processes)]
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=load, args=(parts.hostname, parts.port or 80, paths, count, duration, queue))
+               for count in per_process if count]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    results = [result for _ in workers for result in queue.get()]
+    elapsed = time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+    latencies = sorted(latency for result in results for latency in result[0])
+    return {
+        "requests": len(latencies),
+        "per_sec": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p90_ms": percentile(latencies, 0.9) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "bytes_per_request": sum(result[1] for result in results) / max(len(latencies), 1),
+        "connections_per_request": sum(result[2] for result in results) / max(len(latencies), 1),
+        "errors": sum(result[3] for result in results),
+    }
+
+def percentile(values, q):
+    if not values:
+        return 0
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+def show_headers(url, paths):
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+    try:
+        for path in paths:
+            connection.request("GET", path, headers=HEADERS)
+            response = connection.getresponse()
+            body = response.read()
+            print(f"  {path}: {response.status}, {len(body)} bytes, "
+                  f"Content-Encoding: {response.getheader('Content-Encoding', '-')}, "
+                  f"Cache-Control: {response.getheader('Cache-Control', '-')}")
+    finally:
+        connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the ft_onion web server over plain HTTP.")
+    parser.add_argument("targets", nargs="+", help="Servers to test, as URL or name=URL (e.g. baseline=http://127.0.0.1:8081/).")
+    parser.add_argument("--path", action="append", help="Path requested, repeat for several (default: the targets' own path).")
+    parser.add_argument("--connections", type=int, default=32, help="Concurrent keep-alive clients (default: 32).")
+    parser.add_argument("--processes", type=int, default=min(os.cpu_count() or 1, 4), help="Processes the clients are spread over (default: up to 4).")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per target (default: 10).")
+    args = parser.parse_args()
+
+    for target in args.targets:
+        name, _, url = target.partition("=") if "=" in target.split("://")[0] else ("", "", target)
+        paths = args.path or [urlsplit(url).path or "/"]
+        print(f"{name or url}")
+        show_headers(url, paths)
+        result = run(url, paths, args.connections, args.processes, args.duration)
+        print(f"  {result['per_sec']:9.0f} requests/sec, latency p50 {result['p50_ms']:.2f} ms, "
+              f"p90 {result['p90_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms")
+        print(f"  {result['bytes_per_request']:9.0f} body bytes/request, "
+              f"{result['connections_per_request']:.4f} connections/request, {result['errors']} errors")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from cryptography.fernet import Fernet
+from totp_daemon import TotpClient
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Throughput and latency of getting a code: spawning `ft_otp.py -k ft_otp.key` per code, against generate and verify
+# requests to totp_daemon.py over its Unix socket from `--clients` connections. Runs in a temporary directory with a
+# fresh seed and key; the daemon runs in its own process, like it would in production.
+
+def make_keys(directory):
+    seed = Fernet.generate_key()
+    with open(os.path.join(directory, "seed.key"), "wb") as file:
+        file.write(seed)
+    with open(os.path.join(directory, "ft_otp.key"), "wb") as file:
+        file.write(Fernet(seed).encrypt(os.urandom(32).hex().encode()))
+
+def start_daemon(directory, socket_path):
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, "totp_daemon.py"), "--socket", socket_path],
+                               cwd=directory, stdout=subprocess.DEVNULL)
+    while not os.path.exists(socket_path):
+        if process.poll() is not None:
+            raise RuntimeError("the daemon exited")
+        time.sleep(0.01)
+    return process
+
+def percentile(latencies, q):
+    latencies = sorted(latencies)
+    return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+def report(name, latencies, elapsed, baseline=None):
+    rate = len(latencies) / elapsed
+    print(f"{name:24} {rate:9.0f} req/sec, p50 {percentile(latencies, 0.5) * 1000:8.3f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:8.3f} ms" + (f", {rate / baseline:7.0f}x" if baseline else ""))
+    return rate
+
+def spawn_cli(directory, count):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(count):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(HERE, "ft_otp.py"), "-k", "ft_otp.key"], cwd=directory,
+                       check=True, stdout=subprocess.DEVNULL)
+        latencies.append(time.perf_counter() - started)
+    return latencies, time.perf_counter() - start
+
+# every client sends `count` requests back to back on its own connection
+def daemon_requests(socket_path, clients, count, make_request):
+    latencies = [[] for _ in range(clients)]
+    def client(i):
+        connection = TotpClient(socket_path)
+        for _ in range(count):
+            started = time.perf_counter()
+            make_request(connection)
+            latencies[i].append(time.perf_counter() - started)
+        connection.close()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [latency for client_latencies in latencies for latency in client_latencies], time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the TOTP daemon against spawning the ft_otp CLI.")
+    parser.add_argument("--spawns", type=int, default=20, help="CLI runs (default: 20).")
+    parser.add_argument("--requests", type=int, default=5000, help="Daemon requests per client (default: 5000).")
+    parser.add_argument("--clients", type=int, default=4, help="Concurrent daemon connections (default: 4).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_keys(directory)
+        socket_path = os.path.join(directory, "ft_otp.sock")
+        daemon = start_daemon(directory, socket_path)
+        try:
+            baseline = report("spawn ft_otp.py -k", *spawn_cli(directory, args.spawns))
+            report("daemon generate", *daemon_requests(socket_path, args.clients, args.requests,
+                                                       lambda client: client.generate("ft_otp.key")), baseline)
+            # wrong codes, so the replay protection doesn't turn them away before the HMACs are computed
+            report("daemon verify", *daemon_requests(socket_path, args.clients, args.requests,
+                                                     lambda client: client.verify("ft_otp.key", "000000")), baseline)
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+if __name__ == "__main__":
+    main()
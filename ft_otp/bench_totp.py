@@ -0,0 +1,73 @@
+import argparse
+import hashlib
+import hmac
+import os
+import time
+
+from totp import TotpEngine, time_counter
+
+# Throughput of TOTP generation and verification: the per-call path ft_otp used before (hex decode, new HMAC, byte loop
+# truncation for every code) against TotpEngine with pre-keyed HMACs, for `--accounts` random keys and a window of
+# `--window` time steps on each side of the current one.
+
+def legacy_totp(hex_key, counter):
+    hmac_hash = hmac.new(bytes.fromhex(hex_key), counter.to_bytes(8, byteorder="big"), hashlib.sha1).digest()
+    offset = hmac_hash[-1] & 0x0F
+    truncated_hash = 0
+    for byte in hmac_hash[offset:offset+4]:
+        truncated_hash = (truncated_hash << 8) | byte
+    return (truncated_hash & 0x7FFFFFFF) % 10**6
+
+def legacy_codes(hex_keys, at, window):
+    current = time_counter(at)
+    return {name: [legacy_totp(key, counter) for counter in range(current - window, current + window + 1)]
+            for name, key in hex_keys.items()}
+
+def legacy_verify(hex_keys, attempts, at, window):
+    current = time_counter(at)
+    return [next((counter - current for counter in range(current - window, current + window + 1)
+                  if legacy_totp(hex_keys[name], counter) == int(code)), None)
+            for name, code in attempts]
+
+def timed(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = fn()
+    return result, (time.perf_counter() - start) / rounds
+
+def report(name, codes, elapsed, baseline):
+    print(f"{name:30} {elapsed * 1000:8.2f} ms, {codes / elapsed:10.0f} codes/sec, {baseline / elapsed:5.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-call TOTP generation against the batch engine.")
+    parser.add_argument("--accounts", type=int, default=10_000, help="Number of random keys (default: 10000).")
+    parser.add_argument("--window", type=int, default=1, help="Time steps checked on each side of the current one (default: 1).")
+    parser.add_argument("--rounds", type=int, default=3, help="Repetitions of each measurement (default: 3).")
+    args = parser.parse_args()
+
+    hex_keys = {f"account{i}": os.urandom(20).hex() for i in range(args.accounts)}
+    at = time.time()
+    codes = args.accounts * (2 * args.window + 1)
+
+    # the engine is built once, like a long-running verifier would: its setup is reported on its own
+    engine, setup = timed(lambda: TotpEngine({name: bytes.fromhex(key) for name, key in hex_keys.items()}), 1)
+    print(f"{'engine setup':30} {setup * 1000:8.2f} ms for {args.accounts} keys")
+
+    expected, baseline = timed(lambda: legacy_codes(hex_keys, at, args.window), args.rounds)
+    report("generate, per call", codes, baseline, baseline)
+    result, elapsed = timed(lambda: engine.codes(at=at, window=args.window), args.rounds)
+    assert result == expected
+    report("generate, TotpEngine.codes", codes, elapsed, baseline)
+
+    # half the attempts are current codes, half are wrong and go through the whole window
+    current = engine.codes(at=at)
+    attempts = [(name, engine.format(current[name][0] if i % 2 else (current[name][0] + 1) % 10**6))
+                for i, name in enumerate(hex_keys)]
+    expected, baseline = timed(lambda: legacy_verify(hex_keys, attempts, at, args.window), args.rounds)
+    report("verify, per call", codes, baseline, baseline)
+    result, elapsed = timed(lambda: engine.verify_many(attempts, at, args.window), args.rounds)
+    assert result == expected
+    report("verify, TotpEngine.verify_many", codes, elapsed, baseline)
+
+if __name__ == "__main__":
+    main()
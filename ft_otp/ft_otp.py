@@ -1,15 +1,20 @@
 import os
 import argparse
-from datetime import datetime
-from cryptography.fernet import Fernet
-import hashlib
-import hmac
-from colorama import init, Fore
-import base64
 import sys
-import subprocess
 
-init(autoreset=True)
+# problem: ft_otp is run from scripts thousands of times a day, and importing cryptography, colorama, hmac and
+# subprocess up front costs more than most commands do, -h included
+# solution: every command imports what it needs when it runs (Fernet to encrypt or decrypt, hmac to compute codes),
+# and colorama is only loaded by the first colored print
+class LazyFore:
+    def __getattr__(self, name):
+        global Fore
+        from colorama import init, Fore as fore
+        init(autoreset=True)
+        Fore = fore
+        return getattr(fore, name)
+
+Fore = LazyFore()
 
 # Using symmetric encryption: same key used to encrypt data is also usable for decryption.
 # The fernet library is built on top of the AES algorithm.
@@ -21,6 +26,7 @@ init(autoreset=True)
 
 # --> this should be a separate script executed only once to generate the seed used to encrypt the master key to be stored in ft_otp.key
 def generate_symmetric_key():
+    from cryptography.fernet import Fernet
     key = Fernet.generate_key()
     with open("seed.key", "wb") as key_file:
         key_file.write(key)
@@ -30,12 +36,12 @@ def generate_symmetric_key():
 
 #---------------------------------------------------------------------------------------------------------------
 
-def generate_key_with_openssl(script_path="./hex_string_generator.sh"):
-    try:
-        subprocess.run(["bash", script_path], check=True)
-        print(Fore.LIGHTMAGENTA_EX + "Key generated using OpenSSL and saved to key.hex")
-    except subprocess.CalledProcessError as e:
-        raise Exception(f"Error executing the script: {e}")
+# 64 random bytes from the OS CSPRNG as 128 hex characters, like `openssl rand -hex 64` without spawning bash and openssl.
+# os.urandom is what secrets.token_hex uses, without importing secrets (and random, base64 and hmac with it)
+def generate_random_key(output_file="key.hex"):
+    with open(output_file, "w") as file:
+        file.write(os.urandom(64).hex() + "\n")
+    print(Fore.LIGHTMAGENTA_EX + f"Key generated and saved to {output_file}")
 
 #---------------------------------------------------------------------------------------------------------------
 
@@ -47,6 +53,7 @@ def load_seed():
 
 def save_encrypted_key(key, output_file="ft_otp.key"):
     try:
+        from cryptography.fernet import Fernet
         seed = load_seed()
         f = Fernet(seed)
         encrypted_data = f.encrypt(key)
@@ -58,7 +65,7 @@ def save_encrypted_key(key, output_file="ft_otp.key"):
     except Exception as e:
         raise Exception(f"Error saving the key: {e}")
 
-def validate_hex_key(key):
+def validate_hex_key(key, verbose=True):
 
     clean_key = b''.join(key.split())
     if len(clean_key) % 2 != 0:
@@ -71,10 +78,11 @@ def validate_hex_key(key):
     if len(clean_key) < 64:
         raise ValueError("Key must be at least 64 characters long.")
     
-    print(Fore.LIGHTGREEN_EX + "Key is valid.")
+    if verbose:
+        print(Fore.LIGHTGREEN_EX + "Key is valid.")
     return clean_key
 
-def process_g_option(input_value):
+def process_g_option(input_value, keystore=None, account=None):
 
     if os.path.exists(input_value) & os.path.isfile(input_value):
         if not os.access(input_value, os.R_OK):
@@ -84,7 +92,38 @@ def process_g_option(input_value):
     else:
         raise ValueError("No key provided")
     clean_key = validate_hex_key(key)
-    save_encrypted_key(clean_key)
+    if keystore is None:
+        save_encrypted_key(clean_key)
+        return
+    if account is None:
+        raise ValueError("An account id (-a) is needed to store a key in a keystore.")
+    with open_keystore(keystore) as store:
+        rotated = account in store
+        store.put(account, clean_key)
+    print(Fore.LIGHTGREEN_EX + f"Key for account {account} {'rotated' if rotated else 'saved'} in {keystore}")
+
+#---------------------------------------------------------------------------------------------------------------
+
+# many accounts in one file, see keystore.py
+def open_keystore(path, readonly=False):
+    from keystore import Keystore
+    if readonly and not os.path.isfile(path):
+        raise ValueError(f"Keystore {path} doesn't exist.")
+    return Keystore(path, load_seed(), readonly)
+
+def process_import_option(directory, keystore):
+    if not os.path.isdir(directory):
+        raise ValueError(f"{directory} is not a directory.")
+    with open_keystore(keystore) as store:
+        count = store.import_directory(directory, lambda key: validate_hex_key(key, verbose=False))
+    print(Fore.LIGHTGREEN_EX + f"{count} keys imported into {keystore}")
+
+def process_delete_option(account, keystore):
+    with open_keystore(keystore) as store:
+        if account not in store:
+            raise ValueError(f"No key for account {account} in {keystore}.")
+        store.delete(account)
+    print(Fore.LIGHTGREEN_EX + f"Key for account {account} deleted from {keystore}")
 
 #---------------------------------------------------------------------------------------------------------------
 
@@ -113,7 +152,11 @@ def process_g_option(input_value):
 #     return hmac_result
 
 def generate_totp(master_key):
-    
+    import hashlib
+    import hmac
+    from datetime import datetime
+    from totp import truncate
+
     time_interval = 30
     # converts the time to a 64-bit counter value (number of 30-second intervals since Unix epoch)
     time_counter = int(datetime.now().timestamp() / time_interval)
@@ -122,23 +165,13 @@ def generate_totp(master_key):
     # generates HMAC-SHA-1 hash with the master key and the current time converted to 8byte big endian value
     hmac_hash = hmac.new(secret_bytes, time_counter.to_bytes(8, byteorder="big"), hashlib.sha1).digest()
     # hmac_hash = hmac_sha1(secret_bytes, time_counter.to_bytes(8, byteorder="big"))
-    # applies dynamic truncation to obtain a 4-byte code, extracting 4 bytes starting at the offset
-    offset = hmac_hash[-1] & 0x0F
-    truncated_bytes = hmac_hash[offset:offset+4]
-    # converts the 4 bytes to a 32-bit integer (big-endian)
-    truncated_hash = 0
-    # shifts left and adds the next byte
-    for byte in truncated_bytes:
-        truncated_hash = (truncated_hash << 8) | byte
-    # ignores the most significant bit to ensure it's positive
-    truncated_hash &= 0x7FFFFFFF
-    # converts the 4-byte code to a 6-digit decimal code taking the binary code modulo 10^6
-    otp = truncated_hash % 10**6
-    return otp
+    # applies dynamic truncation: 4 bytes at the offset given by the last nibble, read as a 31-bit big-endian integer,
+    # then modulo 10^6 for a 6-digit code
+    return truncate(hmac_hash)
 
 def decrypt(encrypted_data, seed):
     try:
-
+        from cryptography.fernet import Fernet
         f = Fernet(seed)
         decrypted_data = f.decrypt(encrypted_data)
     except Exception as e:
@@ -146,8 +179,16 @@ def decrypt(encrypted_data, seed):
 
     return decrypted_data
 
-# assumes the decrypted master key is a valid hexadecimal string
-def process_k_option(key_file):
+# assumes the decrypted master key is a valid hexadecimal string.
+# With a keystore, key_file is the account id
+def process_k_option(key_file, keystore=None):
+
+    if keystore is not None:
+        with open_keystore(keystore, readonly=True) as store:
+            if key_file not in store:
+                raise ValueError(f"No key for account {key_file} in {keystore}.")
+            print_totp(generate_totp(store.get(key_file)))
+        return
 
     if key_file != "ft_otp.key":
         raise ValueError("Invalid master key file.")
@@ -160,36 +201,118 @@ def process_k_option(key_file):
 
     master_key = decrypt(encrypted_data, load_seed())
 
-    totp = generate_totp(master_key)
+    print_totp(generate_totp(master_key))
+
+def print_totp(totp):
     totp_str = str(totp).zfill(6)
     print(Fore.LIGHTCYAN_EX + f"TOTP: {totp_str}")
 
 #---------------------------------------------------------------------------------------------------------------
 
+# decrypts every key file with the same Fernet instance; returns {key file: secret bytes}.
+# With a keystore, key_files are account ids
+def load_master_keys(key_files, keystore=None):
+    if keystore is not None:
+        with open_keystore(keystore, readonly=True) as store:
+            missing = [account for account in key_files if account not in store]
+            if missing:
+                raise ValueError(f"No key for account(s) {', '.join(missing)} in {keystore}.")
+            return {account: bytes.fromhex(store.get(account).decode()) for account in key_files}
+
+    from cryptography.fernet import Fernet
+    f = Fernet(load_seed())
+    secrets = {}
+    for key_file in key_files:
+        with open(key_file, "rb") as file:
+            encrypted_data = file.read().strip()
+        try:
+            secrets[key_file] = bytes.fromhex(f.decrypt(encrypted_data).decode())
+        except Exception as e:
+            raise Exception(f"Error decrypting the key in {key_file}: {e}")
+    return secrets
+
+# all keys are loaded once, then codes are generated or verified in one batch.
+# verify is a code to check against every key, or "-" to read "KEY_FILE CODE" lines from stdin
+def process_batch_option(key_files, window=0, verify=None, keystore=None):
+    from totp import TotpEngine
+    engine = TotpEngine(load_master_keys(key_files, keystore))
+
+    if verify is None:
+        for name, codes in engine.codes(window=window).items():
+            print(Fore.LIGHTCYAN_EX + f"{name}: " + " ".join(engine.format(code) for code in codes))
+        return
+
+    if verify == "-":
+        attempts = [tuple(line.split()) for line in sys.stdin if len(line.split()) == 2]
+    else:
+        attempts = [(name, verify) for name in key_files]
+    for (name, code), offset in zip(attempts, engine.verify_many(attempts, window=window)):
+        if offset is None:
+            print(Fore.RED + f"{name}: {code} invalid")
+        else:
+            print(Fore.LIGHTGREEN_EX + f"{name}: {code} valid (time step {offset:+d})")
+
+# keeps the seed and the decrypted keys in memory and answers generate/verify requests on a Unix socket,
+# see totp_daemon.py (which also takes --ttl, --max-keys and --window). With a keystore, requests name account ids
+def process_daemon_option(socket_path, keystore=None):
+    from totp_daemon import TotpDaemon, run_daemon
+
+    store = open_keystore(keystore, readonly=True) if keystore is not None else None
+    print(Fore.LIGHTBLUE_EX + f"Serving TOTP requests on {socket_path}")
+    try:
+        run_daemon(TotpDaemon(load_seed(), keystore=store), socket_path)
+    finally:
+        if store is not None:
+            store.close()
+
+#---------------------------------------------------------------------------------------------------------------
+
 def main():
 
-    parser = argparse.ArgumentParser(description="TOTP Generator", usage="%(prog)s [-h] [-g KEY_FILE or KEY_STRING] [-k MASTER_KEY_FILE]")
+    parser = argparse.ArgumentParser(description="TOTP Generator", usage="%(prog)s [-h] [-g KEY_FILE or KEY_STRING] [-k MASTER_KEY_FILE] [-b KEY_FILE [KEY_FILE ...] [-w WINDOW] [-v CODE]] [-d SOCKET] [--keystore FILE [-a ACCOUNT] [-i DIRECTORY] [--delete ACCOUNT]]")
     parser.add_argument("-g", help="Generate and store an encrypted master key", type=str)
     parser.add_argument("-k", help="Generate a TOTP using the stored master key", type=str)
     parser.add_argument("-s", help="Generate a symmetric key (seed) for master key encription. Make sure to store it safely! File will be overwritten when executing again with -s flag.", action="store_true")
-    parser.add_argument("-m", help="Generate a random hexadecimal key using OpenSSL", action="store_true")
+    parser.add_argument("-m", help="Generate a random hexadecimal key and save it to key.hex", action="store_true")
+    parser.add_argument("-b", "--batch", nargs="+", metavar="KEY_FILE", help="Generate TOTPs for several encrypted key files at once")
+    parser.add_argument("-w", "--window", type=int, default=0, help="With --batch: also cover this many time steps before and after the current one")
+    parser.add_argument("-v", "--verify", metavar="CODE", help="With --batch: check CODE against every key instead of printing codes ('-' reads 'KEY_FILE CODE' lines from stdin)")
+
+    parser.add_argument("-d", "--daemon", metavar="SOCKET", help="Serve generate/verify requests for encrypted key files on the Unix socket SOCKET")
+    parser.add_argument("--keystore", metavar="FILE", help="Keep the keys of many accounts in the keystore FILE: -g stores the key of account -a, and -k, -b and -d take account ids instead of key files")
+    parser.add_argument("-a", "--account", help="With -g and --keystore: account the key is stored (or rotated) for")
+    parser.add_argument("-i", "--import-dir", metavar="DIRECTORY", help="With --keystore: store the hexadecimal key of every file in DIRECTORY, the account being the file name without its extension")
+    parser.add_argument("--delete", metavar="ACCOUNT", help="With --keystore: delete the key of ACCOUNT")
 
     args = parser.parse_args()
 
     try:
         if args.g:
             print(Fore.GREEN + "Storing encrypted master key...")
-            process_g_option(args.g)
-
+            process_g_option(args.g, args.keystore, args.account)
+
+        elif (args.import_dir or args.delete) and not args.keystore:
+            raise ValueError("-i and --delete need a keystore (--keystore).")
+        elif args.import_dir:
+            process_import_option(args.import_dir, args.keystore)
+        elif args.delete:
+            process_delete_option(args.delete, args.keystore)
+        elif args.daemon:
+            process_daemon_option(args.daemon, args.keystore)
+        elif args.batch:
+            process_batch_option(args.batch, args.window, args.verify, args.keystore)
         elif args.k:
-            print(Fore.CYAN + f"Generating TOTP using encrypted key in file: {args.k}.")
-            process_k_option(args.k)
+            if args.keystore:
+                print(Fore.CYAN + f"Generating TOTP for account {args.k} in keystore: {args.keystore}.")
+            else:
+                print(Fore.CYAN + f"Generating TOTP using encrypted key in file: {args.k}.")
+            process_k_option(args.k, args.keystore)
         elif args.s:
             print(Fore.YELLOW + "Generating symmetric key...")
             generate_symmetric_key()
         elif args.m:
             print(Fore.MAGENTA + "Generating random hexadecimal key for you...")
-            generate_key_with_openssl()
+            generate_random_key()
         else:
             parser.print_help()
     except ValueError as e:
@@ -0,0 +1,209 @@
+import os
+import struct
+
+from cryptography.fernet import Fernet
+
+MAGIC = b"FTOTPKS1"
+# magic, offset and length of the latest index snapshot, offset where the records after it start
+HEADER = struct.Struct(">8sQQQ")
+# kind, account id length, token length; followed by the account id and the Fernet token
+RECORD = struct.Struct(">BHI")
+# account id length, token offset, token length; followed by the account id
+ENTRY = struct.Struct(">HQI")
+PUT = 1
+DELETE = 2
+
+# Multi-account keystore for ft_otp: one file holding the encrypted keys of many accounts.
+# problem: ft_otp keeps a single key in a hardcoded ft_otp.key, so serving many users means one file (and one open,
+# read and decrypt of a whole file) per user
+# solution: one file of individually Fernet-encrypted records with an index of account id -> record offset:
+#   [header][records...][index snapshot][records appended since...]
+# The header points to the latest index snapshot. Opening the store reads the snapshot and replays the records
+# appended after it, then a lookup is a dict access plus one pread and one decrypt. Adding, rotating or deleting a key
+# appends a record (a delete appends a tombstone) and overwrites the superseded token with zeros, so nothing is
+# rewritten; a new snapshot is appended by flush()/close(). compact() rewrites the file with the live records only.
+# Account ids are stored in clear, only the keys are encrypted. A record cut short by a crash is dropped on open.
+# There is no locking: one process at a time may modify a keystore. Readers (readonly=True) call reload() to see
+# what was written since they opened it.
+class Keystore:
+    def __init__(self, path, seed, readonly=False):
+        self.path = path
+        self.fernet = Fernet(seed)
+        self.readonly = readonly
+        if not readonly and not os.path.exists(path):
+            with open(path, "wb") as file:
+                file.write(HEADER.pack(MAGIC, 0, 0, HEADER.size))
+        self.file = open(path, "rb" if readonly else "r+b")
+        self.fd = self.file.fileno()
+        self.load()
+
+    def load(self):
+        # account id -> (token offset, token length)
+        self.index = {}
+        self.dirty = False
+        magic, index_offset, index_length, tail = HEADER.unpack(os.pread(self.fd, HEADER.size, 0))
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a keystore.")
+        snapshot = os.pread(self.fd, index_length, index_offset)
+        position = 0
+        while position < len(snapshot):
+            id_length, offset, length = ENTRY.unpack_from(snapshot, position)
+            position += ENTRY.size
+            self.index[snapshot[position:position + id_length].decode()] = (offset, length)
+            position += id_length
+        self.end = self.replay(tail)
+
+    # applies the records appended after the snapshot, returns where the next record goes
+    def replay(self, position):
+        self.file.seek(position)
+        while len(header := self.file.read(RECORD.size)) == RECORD.size:
+            kind, id_length, length = RECORD.unpack(header)
+            account = self.file.read(id_length)
+            token_offset = position + RECORD.size + id_length
+            if len(account) != id_length or self.file.seek(length, os.SEEK_CUR) > os.fstat(self.fd).st_size:
+                break
+            if kind == PUT:
+                self.index[account.decode()] = (token_offset, length)
+            else:
+                self.index.pop(account.decode(), None)
+            self.dirty = True
+            position = token_offset + length
+        # drops a record cut short by a crash, so the next one doesn't follow garbage (a reader leaves it to the writer)
+        if not self.readonly:
+            self.file.truncate(position)
+        return position
+
+    # compact() replaces the file: a reader still holding the old one reopens the path to see what was written since
+    def reload(self):
+        if os.stat(self.path).st_ino != os.fstat(self.fd).st_ino:
+            self.file.close()
+            self.file = open(self.path, "rb" if self.readonly else "r+b")
+            self.fd = self.file.fileno()
+        self.load()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, account):
+        return account in self.index
+
+    def accounts(self):
+        return sorted(self.index)
+
+    # the decrypted hex key of the account
+    def get(self, account):
+        if account not in self.index:
+            raise KeyError(f"No key for account {account}.")
+        offset, length = self.index[account]
+        return self.fernet.decrypt(os.pread(self.fd, length, offset))
+
+    # adds the account's key, or rotates it if the account exists
+    def put(self, account, hex_key):
+        self.put_many([(account, hex_key)])
+
+    def put_many(self, items):
+        records = []
+        entries = []
+        position = self.end
+        for account, hex_key in items:
+            encoded = encode_account(account)
+            token = self.fernet.encrypt(hex_key)
+            records.append(RECORD.pack(PUT, len(encoded), len(token)) + encoded + token)
+            entries.append((account, (position + RECORD.size + len(encoded), len(token))))
+            position += len(records[-1])
+        self.append(b"".join(records))
+        for account, entry in entries:
+            self.wipe(account)
+            self.index[account] = entry
+
+    def delete(self, account):
+        if account not in self.index:
+            raise KeyError(f"No key for account {account}.")
+        encoded = encode_account(account)
+        self.append(RECORD.pack(DELETE, len(encoded), 0) + encoded)
+        self.wipe(account)
+        del self.index[account]
+
+    def append(self, data):
+        os.pwrite(self.fd, data, self.end)
+        os.fsync(self.fd)
+        self.end += len(data)
+        self.dirty = True
+
+    # overwrites the account's current token, once the record replacing it is on disk
+    def wipe(self, account):
+        entry = self.index.get(account)
+        if entry is not None:
+            os.pwrite(self.fd, bytes(entry[1]), entry[0])
+
+    # appends an index snapshot and points the header to it, so opening doesn't replay the records
+    def flush(self):
+        if self.readonly or not self.dirty:
+            return
+        snapshot = pack_index(self.index)
+        os.pwrite(self.fd, snapshot, self.end)
+        os.fsync(self.fd)
+        self.end += len(snapshot)
+        os.pwrite(self.fd, HEADER.pack(MAGIC, self.end - len(snapshot), len(snapshot), self.end), 0)
+        os.fsync(self.fd)
+        self.dirty = False
+
+    # rewrites the file with only the live records, dropping rotated, deleted and wiped ones and old snapshots
+    def compact(self):
+        temporary = self.path + ".tmp"
+        index = {}
+        with open(temporary, "wb") as file:
+            file.seek(HEADER.size)
+            for account, (offset, length) in self.index.items():
+                encoded = encode_account(account)
+                file.write(RECORD.pack(PUT, len(encoded), length) + encoded)
+                index[account] = (file.tell(), length)
+                file.write(os.pread(self.fd, length, offset))
+            snapshot = pack_index(index)
+            index_offset = file.tell()
+            file.write(snapshot)
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, index_offset, len(snapshot), index_offset + len(snapshot)))
+            file.flush()
+            os.fsync(file.fileno())
+        self.file.close()
+        os.replace(temporary, self.path)
+        self.file = open(self.path, "r+b")
+        self.fd = self.file.fileno()
+        self.index = index
+        self.end = index_offset + len(snapshot)
+        self.dirty = False
+
+    # adds or rotates one account per file of the directory, named after the file without its extension;
+    # every key is checked with validate_hex_key first, so one bad file imports nothing
+    def import_directory(self, directory, validate):
+        items = []
+        for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+            if entry.is_file():
+                with open(entry.path, "rb") as file:
+                    items.append((os.path.splitext(entry.name)[0], validate(file.read())))
+        self.put_many(items)
+        return len(items)
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def pack_index(index):
+    return b"".join(ENTRY.pack(len(encoded := account.encode()), offset, length) + encoded
+                    for account, (offset, length) in index.items())
+
+# account ids are matched as typed in requests, so they can't be empty or contain whitespace
+def encode_account(account):
+    if not account or account.split() != [account]:
+        raise ValueError(f"Invalid account id: {account!r}")
+    encoded = account.encode()
+    if len(encoded) > 0xFFFF:
+        raise ValueError("Account id is too long.")
+    return encoded
@@ -1,71 +1,75 @@
 import unittest
-from unittest.mock import mock_open, patch
+from unittest.mock import patch
 import os
-from ft_otp import validate_hex_key  # Import the function to test
-from ft_otp import save_key_securely
-from ft_otp import process_g_option
 import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
 
-class TestFtOtp(unittest.TestCase):
+from cryptography.fernet import Fernet
+import ft_otp
+from ft_otp import decrypt, process_g_option, save_encrypted_key, validate_hex_key
+
+# the ft_otp functions read and write seed.key and ft_otp.key in the working directory
+class TemporaryDirectoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.seed = Fernet.generate_key()
+        with open("seed.key", "wb") as file:
+            file.write(self.seed)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+class TestFtOtp(TemporaryDirectoryTestCase):
     def test_valid_key(self):
-        valid_key = "a" * 64
-        try:
-            validate_hex_key(valid_key)
-        except ValueError:
-            self.fail("validate_hex_key raised ValueError unexpectedly!")
+        self.assertEqual(validate_hex_key(b"a" * 32 + b"\n" + b"b" * 32, verbose=False), b"a" * 32 + b"b" * 32)
 
     def test_short_key(self):
-        short_key = "a" * 63
         with self.assertRaises(ValueError):
-            validate_hex_key(short_key)
+            validate_hex_key(b"a" * 62, verbose=False)
+
+    def test_odd_length_key(self):
+        with self.assertRaises(ValueError):
+            validate_hex_key(b"a" * 65, verbose=False)
 
     def test_invalid_characters(self):
-        invalid_key = "z" * 64 
         with self.assertRaises(ValueError):
-            validate_hex_key(invalid_key)
-    
+            validate_hex_key(b"z" * 64, verbose=False)
+
     def test_empty_key(self):
-        empty_key = ""
         with self.assertRaises(ValueError):
-            validate_hex_key(empty_key)
-
-    @patch("builtins.open", new_callable=mock_open)  # Mock the open function
-    @patch("os.chmod")  # Mock the os.chmod function
-    def test_save_key_securely(self, mock_chmod, mock_file):
-        key_data = "test_key_data"
-        filename = "ft_otp.key"
-
-        save_key_securely(key_data, filename)
+            validate_hex_key(b"", verbose=False)
 
-        # Check if the file was opened in write mode
-        mock_file.assert_called_once_with(filename, "w")
-        
-       # Extract the written key from the mock
-        written_key = mock_file().write.call_args.args[0]
+    def test_save_encrypted_key(self):
+        with redirect_stdout(StringIO()):
+            save_encrypted_key(b"ab" * 32)
+        with open("ft_otp.key", "rb") as file:
+            self.assertEqual(decrypt(file.read(), self.seed), b"ab" * 32)
 
-        # Assert that the file was written with the correct (processed) key
-        self.assertEqual(written_key, "f14880ac3b2546c8b5fff768a0444dd30a40f8bf6679e366cb0867b3ede56519")
-            
-        # Check if the correct file permissions were set
-        mock_chmod.assert_called_once_with(filename, 0o400)  # 0o400 = read-only for owner
-    
-    @patch("ft_otp.save_key_securely")  # Mock the save_key_securely function
-    def test_valid_key(self, mock_save):
-        valid_key = "a" * 64
-        process_g_option(valid_key)
-        
-        # Ensure save_key_securely was called with the correct parameters
-        mock_save.assert_called_once_with(valid_key)
+    @patch("ft_otp.save_encrypted_key")
+    def test_process_g_option_reads_the_key_file(self, mock_save):
+        with open("key.hex", "w") as file:
+            file.write("a" * 64 + "\n")
+        with redirect_stdout(StringIO()):
+            process_g_option("key.hex")
+        mock_save.assert_called_once_with(b"a" * 64)
 
-    def test_invalid_key_short(self):
-        short_key = "a" * 63
+    def test_process_g_option_rejects_missing_file_and_bad_key(self):
         with self.assertRaises(ValueError):
-            process_g_option(short_key)
-
-    def test_invalid_key_characters(self):
-        invalid_key = "z" * 64
+            process_g_option("a" * 64)
+        with open("key.hex", "w") as file:
+            file.write("z" * 64)
         with self.assertRaises(ValueError):
-            process_g_option(invalid_key)
+            process_g_option("key.hex")
+
+    def test_generate_random_key(self):
+        with redirect_stdout(StringIO()):
+            ft_otp.generate_random_key()
+        with open("key.hex", "rb") as file:
+            self.assertEqual(len(validate_hex_key(file.read(), verbose=False)), 128)
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from cryptography.fernet import Fernet
+import ft_otp
+from keystore import Keystore
+
+# ft_otp reads seed.key in the working directory
+class TemporaryDirectoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.seed = Fernet.generate_key()
+        with open("seed.key", "wb") as file:
+            file.write(self.seed)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+class TestKeystore(TemporaryDirectoryTestCase):
+    def test_put_rotate_delete_and_reopen(self):
+        keys = {f"user{i}": os.urandom(32).hex().encode() for i in range(50)}
+        with Keystore("accounts.ks", self.seed) as store:
+            store.put_many(keys.items())
+        with Keystore("accounts.ks", self.seed) as store:
+            self.assertEqual(len(store), 50)
+            self.assertFalse(store.dirty)
+            self.assertTrue(all(store.get(account) == key for account, key in keys.items()))
+            store.put("user1", b"ab" * 32)
+            store.delete("user2")
+            with self.assertRaises(KeyError):
+                store.delete("user2")
+            with self.assertRaises(ValueError):
+                store.put("two words", b"ab" * 32)
+        with open("accounts.ks", "rb") as file:
+            contents = file.read()
+        # no key is stored in clear
+        self.assertFalse(any(key in contents for key in keys.values()))
+        with Keystore("accounts.ks", self.seed) as store:
+            self.assertEqual(store.get("user1"), b"ab" * 32)
+            self.assertNotIn("user2", store)
+            self.assertEqual(len(store), 49)
+
+    def test_records_after_the_snapshot_are_replayed(self):
+        store = Keystore("accounts.ks", self.seed)
+        store.put("alice", b"ab" * 32)
+        store.flush()
+        store.put("bob", b"cd" * 32)
+        store.delete("alice")
+        store.file.close()
+        # a record cut short by a crash
+        with open("accounts.ks", "ab") as file:
+            file.write(b"\x01\x00\x05ca")
+        size = os.path.getsize("accounts.ks")
+        with Keystore("accounts.ks", self.seed) as store:
+            self.assertEqual(store.accounts(), ["bob"])
+            self.assertEqual(store.get("bob"), b"cd" * 32)
+            self.assertLess(store.end, size)
+
+    def test_compact_keeps_only_live_records(self):
+        with Keystore("accounts.ks", self.seed) as store:
+            for i in range(20):
+                store.put("alice", os.urandom(32).hex().encode())
+            store.put("bob", b"cd" * 32)
+            store.flush()
+            before = os.path.getsize("accounts.ks")
+            store.compact()
+            self.assertLess(os.path.getsize("accounts.ks"), before / 5)
+            store.put("carol", b"ef" * 32)
+        with Keystore("accounts.ks", self.seed) as store:
+            self.assertEqual(store.accounts(), ["alice", "bob", "carol"])
+            self.assertEqual(store.get("bob"), b"cd" * 32)
+
+    def test_reader_reloads_after_compaction(self):
+        with Keystore("accounts.ks", self.seed) as store:
+            store.put("alice", b"ab" * 32)
+        reader = Keystore("accounts.ks", self.seed, readonly=True)
+        with Keystore("accounts.ks", self.seed) as store:
+            store.compact()
+            store.put("bob", b"cd" * 32)
+        reader.reload()
+        self.assertIn("bob", reader)
+        self.assertEqual(reader.get("bob"), b"cd" * 32)
+        reader.close()
+
+    def test_import_directory(self):
+        os.mkdir("keys")
+        for account in ("alice", "bob"):
+            with open(os.path.join("keys", f"{account}.hex"), "w") as file:
+                file.write(os.urandom(32).hex() + "\n")
+        with redirect_stdout(StringIO()):
+            ft_otp.process_import_option("keys", "accounts.ks")
+        with Keystore("accounts.ks", self.seed) as store:
+            self.assertEqual(store.accounts(), ["alice", "bob"])
+
+        with open(os.path.join("keys", "carol.hex"), "w") as file:
+            file.write("not hex")
+        with self.assertRaises(ValueError):
+            ft_otp.process_import_option("keys", "accounts.ks")
+        with Keystore("accounts.ks", self.seed) as store:
+            self.assertEqual(len(store), 2)
+
+if __name__ == "__main__":
+    unittest.main()
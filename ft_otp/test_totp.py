@@ -0,0 +1,40 @@
+import time
+import unittest
+
+from ft_otp import generate_totp
+from totp import TotpEngine
+
+# RFC 6238 appendix B, SHA1, 8 digits
+RFC_SECRET = b"12345678901234567890"
+RFC_VECTORS = {59: 94287082, 1111111109: 7081804, 1111111111: 14050471, 1234567890: 89005924,
+               2000000000: 69279037, 20000000000: 65353130}
+
+class TestTotp(unittest.TestCase):
+    def test_rfc_6238_vectors(self):
+        engine = TotpEngine({"rfc": RFC_SECRET}, digits=8)
+        for at, code in RFC_VECTORS.items():
+            self.assertEqual(engine.now("rfc", at), code)
+        self.assertEqual(engine.codes(at=59, window=1), {"rfc": [84755224, 94287082, 37359152]})
+
+    def test_generate_totp_matches_the_engine(self):
+        engine = TotpEngine({"key": bytes.fromhex("ab" * 32)})
+        # generate_totp reads the clock itself: the code must be the current one, or the next if a step just began
+        now = time.time()
+        self.assertIn(generate_totp(b"ab" * 32), engine.codes(at=now, window=1)["key"][1:])
+
+    def test_verify_window(self):
+        engine = TotpEngine({"rfc": RFC_SECRET}, digits=8)
+        self.assertEqual(engine.verify("rfc", "94287082", at=89), -1)
+        self.assertEqual(engine.verify("rfc", 94287082, at=29), 1)
+        self.assertIsNone(engine.verify("rfc", "94287082", at=150))
+        self.assertIsNone(engine.verify("rfc", "94287082", at=89, window=0))
+        # the window is clamped at the first time step instead of packing a negative counter
+        self.assertEqual(engine.verify("rfc", "94287082", at=1, window=3), 1)
+
+    def test_verify_many(self):
+        engine = TotpEngine({"rfc": RFC_SECRET, "other": b"x" * 20}, digits=8)
+        attempts = [("rfc", "94287082"), ("rfc", "00000000"), ("unknown", "94287082"), ("rfc", "123456789")]
+        self.assertEqual(engine.verify_many(attempts, at=59, window=1), [0, None, None, None])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from cryptography.fernet import Fernet
+from keystore import Keystore
+from totp_daemon import TotpDaemon
+
+# key files are resolved relative to the daemon's working directory
+class TemporaryDirectoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.seed = Fernet.generate_key()
+        with open("seed.key", "wb") as file:
+            file.write(self.seed)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def write_key(self, path, hex_key):
+        with open(path, "wb") as file:
+            file.write(Fernet(self.seed).encrypt(hex_key))
+
+class TestTotpDaemon(TemporaryDirectoryTestCase):
+    def setUp(self):
+        super().setUp()
+        for name in ("a.key", "b.key"):
+            self.write_key(name, os.urandom(32).hex().encode())
+
+    def test_generate_then_verify_once(self):
+        daemon = TotpDaemon(self.seed)
+        status, code = daemon.handle("generate a.key").split()
+        self.assertEqual(status, "OK")
+        self.assertEqual(daemon.handle(f"verify a.key {code}"), "OK +0")
+        self.assertEqual(daemon.handle(f"verify a.key {code}"), "REPLAY")
+        self.assertEqual(daemon.handle("verify a.key 12"), "INVALID")
+        self.assertTrue(daemon.handle("generate missing.key").startswith("ERR"))
+        self.assertTrue(daemon.handle("bogus").startswith("ERR"))
+
+    def test_key_cache_evicts_and_wipes(self):
+        daemon = TotpDaemon(self.seed, ttl=60, max_keys=1)
+        daemon.handle("generate a.key")
+        secret = daemon.cache.keys["a.key"][0]
+        daemon.handle("generate b.key")
+        self.assertEqual(list(daemon.cache.keys), ["b.key"])
+        self.assertEqual(secret, bytearray(32))
+        self.assertEqual(len(daemon.engine), 1)
+
+        daemon.cache.ttl = 0
+        daemon.handle("generate a.key")
+        daemon.cache.expire()
+        self.assertEqual(len(daemon.cache.keys), 0)
+        self.assertEqual(len(daemon.engine), 0)
+
+    def test_keystore_accounts_added_while_serving(self):
+        with Keystore("accounts.ks", self.seed) as store:
+            store.put("alice", b"ab" * 32)
+        reader = Keystore("accounts.ks", self.seed, readonly=True)
+        daemon = TotpDaemon(self.seed, keystore=reader)
+        self.assertTrue(daemon.handle("generate alice").startswith("OK"))
+        with Keystore("accounts.ks", self.seed) as store:
+            store.put("bob", b"cd" * 32)
+        # bob isn't in the index the daemon read: it is found after a reload
+        self.assertTrue(daemon.handle("generate bob").startswith("OK"))
+        reader.close()
+
+    def test_keystore_accounts_deleted_or_rotated_while_cached(self):
+        with Keystore("accounts.ks", self.seed) as store:
+            store.put("alice", b"ab" * 32)
+            store.put("bob", b"cd" * 32)
+        reader = Keystore("accounts.ks", self.seed, readonly=True)
+        daemon = TotpDaemon(self.seed, keystore=reader)
+        self.assertTrue(daemon.handle("generate alice").startswith("OK"))
+        _, code = daemon.handle("generate bob").split()
+        with Keystore("accounts.ks", self.seed) as store:
+            store.delete("alice")
+            store.put("bob", b"ef" * 32)
+        self.assertTrue(daemon.handle("generate alice").startswith("ERR"))
+        self.assertTrue(daemon.handle("generate bob").startswith("OK"))
+        self.assertEqual(daemon.cache.keys["bob"][0], bytearray.fromhex("ef" * 32))
+        self.assertEqual(daemon.handle(f"verify bob {code}"), "INVALID")
+        reader.close()
+
+    def test_request_too_long_closes_the_connection(self):
+        daemon = TotpDaemon(self.seed)
+
+        async def exchange():
+            started = asyncio.Event()
+            server = asyncio.ensure_future(daemon.serve("ft_otp.sock", started))
+            await started.wait()
+            try:
+                reader, writer = await asyncio.open_unix_connection("ft_otp.sock")
+                writer.write(b"generate " + b"a" * 70000 + b"\n")
+                reply = await reader.readline(), await reader.read()
+                writer.close()
+                reader, writer = await asyncio.open_unix_connection("ft_otp.sock")
+                writer.write(b"generate a.key\n")
+                writer.write_eof()
+                reply += (await reader.read(),)
+                writer.close()
+                return reply
+            finally:
+                server.cancel()
+
+        with self.assertNoLogs("asyncio", level="ERROR"):
+            too_long, rest, generated = asyncio.run(exchange())
+        self.assertEqual(too_long, b"ERR request too long\n")
+        self.assertEqual(rest, b"")
+        self.assertTrue(generated.startswith(b"OK "))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import time
+from collections import OrderedDict
+
+from cryptography.fernet import Fernet, InvalidToken
+from keystore import Keystore
+from totp import TotpEngine, time_counter
+
+SOCKET_PATH = "ft_otp.sock"
+KEY_TTL = 300
+MAX_KEYS = 1000
+WINDOW = 1
+
+# Long-running TOTP daemon for ft_otp, serving generate/verify requests on a Unix socket.
+# problem: every `ft_otp -k` starts Python, imports cryptography and colorama, reads seed.key and the key file and
+# decrypts the key, all to compute one code
+# solution: one asyncio process holds the seed and a cache of decrypted keys (least recently used first out, and none
+# kept longer than --ttl seconds after it was loaded), with their pre-keyed HMACs in a TotpEngine. A request costs a
+# line on the socket and an HMAC. Successful verifications are remembered per (key file, time step), so a code can
+# only be used once.
+#
+# Protocol: one request per line, one reply per line.
+#   generate KEY_FILE       -> OK 123456
+#   verify KEY_FILE CODE    -> OK +0 (matching time step) | INVALID | REPLAY
+#   anything that fails     -> ERR message
+# Key files are resolved relative to the daemon's working directory; with --keystore, requests name its account ids. The socket is created with mode 0600, so only
+# the daemon's user can ask for codes.
+
+# decrypted secrets are kept in bytearrays, so they can be overwritten when evicted.
+# Python can't guarantee no other copy exists (hmac keeps its own padded state, the decrypted hex string is freed
+# without being wiped), so this only shortens how long the plain key sits in memory.
+class KeyCache:
+    def __init__(self, seed, engine, ttl=KEY_TTL, max_keys=MAX_KEYS, keystore=None):
+        self.fernet = Fernet(seed)
+        self.engine = engine
+        self.keystore = keystore
+        self.ttl = ttl
+        self.max_keys = max_keys
+        # key file -> (secret, expires at)
+        self.keys = OrderedDict()
+        # (inode, size, mtime) of the keystore when it was last read
+        self.keystore_version = None
+
+    def load(self, key_file):
+        self.refresh()
+        entry = self.keys.get(key_file)
+        if entry is not None and entry[1] > time.monotonic():
+            self.keys.move_to_end(key_file)
+            return
+        if entry is not None:
+            self.evict(key_file)
+        secret = bytearray.fromhex(self.decrypt(key_file).decode())
+        self.engine.add(key_file, secret)
+        self.keys[key_file] = (secret, time.monotonic() + self.ttl)
+        while len(self.keys) > self.max_keys:
+            self.evict(next(iter(self.keys)))
+
+    def decrypt(self, key_file):
+        if self.keystore is None:
+            with open(key_file, "rb") as file:
+                return self.fernet.decrypt(file.read().strip())
+        # an account added or rotated since the keystore was read is only found after a reload
+        try:
+            return self.keystore.get(key_file)
+        except (KeyError, InvalidToken):
+            self.keystore.reload()
+            return self.keystore.get(key_file)
+
+    # an account deleted or rotated in the keystore must stop answering at once, not when its cached key expires: the
+    # keystore is stat'ed on every request and, when it changed, reloaded and every account whose entry moved is evicted
+    def refresh(self):
+        if self.keystore is None:
+            return
+        st = os.stat(self.keystore.path)
+        version = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if version == self.keystore_version:
+            return
+        before = dict(self.keystore.index)
+        self.keystore.reload()
+        self.keystore_version = version
+        for key_file in list(self.keys):
+            if self.keystore.index.get(key_file) != before.get(key_file):
+                self.evict(key_file)
+
+    def evict(self, key_file):
+        secret, _ = self.keys.pop(key_file)
+        secret[:] = bytes(len(secret))
+        self.engine.remove(key_file)
+
+    def expire(self):
+        now = time.monotonic()
+        for key_file in [key_file for key_file, (_, expires) in self.keys.items() if expires <= now]:
+            self.evict(key_file)
+
+    def clear(self):
+        for key_file in list(self.keys):
+            self.evict(key_file)
+
+# (key file, time step) pairs already used; steps that fell out of every window are forgotten
+class ReplayGuard:
+    def __init__(self):
+        self.used = {}
+
+    # True the first time a step is used for a key file, False after
+    def use(self, key_file, counter):
+        used = self.used.setdefault(key_file, set())
+        if counter in used:
+            return False
+        used.add(counter)
+        return True
+
+    def forget_before(self, counter):
+        for key_file in list(self.used):
+            self.used[key_file] = {used for used in self.used[key_file] if used >= counter}
+            if not self.used[key_file]:
+                del self.used[key_file]
+
+class TotpDaemon:
+    def __init__(self, seed, ttl=KEY_TTL, max_keys=MAX_KEYS, window=WINDOW, keystore=None):
+        self.engine = TotpEngine()
+        self.cache = KeyCache(seed, self.engine, ttl, max_keys, keystore)
+        self.replays = ReplayGuard()
+        self.window = window
+
+    def handle(self, line):
+        try:
+            command, *words = line.split()
+        except ValueError:
+            return "ERR empty request"
+        try:
+            if command == "generate" and len(words) == 1:
+                self.cache.load(words[0])
+                return f"OK {self.engine.format(self.engine.now(words[0]))}"
+            if command == "verify" and len(words) == 2:
+                return self.verify(*words)
+        except Exception as e:
+            return f"ERR {e or type(e).__name__}"
+        return "ERR usage: generate KEY_FILE | verify KEY_FILE CODE"
+
+    def verify(self, key_file, code):
+        self.cache.load(key_file)
+        at = time.time()
+        offset = self.engine.verify(key_file, code, at, self.window)
+        if offset is None:
+            return "INVALID"
+        if not self.replays.use(key_file, time_counter(at, self.engine.time_step) + offset):
+            return "REPLAY"
+        return f"OK {offset:+d}"
+
+    async def serve_client(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                writer.write((self.handle(line.decode(errors="replace")) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        except ValueError:
+            # a line over the stream's 64 KiB limit can't be read past: the client is told why and disconnected
+            try:
+                writer.write(b"ERR request too long\n")
+                await writer.drain()
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    # drops expired keys and used time steps once per time step
+    async def housekeeping(self):
+        while True:
+            await asyncio.sleep(self.engine.time_step)
+            self.cache.expire()
+            self.replays.forget_before(time_counter(None, self.engine.time_step) - self.window)
+
+    async def serve(self, socket_path, started=None):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        old_umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self.serve_client, socket_path)
+        finally:
+            os.umask(old_umask)
+        housekeeping = asyncio.ensure_future(self.housekeeping())
+        if started is not None:
+            started.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            housekeeping.cancel()
+            self.cache.clear()
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+# minimal blocking client, one connection for many requests
+class TotpClient:
+    def __init__(self, socket_path=SOCKET_PATH):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.file = self.sock.makefile("rwb")
+
+    def request(self, line):
+        self.file.write(line.encode() + b"\n")
+        self.file.flush()
+        return self.file.readline().decode().rstrip("\n")
+
+    def generate(self, key_file):
+        return self.request(f"generate {key_file}")
+
+    def verify(self, key_file, code):
+        return self.request(f"verify {key_file} {code}")
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+# serves until interrupted or sent SIGTERM, then wipes the cached keys and removes the socket
+def run_daemon(daemon, socket_path):
+    async def run():
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        await daemon.serve(socket_path)
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve TOTP generation and verification on a Unix socket.")
+    parser.add_argument("--socket", default=SOCKET_PATH, help=f"Path of the Unix socket (default: {SOCKET_PATH}).")
+    parser.add_argument("--seed", default="seed.key", help="File holding the seed the keys are encrypted with (default: seed.key).")
+    parser.add_argument("--ttl", type=float, default=KEY_TTL, help=f"Seconds a decrypted key stays cached (default: {KEY_TTL}).")
+    parser.add_argument("--max-keys", type=int, default=MAX_KEYS, help=f"Decrypted keys kept at most (default: {MAX_KEYS}).")
+    parser.add_argument("--keystore", metavar="FILE", help="Serve the accounts of this keystore instead of key files.")
+    parser.add_argument("--window", type=int, default=WINDOW, help=f"Time steps accepted on each side of the current one (default: {WINDOW}).")
+    args = parser.parse_args()
+
+    with open(args.seed, "rb") as file:
+        seed = file.read()
+    keystore = Keystore(args.keystore, seed, readonly=True) if args.keystore else None
+    print(f"Serving TOTP requests on {args.socket}")
+    try:
+        run_daemon(TotpDaemon(seed, args.ttl, args.max_keys, args.window, keystore), args.socket)
+    finally:
+        if keystore is not None:
+            keystore.close()
+
+if __name__ == "__main__":
+    main()
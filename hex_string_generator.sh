@@ -1 +0,0 @@
-openssl rand -hex 64 > key.hex